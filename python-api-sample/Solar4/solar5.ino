@@ -132,8 +132,96 @@ const int SOLENOID_UNLOCKED = LOW;   // Change to HIGH if your solenoids unlock
 // UV light configuration (phone slots 7-12)
 const int UV_LIGHT_ON = LOW;   // Change to LOW if your UV lights turn on with LOW signal
 const int UV_LIGHT_OFF = HIGH;   // Change to HIGH if your UV lights turn off with HIGH signal
+
+// Charging current sensors (ACS712-5A) per slot, on the analog inputs the
+// secure bays leave free (A0-A5 drive slots 4-6). Slots without a sensor
+// report null.
+const int CURRENT_SENSE_PINS[TOTAL_SLOTS + 1] = {
+  UNUSED_PIN, // index 0 unused
+  UNUSED_PIN, UNUSED_PIN, UNUSED_PIN, // Slots 1-3
+  UNUSED_PIN, UNUSED_PIN, UNUSED_PIN, // Slots 4-6
+  A6, A7, A8, A9, A10, A11,           // Slots 7-12 (Phone)
+  A12, A13, A14,                      // Slots 13-15 (Laptop)
+  UNUSED_PIN                          // Slot 16
+};
+const float CURRENT_SENSOR_MV_PER_A = 185.0;  // ACS712-5A; 100 for -20A, 66 for -30A
+const int CURRENT_SENSOR_ZERO = 512;          // analogRead() at 0 A (VCC/2)
+
+// Solar/battery bus voltage through a divider (0-25 V sensor module = 5:1)
+const int BUS_VOLTAGE_PIN = A15;
+const float BUS_VOLTAGE_DIVIDER = 5.0;
 // ===================================
 
+// BATCH applies up to MAX_BATCH_OPS actuator operations from one line, e.g.
+// {"command":"BATCH","data":{"ops":[["RELAY",1,false],["UV_LIGHT",7,false]]},"seq":5}
+// The JSON document must be large enough to hold a full batch.
+constexpr int MAX_BATCH_OPS = 16;
+constexpr size_t COMMAND_DOC_SIZE = 768;
+constexpr unsigned long TEMP_UNLOCK_MS = 2000;
+
+// millis() at which each slot's solenoid re-locks (0 = no relock pending).
+// Timed unlocks never delay(): loop() re-locks once the deadline passes, so
+// serial commands and coins keep being served meanwhile. The Python bridge
+// sends timed unlocks as SOLENOID with a "duration" (or as UNLOCK_TEMP) and
+// sends its own re-lock when the time is up; these deadlines are the
+// failsafe that locks the door even if the bridge crashes or the serial
+// link drops.
+unsigned long relockAt[TOTAL_SLOTS + 1] = {0};
+
+// Telemetry: the sensors are read every TELEMETRY_SAMPLE_MS and their
+// average pushed every telemetryIntervalMs as
+// {"telemetry":{"v":busMillivolts,"i":[milliamps per slot, null = no sensor]}}
+// Off until TELEMETRY {"interval": ms} turns it on (the bridge does when
+// TELEMETRY_INTERVAL_MS is set); 0 stops the pushes again.
+constexpr unsigned long TELEMETRY_SAMPLE_MS = 100;
+constexpr unsigned long MIN_TELEMETRY_INTERVAL_MS = 250;
+unsigned long telemetryIntervalMs = 0;
+unsigned long lastTelemetrySample = 0;
+unsigned long lastTelemetryPush = 0;
+long currentSenseSum[TOTAL_SLOTS + 1] = {0};
+long busVoltageSum = 0;
+int telemetrySamples = 0;
+
+// Sequence id of the command being processed (-1 = none).
+// Every reply and status line for a command echoes it so the Python bridge
+// can route the line to the right caller. Unsolicited lines carry no seq.
+long currentSeq = -1;
+
+// True while a fingerprint command is using the AS608 sensor
+bool sensorBusy = false;
+
+// Set by SENSOR_CANCEL while a fingerprint command waits for a finger; the
+// command then gives up at once and frees the sensor
+bool sensorCancelled = false;
+
+// Optional compact binary frames for RELAY/SOLENOID/UV_LIGHT/READ_COIN:
+//   0xFE | length | opcode, seq (2 bytes LE), args... | CRC-8 of length+payload
+// 0xFE never appears in UTF-8 text, so frames and JSON lines share the port.
+// Replies use opcode | 0x80. Everything else stays JSON. SOLENOID carries
+// slot, lock and a uint16 duration in seconds.
+constexpr uint8_t FRAME_START = 0xFE;
+constexpr uint8_t MAX_FRAME_PAYLOAD = 32;
+constexpr uint8_t FRAME_REPLY_FLAG = 0x80;
+constexpr uint8_t OP_RELAY = 0x01;
+constexpr uint8_t OP_SOLENOID = 0x02;
+constexpr uint8_t OP_UV_LIGHT = 0x03;
+constexpr uint8_t OP_READ_COIN = 0x04;
+constexpr uint8_t FRAME_OK = 0;
+constexpr uint8_t FRAME_UNSUPPORTED_SLOT = 1;
+
+// Opcode of the binary command being processed (0 = JSON command).
+// While set, sendJson answers with a binary reply frame instead.
+uint8_t replyOpcode = 0;
+
+// LINK_UPGRADE switches to a faster baud rate after replying; if nothing
+// valid arrives at the new rate in time, fall back to the old one
+constexpr long SERIAL_BAUD_RATE = 9600;
+constexpr unsigned long LINK_UPGRADE_TIMEOUT_MS = 2000;
+long currentBaudRate = SERIAL_BAUD_RATE;
+long previousBaudRate = SERIAL_BAUD_RATE;
+bool linkUpgradePending = false;
+unsigned long linkUpgradeStartedAt = 0;
+
 volatile int coinPulseCount = 0;
 float coinValue = 0.0;
 unsigned long coinDetectedTime = 0;
@@ -173,7 +261,7 @@ float resolveCoinValueFromPulses(int normalizedPulses) {
 }
 
 void setup() {
-  Serial.begin(9600);
+  Serial.begin(SERIAL_BAUD_RATE);
   
   // Initialize relay pins
   // Use configuration constants for relay behavior
@@ -249,27 +337,128 @@ void setup() {
 
 void loop() {
   if (Serial.available() > 0) {
-    String jsonString = Serial.readStringUntil('\n');
-    processCommand(jsonString);
+    serviceSerialInput();
   }
   
+  checkLinkUpgrade();
+  serviceRelocks();
+  serviceTelemetry();
+  
   // Check for coin detection
   if (coinPulseCount > 0) {
     processCoinPulse();
   }
 }
 
+// Re-lock every slot whose timed unlock has run out
+void serviceRelocks() {
+  unsigned long now = millis();
+  for (int slot = 1; slot <= TOTAL_SLOTS; slot++) {
+    if (relockAt[slot] != 0 && (long)(now - relockAt[slot]) >= 0) {
+      relockAt[slot] = 0;
+      digitalWrite(getSolenoidPin(slot), SOLENOID_LOCKED);
+    }
+  }
+}
+
+// Sample the current/voltage sensors and push their averages when due
+void serviceTelemetry() {
+  unsigned long now = millis();
+  if (telemetryIntervalMs == 0 || now - lastTelemetrySample < TELEMETRY_SAMPLE_MS) {
+    return;
+  }
+  lastTelemetrySample = now;
+  
+  for (int slot = 1; slot <= TOTAL_SLOTS; slot++) {
+    if (CURRENT_SENSE_PINS[slot] != UNUSED_PIN) {
+      currentSenseSum[slot] += analogRead(CURRENT_SENSE_PINS[slot]);
+    }
+  }
+  busVoltageSum += analogRead(BUS_VOLTAGE_PIN);
+  telemetrySamples++;
+  
+  if (now - lastTelemetryPush >= telemetryIntervalMs) {
+    lastTelemetryPush = now;
+    pushTelemetry();
+  }
+}
+
+// Printed by hand: 16 readings would need a large JsonDocument
+void pushTelemetry() {
+  const float mvPerStep = 5000.0 / 1023.0;
+  long busMillivolts = lround(busVoltageSum * mvPerStep * BUS_VOLTAGE_DIVIDER / telemetrySamples);
+  
+  Serial.print("{\"telemetry\":{\"v\":");
+  Serial.print(busMillivolts);
+  Serial.print(",\"i\":[");
+  for (int slot = 1; slot <= TOTAL_SLOTS; slot++) {
+    if (slot > 1) {
+      Serial.print(',');
+    }
+    if (CURRENT_SENSE_PINS[slot] == UNUSED_PIN) {
+      Serial.print("null");
+    } else {
+      float steps = (float)currentSenseSum[slot] / telemetrySamples - CURRENT_SENSOR_ZERO;
+      Serial.print(lround(steps * mvPerStep * 1000.0 / CURRENT_SENSOR_MV_PER_A));
+    }
+    currentSenseSum[slot] = 0;
+  }
+  Serial.println("]}}");
+  
+  busVoltageSum = 0;
+  telemetrySamples = 0;
+}
+
+void handleTelemetry(JsonObject data) {
+  unsigned long interval = data["interval"] | 1000UL;
+  if (interval != 0 && interval < MIN_TELEMETRY_INTERVAL_MS) {
+    interval = MIN_TELEMETRY_INTERVAL_MS;
+  }
+  telemetryIntervalMs = interval;
+  sendResponse(true, interval == 0 ? "Telemetry off" : "Telemetry interval set");
+}
+
+// Unlock a slot now and re-lock it after `ms` (see relockAt)
+void unlockFor(int slot, unsigned long ms) {
+  digitalWrite(getSolenoidPin(slot), SOLENOID_UNLOCKED);
+  relockAt[slot] = (millis() + ms) | 1;  // Never 0, which means "none"
+}
+
 void processCommand(String jsonString) {
-  StaticJsonDocument<200> doc;
+  StaticJsonDocument<COMMAND_DOC_SIZE> doc;
   DeserializationError error = deserializeJson(doc, jsonString);
   
+  // Commands can nest while a fingerprint job waits on the sensor,
+  // so restore the outer command's seq when this one is done
+  long previousSeq = currentSeq;
+  uint8_t previousOpcode = replyOpcode;
+  replyOpcode = 0;
+  
   if (error) {
+    currentSeq = -1;
     sendResponse(false, "Invalid JSON");
+    currentSeq = previousSeq;
+    replyOpcode = previousOpcode;
     return;
   }
   
   String command = doc["command"];
   JsonObject data = doc["data"];
+  currentSeq = doc["seq"] | -1L;
+  linkUpgradePending = false;  // A valid line arrived at the current rate
+  
+  // Only one fingerprint job can use the AS608 at a time
+  bool isSensorCommand = command.startsWith("FINGERPRINT_");
+  if (isSensorCommand && sensorBusy) {
+    sendResponse(false, "Fingerprint sensor busy");
+    currentSeq = previousSeq;
+    replyOpcode = previousOpcode;
+    return;
+  }
+  if (isSensorCommand) {
+    sensorBusy = true;
+    sensorCancelled = false;
+  }
   
   if (command == "RELAY") {
     handleRelay(data);
@@ -279,6 +468,8 @@ void processCommand(String jsonString) {
     handleUVLight(data);
   } else if (command == "FINGERPRINT_VERIFY") {
     handleFingerprintVerify(data);
+  } else if (command == "FINGERPRINT_IDENTIFY") {
+    handleFingerprintIdentify();
   } else if (command == "FINGERPRINT_ENROLL") {
     handleFingerprintEnroll(data);
   } else if (command == "READ_COIN") {
@@ -287,9 +478,189 @@ void processCommand(String jsonString) {
     handleUnlockTemp(data);
   } else if (command == "FINGERPRINT_DELETE") {
     handleFingerprintDelete(data);
+  } else if (command == "FINGERPRINT_DELETE_RANGE") {
+    handleFingerprintDeleteRange(data);
+  } else if (command == "FINGERPRINT_EMPTY") {
+    handleFingerprintEmpty();
+  } else if (command == "BATCH") {
+    handleBatch(data["ops"]);
+  } else if (command == "LINK_UPGRADE") {
+    handleLinkUpgrade(data);
+  } else if (command == "SENSOR_CANCEL") {
+    handleSensorCancel();
+  } else if (command == "TELEMETRY") {
+    handleTelemetry(data);
+  } else if (command == "PING") {
+    sendResponse(true, "pong");
   } else {
     sendResponse(false, "Unknown command");
   }
+  
+  if (isSensorCommand) {
+    sensorBusy = false;
+  }
+  currentSeq = previousSeq;
+  replyOpcode = previousOpcode;
+}
+
+// Wait while a fingerprint job polls the sensor, but keep serving
+// relay/solenoid/UV/coin commands and coin pulses in the meantime
+void waitServicingSerial(unsigned long ms) {
+  unsigned long start = millis();
+  do {
+    if (Serial.available() > 0) {
+      serviceSerialInput();
+    }
+    if (coinPulseCount > 0) {
+      // Coin pushes are unsolicited; they must not carry the job's seq
+      long jobSeq = currentSeq;
+      currentSeq = -1;
+      processCoinPulse();
+      currentSeq = jobSeq;
+    }
+    serviceRelocks();
+    serviceTelemetry();  // Printed without a seq
+  } while (millis() - start < ms);
+}
+
+// Read one binary frame or JSON line, whichever comes next
+void serviceSerialInput() {
+  if (Serial.peek() == FRAME_START) {
+    processFrame();
+  } else {
+    String jsonString = Serial.readStringUntil('\n');
+    processCommand(jsonString);
+  }
+}
+
+uint8_t crc8(uint8_t length, const uint8_t* payload) {
+  uint8_t crc = 0;
+  for (int i = -1; i < length; i++) {
+    crc ^= i < 0 ? length : payload[i];
+    for (int bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+// Decode a binary frame and run it through the regular JSON handlers.
+// Corrupt frames are dropped silently; the bridge times the command out.
+void processFrame() {
+  uint8_t header[2];
+  uint8_t payload[MAX_FRAME_PAYLOAD];
+  uint8_t checksum;
+  
+  if (Serial.readBytes(header, 2) < 2) {
+    return;
+  }
+  uint8_t length = header[1];
+  if (length < 3 || length > MAX_FRAME_PAYLOAD) {
+    return;
+  }
+  if (Serial.readBytes(payload, length) < length || Serial.readBytes(&checksum, 1) < 1) {
+    return;
+  }
+  if (crc8(length, payload) != checksum) {
+    return;
+  }
+  linkUpgradePending = false;
+  
+  long previousSeq = currentSeq;
+  uint8_t previousOpcode = replyOpcode;
+  uint8_t opcode = payload[0];
+  currentSeq = payload[1] | ((long)payload[2] << 8);
+  replyOpcode = opcode;
+  
+  StaticJsonDocument<64> doc;
+  JsonObject data = doc.to<JsonObject>();
+  
+  if (opcode == OP_RELAY && length >= 5) {
+    data["slot"] = payload[3];
+    data["state"] = payload[4] != 0;
+    handleRelay(data);
+  } else if (opcode == OP_SOLENOID && length >= 7) {
+    data["slot"] = payload[3];
+    data["lock"] = payload[4] != 0;
+    data["duration"] = payload[5] | ((long)payload[6] << 8);
+    handleSolenoid(data);
+  } else if (opcode == OP_UV_LIGHT && length >= 5) {
+    data["slot"] = payload[3];
+    data["state"] = payload[4] != 0;
+    handleUVLight(data);
+  } else if (opcode == OP_READ_COIN) {
+    handleReadCoin();
+  }
+  
+  replyOpcode = previousOpcode;
+  currentSeq = previousSeq;
+}
+
+// Reply to a binary command with the fields the bridge needs from doc
+void sendFrameReply(JsonDocument& doc) {
+  uint8_t payload[10];
+  uint8_t length = 4;
+  
+  payload[0] = replyOpcode | FRAME_REPLY_FLAG;
+  payload[1] = currentSeq & 0xFF;
+  payload[2] = (currentSeq >> 8) & 0xFF;
+  payload[3] = doc["success"] ? FRAME_OK : FRAME_UNSUPPORTED_SLOT;
+  
+  if (replyOpcode == OP_READ_COIN) {
+    uint16_t centavos = (uint16_t)(doc["value"].as<float>() * 100 + 0.5);
+    uint32_t timestamp = doc["timestamp"] | 0UL;
+    payload[4] = centavos & 0xFF;
+    payload[5] = centavos >> 8;
+    for (int i = 0; i < 4; i++) {
+      payload[6 + i] = (timestamp >> (8 * i)) & 0xFF;
+    }
+    length = 10;
+  }
+  
+  Serial.write(FRAME_START);
+  Serial.write(length);
+  Serial.write(payload, length);
+  Serial.write(crc8(length, payload));
+}
+
+bool isSupportedBaudRate(long baud) {
+  return baud == 9600 || baud == 19200 || baud == 38400 || baud == 57600 || baud == 115200;
+}
+
+// {"command":"LINK_UPGRADE","data":{"baud":115200,"binary":true}}
+// Replies at the current rate, then switches. The bridge confirms with a
+// PING at the new rate; checkLinkUpgrade reverts if that never arrives.
+void handleLinkUpgrade(JsonObject data) {
+  long baud = data["baud"] | currentBaudRate;
+  if (!isSupportedBaudRate(baud)) {
+    sendResponse(false, "Unsupported baud rate");
+    return;
+  }
+  
+  StaticJsonDocument<100> doc;
+  doc["success"] = true;
+  doc["baud"] = baud;
+  doc["binary"] = data["binary"] | false;
+  sendJson(doc);
+  
+  if (baud != currentBaudRate) {
+    Serial.flush();  // Let the reply go out at the old rate
+    Serial.end();
+    Serial.begin(baud);
+    previousBaudRate = currentBaudRate;
+    currentBaudRate = baud;
+    linkUpgradePending = true;
+    linkUpgradeStartedAt = millis();
+  }
+}
+
+void checkLinkUpgrade() {
+  if (linkUpgradePending && millis() - linkUpgradeStartedAt > LINK_UPGRADE_TIMEOUT_MS) {
+    Serial.end();
+    Serial.begin(previousBaudRate);
+    currentBaudRate = previousBaudRate;
+    linkUpgradePending = false;
+  }
 }
 
 void handleRelay(JsonObject data) {
@@ -310,7 +681,7 @@ void handleRelay(JsonObject data) {
 void handleSolenoid(JsonObject data) {
   int slot = data["slot"];
   bool lock = data["lock"];
-  int duration = data["duration"] | 0; // Get duration in seconds, default 0 (permanent)
+  long duration = data["duration"] | 0L; // Get duration in seconds, default 0 (permanent)
   
   int solenoidPin = getSolenoidPin(slot);
   if (solenoidPin == UNUSED_PIN) {
@@ -318,17 +689,17 @@ void handleSolenoid(JsonObject data) {
     return;
   }
 
-  // Use configuration constants for lock/unlock behavior
-  digitalWrite(solenoidPin, lock ? SOLENOID_LOCKED : SOLENOID_UNLOCKED);
-  
-  // If duration is specified, wait and then return to locked state
+  // If duration is specified, unlock now; loop() re-locks when it runs out
   if (duration > 0 && !lock) {
-    delay(duration * 1000); // Convert seconds to milliseconds
-    digitalWrite(solenoidPin, SOLENOID_LOCKED); // Return to locked state
-    sendResponse(true, "Solenoid timed unlock completed");
-  } else {
-    sendResponse(true, "Solenoid controlled");
+    unlockFor(slot, duration * 1000UL); // Convert seconds to milliseconds
+    sendResponse(true, "Solenoid timed unlock started");
+    return;
   }
+  
+  // Use configuration constants for lock/unlock behavior
+  relockAt[slot] = 0;  // An explicit command replaces any timed unlock
+  digitalWrite(solenoidPin, lock ? SOLENOID_LOCKED : SOLENOID_UNLOCKED);
+  sendResponse(true, "Solenoid controlled");
 }
 
 void handleUVLight(JsonObject data) {
@@ -349,15 +720,20 @@ void handleUVLight(JsonObject data) {
 void handleFingerprintVerify(JsonObject data) {
   int expectedId = data["id"];
   
-  Serial.println("{\"status\":\"Waiting for finger on AS608 sensor...\"}");
+  sendStatus("Waiting for finger on AS608 sensor...");
   
   // Wait for finger with timeout
   unsigned long timeout = millis() + 5000; // 5 second timeout
   int p = -1;
   
-  while (p != FINGERPRINT_OK && millis() < timeout) {
+  while (p != FINGERPRINT_OK && millis() < timeout && !sensorCancelled) {
     p = finger.getImage();
-    delay(50);
+    waitServicingSerial(50);
+  }
+  
+  if (sensorCancelled) {
+    sendCancelled();
+    return;
   }
   
   if (p != FINGERPRINT_OK) {
@@ -366,9 +742,7 @@ void handleFingerprintVerify(JsonObject data) {
     doc["isValid"] = false;
     doc["error"] = "No finger detected or timeout";
     
-    String response;
-    serializeJson(doc, response);
-    Serial.println(response);
+    sendJson(doc);
     return;
   }
   
@@ -380,9 +754,7 @@ void handleFingerprintVerify(JsonObject data) {
     doc["isValid"] = false;
     doc["error"] = "Image conversion failed";
     
-    String response;
-    serializeJson(doc, response);
-    Serial.println(response);
+    sendJson(doc);
     return;
   }
   
@@ -402,9 +774,7 @@ void handleFingerprintVerify(JsonObject data) {
       doc["confidence"] = finger.confidence;
       doc["matchScore"] = finger.confidence;
       
-      String response;
-      serializeJson(doc, response);
-      Serial.println(response);
+      sendJson(doc);
     } else {
       // Wrong fingerprint matched!
       StaticJsonDocument<150> doc;
@@ -415,9 +785,7 @@ void handleFingerprintVerify(JsonObject data) {
       doc["expectedId"] = expectedId;
       doc["confidence"] = finger.confidence;
       
-      String response;
-      serializeJson(doc, response);
-      Serial.println(response);
+      sendJson(doc);
     }
   } else {
     // No match in database
@@ -433,35 +801,82 @@ void handleFingerprintVerify(JsonObject data) {
       doc["error"] = "Verification failed";
     }
     
-    String response;
-    serializeJson(doc, response);
-    Serial.println(response);
+    sendJson(doc);
+  }
+}
+
+// One-to-many search: which enrolled finger is this? The bridge maps the
+// ID to its slot, so the user does not pick a slot before scanning
+void handleFingerprintIdentify() {
+  sendStatus("Waiting for finger on AS608 sensor...");
+  
+  unsigned long timeout = millis() + 5000; // 5 second timeout
+  int p = -1;
+  
+  while (p != FINGERPRINT_OK && millis() < timeout && !sensorCancelled) {
+    p = finger.getImage();
+    waitServicingSerial(50);
+  }
+  
+  if (sensorCancelled) {
+    sendCancelled();
+    return;
+  }
+  
+  StaticJsonDocument<150> doc;
+  doc["success"] = true;
+  doc["found"] = false;
+  
+  if (p != FINGERPRINT_OK) {
+    doc["error"] = "No finger detected or timeout";
+  } else if (finger.image2Tz() != FINGERPRINT_OK) {
+    doc["error"] = "Image conversion failed";
+  } else {
+    p = finger.fingerFastSearch();
+    if (p == FINGERPRINT_OK) {
+      doc["found"] = true;
+      doc["fingerprintId"] = finger.fingerID;
+      doc["confidence"] = finger.confidence;
+    } else if (p == FINGERPRINT_NOTFOUND) {
+      doc["error"] = "No match found in database";
+    } else if (p == FINGERPRINT_PACKETRECIEVEERR) {
+      doc["error"] = "Communication error";
+    } else {
+      doc["error"] = "Identification failed";
+    }
   }
+  
+  sendJson(doc);
 }
 
 void handleFingerprintEnroll(JsonObject data) {
   int fingerprintId = data["userId"];
   int p = -1;
   
-  Serial.println("{\"status\":\"Starting AS608 fingerprint enrollment...\"}");
+  sendStatus("Starting AS608 fingerprint enrollment...");
   
   // Step 0: Delete existing fingerprint if it exists (auto-cleanup)
-  Serial.println("{\"status\":\"Checking for existing fingerprint...\"}");
+  sendStatus("Checking for existing fingerprint...");
   uint8_t deleteResult = finger.deleteModel(fingerprintId);
   if (deleteResult == FINGERPRINT_OK) {
-    Serial.println("{\"status\":\"Deleted existing fingerprint - ready for re-enrollment\"}");
+    sendStatus("Deleted existing fingerprint - ready for re-enrollment");
   } else {
-    Serial.println("{\"status\":\"No existing fingerprint found - proceeding with enrollment\"}");
+    sendStatus("No existing fingerprint found - proceeding with enrollment");
   }
   
   // Step 1: Get first image
-  Serial.println("{\"status\":\"Place finger on sensor\"}");
+  sendStatus("Place finger on sensor");
   
   unsigned long timeout = millis() + 10000; // 10 second timeout
   p = -1;
-  while (p != FINGERPRINT_OK && millis() < timeout) {
+  while (p != FINGERPRINT_OK && millis() < timeout && !sensorCancelled) {
     p = finger.getImage();
-    delay(50);
+    waitServicingSerial(50);
+  }
+  
+  if (sensorCancelled) {
+    sendCancelled();
+    return;
   }
   
   if (p != FINGERPRINT_OK) {
@@ -486,23 +901,28 @@ void handleFingerprintEnroll(JsonObject data) {
   }
   
   // Step 2: Remove finger
-  Serial.println("{\"status\":\"Remove finger\"}");
-  delay(2000);
+  sendStatus("Remove finger");
+  waitServicingSerial(2000);
   
   // Wait for finger removal (with timeout)
   timeout = millis() + 5000;
-  while (finger.getImage() != FINGERPRINT_NOFINGER && millis() < timeout) {
-    delay(50);
+  while (finger.getImage() != FINGERPRINT_NOFINGER && millis() < timeout && !sensorCancelled) {
+    waitServicingSerial(50);
   }
   
   // Step 3: Get second image
-  Serial.println("{\"status\":\"Place same finger again\"}");
+  sendStatus("Place same finger again");
   
   timeout = millis() + 10000;
   p = -1;
-  while (p != FINGERPRINT_OK && millis() < timeout) {
+  while (p != FINGERPRINT_OK && millis() < timeout && !sensorCancelled) {
     p = finger.getImage();
-    delay(50);
+    waitServicingSerial(50);
+  }
+  
+  if (sensorCancelled) {
+    sendCancelled();
+    return;
   }
   
   if (p != FINGERPRINT_OK) {
@@ -527,7 +947,7 @@ void handleFingerprintEnroll(JsonObject data) {
   }
   
   // Step 4: Create model from both templates
-  Serial.println("{\"status\":\"Creating fingerprint template...\"}");
+  sendStatus("Creating fingerprint template...");
   
   p = finger.createModel();
   if (p != FINGERPRINT_OK) {
@@ -540,7 +960,7 @@ void handleFingerprintEnroll(JsonObject data) {
   }
   
   // Step 5: Store model in AS608 memory
-  Serial.println("{\"status\":\"Storing fingerprint...\"}");
+  sendStatus("Storing fingerprint...");
   
   p = finger.storeModel(fingerprintId);
   if (p == FINGERPRINT_OK) {
@@ -550,9 +970,7 @@ void handleFingerprintEnroll(JsonObject data) {
     doc["message"] = "Fingerprint enrolled successfully";
     doc["fingerprintId"] = fingerprintId;
     
-    String response;
-    serializeJson(doc, response);
-    Serial.println(response);
+    sendJson(doc);
   } else {
     // Enhanced error messages with troubleshooting hints
     StaticJsonDocument<150> doc;
@@ -572,9 +990,7 @@ void handleFingerprintEnroll(JsonObject data) {
       doc["errorCode"] = p;
     }
     
-    String response;
-    serializeJson(doc, response);
-    Serial.println(response);
+    sendJson(doc);
   }
 }
 
@@ -599,9 +1015,7 @@ void handleReadCoin() {
     doc["value"] = 0.0;
   }
   
-  String response;
-  serializeJson(doc, response);
-  Serial.println(response);
+  sendJson(doc);
   
   // Clear coin value after the configured delay to be ready for the next coin
   if (coinValue > 0 && (currentTime - detectionTimeSnapshot > COIN_CLEAR_DELAY_MS)) {
@@ -654,9 +1068,7 @@ void processCoinPulse() {
       doc["pulses"] = pulsesSnapshot;
       doc["timestamp"] = currentTime;
       
-      String response;
-      serializeJson(doc, response);
-      Serial.println(response);
+      sendJson(doc);
       
       coinDetectedTime = currentTime;
       coinProcessed = false; // Ready to be read by API
@@ -667,9 +1079,7 @@ void processCoinPulse() {
       doc["pulses"] = pulsesSnapshot;
       doc["timestamp"] = currentTime;
       
-      String response;
-      serializeJson(doc, response);
-      Serial.println(response);
+      sendJson(doc);
     }
     
     // Reset counter
@@ -688,17 +1098,85 @@ void handleUnlockTemp(JsonObject data) {
     return;
   }
 
-  // Send unlock signal for 2 seconds using configuration constants
-  digitalWrite(solenoidPin, SOLENOID_UNLOCKED);
-  delay(2000);  // Hold unlock for 2 seconds
-  digitalWrite(solenoidPin, SOLENOID_LOCKED); // Re-lock
-  sendResponse(true, "Temporary unlock completed");
+  // Unlock for 2 seconds; loop() re-locks
+  unlockFor(slot, TEMP_UNLOCK_MS);
+  sendResponse(true, "Temporary unlock started");
+}
+
+// Batch result codes, one per operation
+constexpr uint8_t BATCH_OK = 0;
+constexpr uint8_t BATCH_UNSUPPORTED_SLOT = 1;
+constexpr uint8_t BATCH_UNKNOWN_OP = 2;
+
+void handleBatch(JsonArray ops) {
+  if (ops.isNull() || ops.size() == 0) {
+    sendResponse(false, "Batch has no operations");
+    return;
+  }
+  if (ops.size() > MAX_BATCH_OPS) {
+    sendResponse(false, "Too many operations in batch");
+    return;
+  }
+  
+  uint8_t results[MAX_BATCH_OPS];
+  
+  for (size_t i = 0; i < ops.size(); i++) {
+    // Each operation is [name, slot, value]
+    JsonArray op = ops[i];
+    const char* name = op[0] | "";
+    int slot = op[1] | 0;
+    bool value = op[2] | false;
+    int pin = UNUSED_PIN;
+    
+    if (strcmp(name, "RELAY") == 0) {
+      pin = getRelayPin(slot);
+      if (pin != UNUSED_PIN) {
+        digitalWrite(pin, value ? RELAY_ON : RELAY_OFF);
+      }
+    } else if (strcmp(name, "SOLENOID") == 0) {
+      pin = getSolenoidPin(slot);
+      if (pin != UNUSED_PIN) {
+        relockAt[slot] = 0;
+        digitalWrite(pin, value ? SOLENOID_LOCKED : SOLENOID_UNLOCKED);
+      }
+    } else if (strcmp(name, "UV_LIGHT") == 0) {
+      pin = getUvLightPin(slot);
+      if (pin != UNUSED_PIN) {
+        digitalWrite(pin, value ? UV_LIGHT_ON : UV_LIGHT_OFF);
+      }
+    } else if (strcmp(name, "UNLOCK_TEMP") == 0) {
+      pin = getSolenoidPin(slot);
+      if (pin != UNUSED_PIN) {
+        unlockFor(slot, TEMP_UNLOCK_MS);
+      }
+    } else {
+      results[i] = BATCH_UNKNOWN_OP;
+      continue;
+    }
+    
+    results[i] = pin == UNUSED_PIN ? BATCH_UNSUPPORTED_SLOT : BATCH_OK;
+  }
+  
+  // Printed by hand to avoid a second large JsonDocument on the stack
+  Serial.print("{\"success\":true,\"results\":[");
+  for (size_t i = 0; i < ops.size(); i++) {
+    if (i > 0) {
+      Serial.print(',');
+    }
+    Serial.print(results[i]);
+  }
+  Serial.print(']');
+  if (currentSeq >= 0) {
+    Serial.print(",\"seq\":");
+    Serial.print(currentSeq);
+  }
+  Serial.println('}');
 }
 
 void handleFingerprintDelete(JsonObject data) {
   int fingerprintId = data["fingerprintId"];
   
-  Serial.println("{\"status\":\"Deleting fingerprint from AS608 sensor...\"}");
+  sendStatus("Deleting fingerprint from AS608 sensor...");
   
   // Delete fingerprint from AS608 sensor memory
   uint8_t p = finger.deleteModel(fingerprintId);
@@ -710,9 +1188,7 @@ void handleFingerprintDelete(JsonObject data) {
     doc["message"] = "Fingerprint deleted successfully";
     doc["fingerprintId"] = fingerprintId;
     
-    String response;
-    serializeJson(doc, response);
-    Serial.println(response);
+    sendJson(doc);
   } else if (p == FINGERPRINT_DELETEFAIL) {
     sendResponse(false, "Failed to delete fingerprint");
   } else {
@@ -720,12 +1196,100 @@ void handleFingerprintDelete(JsonObject data) {
   }
 }
 
+void handleFingerprintDeleteRange(JsonObject data) {
+  int firstId = data["from"] | 1;
+  int lastId = data["to"] | 127;
+  int total = lastId - firstId + 1;
+  int deletedCount = 0;
+  
+  for (int fingerprintId = firstId; fingerprintId <= lastId; fingerprintId++) {
+    if (finger.deleteModel(fingerprintId) == FINGERPRINT_OK) {
+      deletedCount++;
+    }
+    
+    int done = fingerprintId - firstId + 1;
+    if (done % 16 == 0 && done < total) {
+      StaticJsonDocument<100> doc;
+      doc["status"] = "Deleting fingerprints...";
+      doc["progress"] = done;
+      doc["total"] = total;
+      sendJson(doc);
+    }
+    
+    // Let relay/solenoid/coin commands through between deletes
+    waitServicingSerial(0);
+  }
+  
+  StaticJsonDocument<100> doc;
+  doc["success"] = true;
+  doc["message"] = "Fingerprint range deleted";
+  doc["deletedCount"] = deletedCount;
+  sendJson(doc);
+}
+
+void handleFingerprintEmpty() {
+  sendStatus("Clearing fingerprint database...");
+  
+  finger.getTemplateCount();
+  uint16_t enrolledCount = finger.templateCount;
+  
+  if (finger.emptyDatabase() == FINGERPRINT_OK) {
+    StaticJsonDocument<100> doc;
+    doc["success"] = true;
+    doc["message"] = "Fingerprint database cleared";
+    doc["deletedCount"] = enrolledCount;
+    sendJson(doc);
+  } else {
+    sendResponse(false, "Failed to clear fingerprint database");
+  }
+}
+
+// Runs from waitServicingSerial while a fingerprint command waits
+void handleSensorCancel() {
+  if (!sensorBusy) {
+    sendResponse(false, "No fingerprint job running");
+    return;
+  }
+  sensorCancelled = true;
+  sendResponse(true, "Cancelling");
+}
+
+// Final reply of a fingerprint command stopped by SENSOR_CANCEL
+void sendCancelled() {
+  StaticJsonDocument<100> doc;
+  doc["success"] = false;
+  doc["cancelled"] = true;
+  doc["message"] = "Cancelled";
+  doc["error"] = "Cancelled";
+  
+  sendJson(doc);
+}
+
 void sendResponse(bool success, const char* message) {
   StaticJsonDocument<100> doc;
   doc["success"] = success;
   doc["message"] = message;
   
+  sendJson(doc);
+}
+
+void sendStatus(const char* status) {
+  StaticJsonDocument<100> doc;
+  doc["status"] = status;
+  sendJson(doc);
+}
+
+void sendJson(JsonDocument& doc) {
+  if (replyOpcode != 0) {
+    sendFrameReply(doc);
+    return;
+  }
+  
+  if (currentSeq >= 0) {
+    doc["seq"] = currentSeq;
+  }
+  
   String response;
   serializeJson(doc, response);
   Serial.println(response);
-}
\ No newline at end of file
+}
@@ -0,0 +1,90 @@
+"""
+Batched actuator operations
+Turns a list of RELAY/SOLENOID/UV_LIGHT/UNLOCK_TEMP operations into
+firmware BATCH frames, and maps the per-operation result codes back.
+"""
+
+# Must match MAX_BATCH_OPS in solar5.ino; longer lists are split into frames
+MAX_OPS_PER_FRAME = 16
+
+BATCH_COMMANDS = ('RELAY', 'SOLENOID', 'UV_LIGHT', 'UNLOCK_TEMP')
+
+# Result codes sent back by the firmware, one per operation
+RESULT_MESSAGES = {
+    0: None,
+    1: 'Slot does not support this operation',
+    2: 'Unknown operation',
+}
+
+SUCCESS_MESSAGES = {
+    'RELAY': 'Relay controlled',
+    'SOLENOID': 'Solenoid controlled',
+    'UV_LIGHT': 'UV light controlled',
+    'UNLOCK_TEMP': 'Temporary unlock started',
+}
+
+
+class BatchError(ValueError):
+    """An operation in a batch request is malformed"""
+
+
+def parse_operation(operation):
+    """
+    Validate one API operation and return (command, slot, value)
+    Uses the same field names as the single-operation routes
+    """
+    if not isinstance(operation, dict):
+        raise BatchError('Each operation must be an object')
+
+    command = operation.get('command')
+    if command not in BATCH_COMMANDS:
+        raise BatchError(f"Unsupported command: {command}")
+
+    slot = operation.get('slotNumber')
+    if not isinstance(slot, int):
+        raise BatchError(f"{command} needs an integer slotNumber")
+
+    if command == 'SOLENOID':
+        value = bool(operation.get('locked'))
+    elif command == 'UNLOCK_TEMP':
+        value = False
+    else:
+        value = bool(operation.get('state'))
+
+    return command, slot, value
+
+
+def split_frames(operations):
+    """Split parsed operations into groups that fit one BATCH frame"""
+    return [operations[i:i + MAX_OPS_PER_FRAME]
+            for i in range(0, len(operations), MAX_OPS_PER_FRAME)]
+
+
+def encode_frame(operations):
+    """BATCH payload for one frame of parsed operations"""
+    return {'ops': [[command, slot, value] for command, slot, value in operations]}
+
+
+def decode_results(operations, reply):
+    """Pair each operation with its result from a BATCH reply"""
+    codes = reply.get('results') if reply.get('success') else None
+    if reply.get('simulated'):
+        codes = [0] * len(operations)
+
+    results = []
+    for index, (command, slot, value) in enumerate(operations):
+        if codes is None or index >= len(codes):
+            success = False
+            message = reply.get('error') or reply.get('message') or 'No result from Arduino'
+        else:
+            success = codes[index] == 0
+            message = RESULT_MESSAGES.get(codes[index], 'Unknown result') or SUCCESS_MESSAGES[command]
+
+        results.append({
+            'command': command,
+            'slotNumber': slot,
+            'value': value,
+            'success': success,
+            'message': message,
+        })
+    return results
@@ -3,272 +3,910 @@ Solar Charging Station - Python API Bridge
 Communicates between Blazor app and Arduino Mega
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-import serial
+import asyncio
+import atexit
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import json
+import logging
+import math
+import os
+import threading
 import time
 
+from actuator_batch import BatchError, decode_results, encode_frame, parse_operation, split_frames
+from charging_sessions import ChargingSessions
+from coin_events import CoinEventHub
+from coin_ledger import CoinLedger
+from command_scheduler import DeadlineExceeded
+from fingerprint_index import FingerprintIndex
+from board_set import BoardSet, parse_boards
+from bridge_log import SerialTrafficLog, dropped_records, setup_logging
+from jobs import CANCELLED, FAILED, SUCCEEDED, JobRegistry
+import metrics
+import profiling
+from serial_broker import (BrokerClient, BrokerError, RemoteChargingSessions, RemoteCoinHub, RemoteFingerprintIndex,
+                           RemoteJobRegistry, RemoteSlotStates, RemoteSlotTimers, RemoteTelemetry)
+from serial_capture import REPLAY_PREFIX
+from slot_state import SlotStateTable
+from slot_timers import RELOCK, UV_OFF, SlotTimers
+from telemetry import RESOLUTIONS, TelemetryStore
+
+# Log records are written by a background thread (see bridge_log.py);
+# LOG_LEVEL=DEBUG also shows sampled serial traffic
+setup_logging()
+log = logging.getLogger(__name__)
+
 app = Flask(__name__)
 CORS(app)
 
 # Configure serial connection to Arduino
 # Update COM port for your setup (e.g., '/dev/ttyACM0' on Raspberry Pi)
+# or set ARDUINO_PORT in the environment (e.g. the virtual board from
+# arduino_emulator.py)
 # ARDUINO_PORT = 'COM3'  # Windows
-ARDUINO_PORT = '/dev/ttyACM0'  # Raspberry Pi
+ARDUINO_PORT = os.environ.get('ARDUINO_PORT', '/dev/ttyACM0')  # Raspberry Pi
 BAUD_RATE = 9600
 
-try:
-    arduino = serial.Serial(ARDUINO_PORT, BAUD_RATE, timeout=1)
-    print(f"\n{'='*60}")
-    print(f"ARDUINO CONNECTION")
-    print(f"{'='*60}")
-    print(f"Connected to Arduino on {ARDUINO_PORT}")
-    print(f"Waiting for Arduino to initialize...\n")
-    
-    # Read Arduino startup messages for 3 seconds
-    startup_timeout = time.time() + 3
-    while time.time() < startup_timeout:
-        if arduino.in_waiting > 0:
-            try:
-                line = arduino.readline().decode('utf-8', errors='ignore').strip()
-                if line:
-                    # Try to parse as JSON for pretty printing
-                    try:
-                        data = json.loads(line)
-                        if 'status' in data:
-                            print(f"📟 Arduino: {data['status']}")
-                        elif 'info' in data:
-                            print(f"ℹ️  Info: {data['info']}")
-                        elif 'help' in data:
-                            print(f"💡 Help: {data['help']}")
-                        else:
-                            print(f"📟 Arduino: {line}")
-                    except json.JSONDecodeError:
-                        # Not JSON, just print it
-                        print(f"📟 Arduino: {line}")
-            except Exception as e:
-                pass  # Ignore decoding errors
-        time.sleep(0.1)
-    
-    print(f"{'='*60}")
-    print(f"✓ Arduino initialization complete!")
-    print(f"{'='*60}\n")
-    
-except Exception as e:
-    print(f"\n{'='*60}")
-    print(f"⚠️  WARNING: Could not connect to Arduino")
-    print(f"{'='*60}")
-    print(f"Error: {e}")
-    print(f"Port: {ARDUINO_PORT}")
-    print(f"\nThe API will run in SIMULATION mode.")
-    print(f"All hardware commands will be simulated (not secure!).")
-    print(f"{'='*60}\n")
-    arduino = None
-
-def send_arduino_command(command, data, timeout=10):
-    """Send command to Arduino and get response"""
-    if arduino is None:
-        print(f"⚠ Simulating Arduino command: {command} with data: {data}")
-        return {"success": True, "simulated": True}
+# Kiosks with more slots than one Mega drives use several boards, each with
+# its own port and slot range: 'port:first-last,...' (see board_set.py).
+# The first board also has the fingerprint sensor and coin acceptor.
+ARDUINO_BOARDS = parse_boards(os.environ.get('ARDUINO_BOARDS', f'{ARDUINO_PORT}:1-16'))
+
+# Negotiated with LINK_UPGRADE once the Arduino is up. Firmware without
+# support keeps the link at BAUD_RATE with JSON lines; set LINK_BAUD_RATE to
+# BAUD_RATE and BINARY_FRAMES to False to skip the handshake entirely.
+LINK_BAUD_RATE = 115200
+BINARY_FRAMES = True
+
+# Milliseconds between current/voltage pushes (TELEMETRY in solar5.ino), for
+# kiosks with the current sensors wired; unset, the boards send none
+TELEMETRY_INTERVAL_MS = int(os.environ.get('TELEMETRY_INTERVAL_MS', 0)) or None
+
+# How long a request that arrives while the board is still booting waits
+READY_WAIT = 15
+
+# Directory to record every board's serial traffic into, for replaying
+# field problems later (see serial_capture.py); unset, nothing is recorded
+SERIAL_RECORD = os.environ.get('SERIAL_RECORD')
+
+# Set in HTTP workers when serial_broker.py owns the port (multi-worker
+# deployments); unset, this process opens the board itself
+BROKER_SOCKET = os.environ.get('BROKER_SOCKET')
+
+# AS608 fingerprint IDs are 1-127
+MAX_FINGERPRINT_ID = 127
+
+# How long /api/solenoid/unlock-temp keeps a slot open (TEMP_UNLOCK_MS in solar5.ino)
+TEMP_UNLOCK_SECONDS = 2
+
+# Every coin is recorded here (SQLite, WAL mode), served by /api/coins
+DEFAULT_COIN_LEDGER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'coins.db')
+COIN_LEDGER_PATH = os.environ.get('COIN_LEDGER', DEFAULT_COIN_LEDGER)
+
+# A 'replay:' board plays a capture back (see serial_capture.py). Its coins
+# were paid once already: they are not counted again, the ledger is kept in
+# memory unless COIN_LEDGER names a scratch file, and no charging session
+# can be started
+REPLAYING = any(port.startswith(REPLAY_PREFIX) for port, _, _ in ARDUINO_BOARDS)
+if REPLAYING and 'COIN_LEDGER' not in os.environ:
+    COIN_LEDGER_PATH = ':memory:'
+elif REPLAYING and os.path.abspath(COIN_LEDGER_PATH) == DEFAULT_COIN_LEDGER:
+    raise SystemExit(f"Refusing to replay a capture against the kiosk's coin ledger {DEFAULT_COIN_LEDGER}; "
+                     f"unset COIN_LEDGER or point it at a scratch file")
+
+# A job event stream with nothing new sends a keepalive this often (seconds)
+JOB_EVENTS_KEEPALIVE = 15
+
+# A job event stream ends with the job in one of these
+JOB_FINAL_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+# Recent serial lines in both directions, served by /api/debug/serial-traffic
+serial_traffic = SerialTrafficLog()
+
+# Timelines of profiled requests (X-Profile header), served by /api/debug/profiles
+profiler = profiling.Profiler()
+
+def log_unsolicited_message(data):
+    """Log a line the Arduino sent on its own (banners, coin pushes)"""
+    if 'status' in data:
+        log.info(f"📟 Arduino: {data['status']}")
+    elif 'info' in data:
+        log.info(f"ℹ️  Info: {data['info']}")
+    elif 'help' in data:
+        log.info(f"💡 Help: {data['help']}")
+    elif 'coinDetected' in data:
+        log.info(f"💰 Arduino coin push: ₱{data['coinDetected']}",
+                 extra={'fields': {'timestamp': data.get('timestamp')}})
+    elif 'telemetry' in data:
+        pass  # Every second; kept by the TelemetryStore instead
+    else:
+        log.info(f"📟 Arduino: {json.dumps(data)}")
+
+def collect_link_metrics():
+    """Copy link, queue and connection state into /metrics at scrape time"""
+    for shard in boards.shards:
+        collect_board_metrics(shard.name, shard.board)
+
+def collect_board_metrics(name, board):
+    counters = board.link_counters()
+    for direction in ('in', 'out'):
+        metrics.serial_bytes.set_total(name, direction, value=counters.get(f'bytes_{direction}', 0))
+    for reason in ('non_json', 'unexpected', 'late_reply', 'bad_frame'):
+        metrics.serial_discarded.set_total(name, reason, value=counters.get(reason, 0))
+
+    queues = board.scheduler.queue_stats() if board.scheduler else {}
+    for queue_class, stats in queues.items():
+        metrics.queue_depth.set(name, queue_class, value=stats['queued'])
+        metrics.queue_dispatched.set_total(name, queue_class, value=stats['dispatched'])
+        metrics.queue_expired.set_total(name, queue_class, value=stats['expired'])
+        metrics.queue_rejected.set_total(name, queue_class, value=stats['rejected'])
+        metrics.queue_backlog.set(name, queue_class, value=stats['backlog_ms'] / 1000)
+
+    status = board.status()
+    for state in ('connecting', 'warming', 'ready', 'disconnected', 'simulated'):
+        metrics.arduino_state.set(name, state, value=int(status['state'] == state))
+    metrics.arduino_reconnects.set_total(name, value=status['reconnects'])
+    metrics.arduino_outage_seconds.set_total(
+        name, value=status['totalOutageSeconds'] + (status['outageSeconds'] or 0))
+
+def run_timer_action(command, data):
+    """A timed follow-up (re-lock, UV off) is due; it always goes to the board"""
+    return send_arduino_command(command, data, force=True)
+
+def power_off_slots(slots):
+    """
+    Cut relay and UV light of several slots with one batched action
+    (a charging session ended); returns the slots that did not confirm
+    """
+    operations = power_off_operations(slots)
+    return unconfirmed_slots(operations, send_batch(operations))
+
+def power_off_operations(slots):
+    """Batch operations cutting the slots' relays and UV lights (pending UV-offs are dropped)"""
+    operations = []
+    for slot in slots:
+        operations.append(('RELAY', slot, False))
+        state = slot_states.get(slot)
+        if state and state['hasUvLight']:
+            operations.append(('UV_LIGHT', slot, False))
+            slot_timers.cancel_slot(slot, UV_OFF)
+    return operations
+
+def unconfirmed_slots(operations, results):
+    return sorted({operation[1] for operation, result in zip(operations, results) if not result['success']})
+
+if BROKER_SOCKET:
+    # HTTP worker: the broker has the board and all state shared between workers
+    broker = BrokerClient(BROKER_SOCKET)
+    boards = None
+    coin_ledger = None
+    coin_hub = RemoteCoinHub(broker)
+    jobs = RemoteJobRegistry(broker)
+    slot_states = RemoteSlotStates(broker)
+    fingerprint_index = RemoteFingerprintIndex(broker)
+    slot_timers = RemoteSlotTimers(broker)
+    charging_sessions = RemoteChargingSessions(broker)
+    telemetry = RemoteTelemetry(broker)
+else:
+    # Opened and brought up in the background so the server starts at once
+    broker = None
+    coin_ledger = CoinLedger(COIN_LEDGER_PATH)
+    atexit.register(coin_ledger.close)  # Commit coins still queued
+    # Coins pushed by the Arduino, served to /api/coin-slot and /api/coin-events
+    coin_hub = CoinEventHub(ledger=coin_ledger)
+    # Long-running operations (e.g. bulk fingerprint delete) polled via /api/jobs
+    jobs = JobRegistry()
+    boards = BoardSet(ARDUINO_BOARDS, BAUD_RATE, LINK_BAUD_RATE, BINARY_FRAMES, traffic=serial_traffic,
+                      capture_dir=SERIAL_RECORD, telemetry_interval=TELEMETRY_INTERVAL_MS)
+    # Last confirmed relay/solenoid/UV state per slot, served by /api/slots
+    slot_states = SlotStateTable(layout=boards.layout())
+    # Which slot each enrolled fingerprint ID belongs to, for /api/fingerprint/identify
+    fingerprint_index = FingerprintIndex()
+    # Current and bus voltage pushes, rolled up for /api/telemetry
+    telemetry = TelemetryStore(boards.layout().keys())
+    boards.add_listener(log_unsolicited_message)
+    for shard in boards.shards:
+        # Coins are deduplicated per board; a board's boot banner resets
+        # only the slots it drives
+        if not shard.board.replaying:
+            shard.board.add_listener(functools.partial(coin_hub.handle_message, board=shard.name))
+        shard.board.add_listener(functools.partial(slot_states.handle_message, slots=shard.slots))
+        shard.board.add_listener(functools.partial(telemetry.handle_message, first_slot=shard.first_slot))
+    boards.start()
+    # Re-locks and UV-offs of timed actions, served by /api/timers
+    slot_timers = SlotTimers(run_timer_action)
+    slot_timers.start()
+    # Paid charging time per slot, powered off when it runs out (/api/sessions)
+    charging_sessions = ChargingSessions(power_off_slots)
+    if not REPLAYING:
+        charging_sessions.start()
+    metrics.registry.add_collector(collect_link_metrics)
+
+def observe_http(method, route, status, seconds):
+    metrics.http_seconds.observe(method, route, status, value=seconds)
+
+def record_http(method, route, status, seconds):
+    """observe_http where /metrics is served: the broker's, in a worker"""
+    if broker:
+        try:
+            broker.call('observe_http', method, route, status, seconds)
+        except BrokerError:
+            pass  # Already reported by the request itself
+    else:
+        observe_http(method, route, status, seconds)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    mode = profiling.requested_mode(request.headers.get(profiling.PROFILE_HEADER))
+    if mode:
+        g.profile = profiler.start(request.method, request.path, mode)
+
+@app.after_request
+def observe_request(response):
+    """HTTP latency per route (for streams: until the response starts)"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        record_http(request.method, route, response.status_code, time.perf_counter() - started)
+    
+    profile = g.pop('profile', None)
+    if profile is not None:
+        timeline = profiler.finish(profile, response.status_code)
+        response.headers['Server-Timing'] = timeline.server_timing()
+        response.headers['X-Profile-Id'] = str(timeline.id)
+    return response
+
+@app.teardown_request
+def finish_failed_profile(error):
+    """after_request is skipped when a route raises; still stop the sampler"""
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.finish(profile, 500)
+
+@app.errorhandler(BrokerError)
+def broker_unavailable(error):
+    log.error(f"❌ {error}")
+    return jsonify({'success': False, 'error': str(error)}), 503
+
+def shed_response(error):
+    """Body and Retry-After (whole seconds) for a command the scheduler turned away"""
+    retry_after = max(1, math.ceil(error.retry_after))
+    return {'success': False, 'error': str(error), 'overloaded': True, 'retryAfter': retry_after}, retry_after
+
+@app.errorhandler(DeadlineExceeded)
+def command_shed(error):
+    """The serial backlog was too deep: fail fast so the client can retry"""
+    log.warning(f"🚦 {error}")
+    payload, retry_after = shed_response(error)
+    response = jsonify(payload)
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 503
+
+def send_arduino_command(command, data, timeout=10, on_update=None, force=False):
+    """
+    Send command to Arduino and wait for its reply
+    Actuator commands that would not change the slot are skipped unless forced
+    """
+    if broker:
+        return forward_command(command, data, timeout, force)
+    
+    skipped = skip_redundant_command(command, data, force)
+    if skipped:
+        metrics.command_results.inc(command, 'skipped')
+        return skipped
+    
+    board, board_data = boards.route(command, data)
+    if board is None:
+        metrics.command_results.inc(command, 'no_board')
+        return {"success": False, "error": "Slot is not on any configured board"}
+    
+    if not board.wait_ready(READY_WAIT):
+        metrics.command_results.inc(command, 'not_ready')
+        return {"success": False, "error": "Arduino is still starting up"}
+    
+    if board.simulated:
+        metrics.command_results.inc(command, 'simulated')
+        result = simulate_command(command, data)
+    else:
+        try:
+            start_command(command)
+            started = time.perf_counter()
+            reply, updates = board.execute(command, board_data, timeout=timeout,
+                                                on_update=on_update or log_status_update)
+            result = finish_command(command, reply, updates, timeout)
+            observe_command(command, time.perf_counter() - started, reply, result)
+        except DeadlineExceeded:
+            metrics.command_results.inc(command, 'shed')
+            raise  # 503 with Retry-After (see command_shed)
+        except Exception as e:
+            metrics.command_results.inc(command, 'error')
+            log.error(f"❌ Arduino communication error: {e}")
+            return {"success": False, "error": str(e)}
+    
+    slot_states.record(command, data, result)
+    return result
+
+async def send_arduino_command_async(command, data, timeout=10, on_update=None, force=False):
+    """Same as send_arduino_command, but awaits the reply (asyncio server)"""
+    if broker:
+        return await forward_command_async(command, data, timeout, force)
+    
+    skipped = skip_redundant_command(command, data, force)
+    if skipped:
+        metrics.command_results.inc(command, 'skipped')
+        return skipped
+    
+    board, board_data = boards.route(command, data)
+    if board is None:
+        metrics.command_results.inc(command, 'no_board')
+        return {"success": False, "error": "Slot is not on any configured board"}
+    
+    if not await board.wait_ready_async(READY_WAIT):
+        metrics.command_results.inc(command, 'not_ready')
+        return {"success": False, "error": "Arduino is still starting up"}
+    
+    if board.simulated:
+        metrics.command_results.inc(command, 'simulated')
+        result = simulate_command(command, data)
+    else:
+        try:
+            start_command(command)
+            started = time.perf_counter()
+            reply, updates = await board.execute_async(command, board_data, timeout=timeout,
+                                                        on_update=on_update or log_status_update)
+            result = finish_command(command, reply, updates, timeout)
+            observe_command(command, time.perf_counter() - started, reply, result)
+        except DeadlineExceeded:
+            metrics.command_results.inc(command, 'shed')
+            raise  # 503 with Retry-After (see command_shed)
+        except Exception as e:
+            metrics.command_results.inc(command, 'error')
+            log.error(f"❌ Arduino communication error: {e}")
+            return {"success": False, "error": str(e)}
     
+    slot_states.record(command, data, result)
+    return result
+
+def forward_command(command, data, timeout, force):
+    """HTTP worker: the broker runs send_arduino_command (and its on_update)"""
     try:
-        message = json.dumps({"command": command, "data": data})
-        print(f"→ Sending to Arduino: {message}")
-        arduino.write((message + '\n').encode())
-        
-        # For fingerprint enrollment, we need to wait longer and handle multiple responses
-        if command == 'FINGERPRINT_ENROLL':
-            return handle_enrollment_response(timeout)
-        
-        # For fingerprint verification, we need to wait for sensor scan
-        if command == 'FINGERPRINT_VERIFY':
-            return handle_verification_response(timeout)
-        
-        # Standard response handling
-        time.sleep(0.15)  # Slightly longer delay for reliability
-        
-        if arduino.in_waiting > 0:
-            response = arduino.readline().decode().strip()
-            print(f"← Received from Arduino: {response}")
-            
-            try:
-                return json.loads(response)
-            except json.JSONDecodeError:
-                print(f"⚠ Non-JSON response: {response}")
-                return {"success": True}
-        
-        return {"success": True}
-    except Exception as e:
-        print(f"❌ Arduino communication error: {e}")
+        return broker.call('send_arduino_command', command, data, timeout=timeout, force=force)
+    except BrokerError as e:
+        log.error(f"❌ {e}")
         return {"success": False, "error": str(e)}
 
-def handle_enrollment_response(timeout=10):
+async def forward_command_async(command, data, timeout, force):
+    try:
+        return await broker.call_async('send_arduino_command', command, data, timeout=timeout, force=force)
+    except BrokerError as e:
+        log.error(f"❌ {e}")
+        return {"success": False, "error": str(e)}
+
+def observe_command(command, seconds, reply, result):
+    """Record one round trip in /metrics; reply is None if it timed out"""
+    if reply is None:
+        outcome = 'timeout'
+    elif command == 'FINGERPRINT_VERIFY':
+        outcome = 'matched' if result.get('isValid') else 'no_match'
+    elif command == 'FINGERPRINT_IDENTIFY':
+        outcome = 'matched' if result.get('found') else 'no_match'
+    else:
+        outcome = 'ok' if result.get('success') else 'failed'
+    
+    metrics.command_seconds.observe(command, value=seconds)
+    metrics.command_results.inc(command, outcome)
+    if command in SENSOR_PROCESSES:
+        metrics.fingerprint_seconds.observe(SENSOR_PROCESSES[command].lower(), outcome, value=seconds)
+
+def skip_redundant_command(command, data, force=False):
+    """
+    Result for a command that would set a state the slot already has
+    Timed commands are always forced (see run_actuator_command)
+    """
+    if force or command not in ('RELAY', 'SOLENOID', 'UV_LIGHT'):
+        return None
+    
+    value = data.get('lock') if command == 'SOLENOID' else data.get('state')
+    
+    if not slot_states.is_redundant(command, data.get('slot'), value):
+        return None
+    
+    log.info(f"↷ Skipping {command} for slot {data.get('slot')}: already in requested state")
+    return {"success": True, "skipped": True, "message": "Slot already in requested state"}
+
+def simulate_command(command, data):
+    """Pretend the command succeeded when no Arduino is connected"""
+    log.warning(f"⚠ Simulating Arduino command: {command}", extra={'fields': {'data': data}})
+    return {"success": True, "simulated": True}
+
+# Multi-step AS608 commands whose progress is logged
+SENSOR_PROCESSES = {
+    'FINGERPRINT_ENROLL': 'Enrollment',
+    'FINGERPRINT_VERIFY': 'Verification',
+    'FINGERPRINT_IDENTIFY': 'Identification',
+}
+
+def start_command(command):
+    if command in SENSOR_PROCESSES:
+        log.info(f"--- AS608 {SENSOR_PROCESSES[command]} Process ---")
+
+def log_status_update(message):
+    """Log AS608 status updates as they arrive"""
+    if 'status' in message:
+        log.info(f"   Status: {message['status']}")
+
+def finish_command(command, result, updates, timeout):
+    """Turn the reply (None on timeout) into the result the routes expect"""
+    # Enrollment sends multiple status updates before its final result
+    if command == 'FINGERPRINT_ENROLL':
+        return finish_enrollment(result, updates)
+    
+    if command in ('FINGERPRINT_VERIFY', 'FINGERPRINT_IDENTIFY'):
+        return finish_verification(command, result)
+    
+    if result is None:
+        log.warning(f"⚠ No reply from Arduino for {command} within {timeout}s")
+        return {"success": False, "error": "Timeout"}
+    
+    return result
+
+def finish_enrollment(result, updates):
     """
     Handle multi-step enrollment response from Arduino
     AS608 enrollment sends multiple status updates
     """
-    start_time = time.time()
-    final_result = None
-    
-    print("\n--- AS608 Enrollment Process ---")
-    
-    while (time.time() - start_time) < timeout:
-        if arduino.in_waiting > 0:
-            try:
-                response = arduino.readline().decode().strip()
-                print(f"← {response}")
-                
-                result = json.loads(response)
-                
-                # Status updates during enrollment
-                if 'status' in result:
-                    print(f"   Status: {result['status']}")
-                
-                # Final result
-                if 'success' in result:
-                    final_result = result
-                    
-                    # If success is True and we have a message or fingerprintId, enrollment is complete
-                    if result.get('success') and ('message' in result or 'fingerprintId' in result):
-                        print("--- Enrollment Complete ---\n")
-                        return final_result
-                    elif not result.get('success'):
-                        # Enrollment failed
-                        print("--- Enrollment Failed ---\n")
-                        return final_result
-                        
-            except json.JSONDecodeError:
-                # Non-JSON response, might be debug output
-                continue
-        
-        time.sleep(0.1)
+    if result is not None:
+        if result.get('success'):
+            log.info("--- Enrollment Complete ---")
+        else:
+            log.warning("--- Enrollment Failed ---")
+        return result
     
-    print("--- Enrollment Timeout ---\n")
-    return final_result if final_result else {"success": False, "error": "Timeout"}
+    log.warning("--- Enrollment Timeout ---")
+    # Fall back to the last intermediate result, if any
+    partial = [update for update in updates if 'success' in update]
+    return partial[-1] if partial else {"success": False, "error": "Timeout"}
 
-def handle_verification_response(timeout=10):
+def finish_verification(command, result):
     """
-    Handle fingerprint verification response from Arduino
+    Handle fingerprint verification (or identification) response from Arduino
     AS608 verification may send status updates before final result
     """
-    start_time = time.time()
-    final_result = None
-    
-    print("\n--- AS608 Verification Process ---")
-    
-    while (time.time() - start_time) < timeout:
-        if arduino.in_waiting > 0:
-            try:
-                response = arduino.readline().decode().strip()
-                print(f"← {response}")
-                
-                result = json.loads(response)
-                
-                # Status updates during verification
-                if 'status' in result:
-                    print(f"   Status: {result['status']}")
-                
-                # Final result
-                if 'success' in result or 'isValid' in result:
-                    final_result = result
-                    print("--- Verification Complete ---\n")
-                    return final_result
-                        
-            except json.JSONDecodeError:
-                # Non-JSON response, might be debug output
-                continue
-        
-        time.sleep(0.1)
+    process = SENSOR_PROCESSES[command]
+    if result is not None:
+        log.info(f"--- {process} Complete ---")
+        return result
     
-    print("--- Verification Timeout ---\n")
-    return final_result if final_result else {"success": True, "isValid": False, "error": "Timeout"}
+    log.warning(f"--- {process} Timeout ---")
+    return {"success": True, "isValid": False, "found": False, "error": "Timeout"}
 
-@app.route('/api/relay', methods=['POST'])
-def control_relay():
-    """Control relay for slot power"""
-    data = request.json
+def relay_command(data):
+    """RELAY command for a /api/relay request body"""
     slot_number = data.get('slotNumber')
     state = data.get('state')
     
-    print(f"Relay control - Slot {slot_number}: {'ON' if state else 'OFF'}")
+    log.info(f"Relay control - Slot {slot_number}: {'ON' if state else 'OFF'}")
     
-    result = send_arduino_command('RELAY', {
+    return 'RELAY', {
         'slot': slot_number,
         'state': state
-    })
-    
-    return jsonify(result), 200 if result.get('success') else 500
+    }, 10
 
-@app.route('/api/solenoid', methods=['POST'])
-def control_solenoid():
-    """Control solenoid lock"""
-    data = request.json
+def solenoid_command(data):
+    """SOLENOID command for a /api/solenoid request body"""
     slot_number = data.get('slotNumber')
     lock_state = data.get('locked')
     duration = data.get('duration', 0)  # Duration in seconds, default 0 (permanent)
     
     if duration > 0:
-        print(f"Solenoid control - Slot {slot_number}: {'LOCK' if lock_state else 'UNLOCK'} for {duration} seconds")
+        log.info(f"Solenoid control - Slot {slot_number}: {'LOCK' if lock_state else 'UNLOCK'} for {duration} seconds")
     else:
-        print(f"Solenoid control - Slot {slot_number}: {'LOCK' if lock_state else 'UNLOCK'}")
+        log.info(f"Solenoid control - Slot {slot_number}: {'LOCK' if lock_state else 'UNLOCK'}")
     
-    result = send_arduino_command('SOLENOID', {
+    return 'SOLENOID', {
         'slot': slot_number,
         'lock': lock_state,
         'duration': duration
-    })
+    }, 10
+
+def uv_light_command(data):
+    """UV_LIGHT command for a /api/uv-light request body"""
+    slot_number = data.get('slotNumber')
+    state = data.get('state')
+    duration = data.get('duration', 0)  # Sanitization cycle in seconds, default 0 (until turned off)
+    
+    if state and duration > 0:
+        log.info(f"UV Light control - Slot {slot_number}: ON for {duration} seconds")
+    else:
+        log.info(f"UV Light control - Slot {slot_number}: {'ON' if state else 'OFF'}")
+    
+    return 'UV_LIGHT', {
+        'slot': slot_number,
+        'state': state,
+        'duration': duration
+    }, 10
+
+def unlock_temp_command(data):
+    """UNLOCK_TEMP command for a /api/solenoid/unlock-temp request body"""
+    slot_number = data.get('slotNumber')
+    
+    log.info(f"Temporary unlock - Slot {slot_number}")
+    
+    return 'UNLOCK_TEMP', {
+        'slot': slot_number
+    }, 10
+
+# Single-actuator routes: path -> builder of (command, data, timeout)
+ACTUATOR_ROUTES = {
+    '/api/relay': relay_command,
+    '/api/solenoid': solenoid_command,
+    '/api/uv-light': uv_light_command,
+    '/api/solenoid/unlock-temp': unlock_temp_command,
+}
+
+def split_timed_command(command, data):
+    """
+    (command, data, timer) for the board: `timer` is the (kind, seconds,
+    command, data) follow-up for slot_timers, else None. A timed unlock and
+    a temporary unlock keep their duration, so the board still re-locks on
+    its own if the bridge is down when the timer falls due; a UV cycle goes
+    out as a plain UV on (the firmware has no UV timer)
+    """
+    slot = data.get('slot')
+    if command == 'SOLENOID' and not data.get('lock') and data.get('duration', 0) > 0:
+        timer = (RELOCK, data['duration'], 'SOLENOID', {'slot': slot, 'lock': True})
+    elif command == 'UNLOCK_TEMP':
+        timer = (RELOCK, TEMP_UNLOCK_SECONDS, 'SOLENOID', {'slot': slot, 'lock': True})
+    elif command == 'UV_LIGHT' and data.get('state') and data.get('duration', 0) > 0:
+        timer = (UV_OFF, data['duration'], 'UV_LIGHT', {'slot': slot, 'state': False})
+    else:
+        timer = None
+
+    if command == 'SOLENOID':
+        return 'SOLENOID', {'slot': slot, 'lock': data.get('lock'), 'duration': data.get('duration', 0)}, timer
+    if command == 'UV_LIGHT':
+        return 'UV_LIGHT', {'slot': slot, 'state': data.get('state')}, timer
+    return command, data, timer
+
+def schedule_follow_up(command, data, timer, result):
+    """
+    Once the board confirmed the command, start its timer (added to the
+    result as `timer`), or cancel the slot's timer an explicit command
+    overrides (e.g. locking a slot that was unlocked for 30 s)
+    """
+    if not result.get('success'):
+        return result
     
+    slot = data.get('slot')
+    if timer is not None:
+        kind, seconds, follow_command, follow_data = timer
+        result['timer'] = slot_timers.schedule(slot, kind, seconds, follow_command, follow_data)
+    elif command == 'SOLENOID':
+        slot_timers.cancel_slot(slot, RELOCK)
+    elif command == 'UV_LIGHT':
+        slot_timers.cancel_slot(slot, UV_OFF)
+    return result
+
+def run_actuator_command(build_command):
+    body = request.json
+    command, data, timeout = build_command(body)
+    command, data, timer = split_timed_command(command, data)
+    # A timed command always goes out: the board arms its own re-lock with it
+    result = send_arduino_command(command, data, timeout=timeout,
+                                  force=body.get('force', False) or timer is not None)
+    result = schedule_follow_up(command, data, timer, result)
     return jsonify(result), 200 if result.get('success') else 500
 
+@app.route('/api/relay', methods=['POST'])
+def control_relay():
+    """Control relay for slot power"""
+    return run_actuator_command(relay_command)
+
+@app.route('/api/solenoid', methods=['POST'])
+def control_solenoid():
+    """Control solenoid lock"""
+    return run_actuator_command(solenoid_command)
+
 @app.route('/api/uv-light', methods=['POST'])
 def control_uv_light():
     """Control UV light for phone sanitization"""
-    data = request.json
+    return run_actuator_command(uv_light_command)
+
+@app.route('/api/solenoid/unlock-temp', methods=['POST'])
+def unlock_temp():
+    """
+    Temporarily unlock solenoid for 2 seconds (for device access during charging)
+    Unlocks at once; the board re-locks the slot 2 seconds later, and so does the
+    bridge (see slot_timers.py) in case the board missed it
+    """
+    return run_actuator_command(unlock_temp_command)
+
+@app.route('/api/sessions', methods=['GET', 'POST'])
+def charging_session_list():
+    """
+    GET: every slot's charging session (no serial I/O)
+    POST starts one: turns the relay on and powers it off when the paid
+    time runs out, whether or not the UI is still open
+    Body: { "slotNumber": 1, "minutes": 30, "fingerprintId": 5, "sessionId": "optional" }
+    """
+    if request.method == 'GET':
+        return jsonify({'sessions': charging_sessions.all()}), 200
+    
+    data = request.get_json(silent=True) or {}
+    rejected = session_request_error(data)
+    if rejected:
+        payload, status = rejected
+        return jsonify(payload), status
+    
+    result = send_arduino_command('RELAY', {'slot': data['slotNumber'], 'state': True}, force=True)
+    payload, status = begin_session(data, result)
+    return jsonify(payload), status
+
+def session_request_error(data):
+    """The error response and status for a session that cannot be started, or None"""
+    if REPLAYING:
+        return {'success': False, 'error': 'No charging sessions while replaying a capture'}, 503
+    
     slot_number = data.get('slotNumber')
-    state = data.get('state')
+    minutes = data.get('minutes')
+    if slot_states.get(slot_number) is None or not isinstance(minutes, (int, float)) or minutes <= 0:
+        return {'success': False, 'error': 'Needs a known slotNumber and positive minutes'}, 400
+    if charging_sessions.get(slot_number) is not None:
+        return {'success': False, 'error': 'Slot already has a session'}, 409
+    return None
+
+def begin_session(data, relay_result):
+    """Start the session once the relay is on; returns the response and status"""
+    if not relay_result.get('success'):
+        return {'success': False, 'error': relay_result.get('error', relay_result.get('message', 'Relay failed'))}, 500
     
-    print(f"UV Light control - Slot {slot_number}: {'ON' if state else 'OFF'}")
+    slot_number = data['slotNumber']
+    fingerprint_id = data.get('fingerprintId')
+    session = charging_sessions.begin(slot_number, data['minutes'], data.get('sessionId'), fingerprint_id)
+    if session is None:
+        return {'success': False, 'error': 'Slot already has a session'}, 409
+    if fingerprint_id is not None:
+        fingerprint_index.bind(fingerprint_id, slot_number, session['sessionId'])
     
-    result = send_arduino_command('UV_LIGHT', {
-        'slot': slot_number,
-        'state': state
-    })
+    return {'success': True, **session}, 201
+
+@app.route('/api/sessions/<int:slot_number>', methods=['GET', 'DELETE'])
+def charging_session(slot_number):
+    """
+    GET: the slot's session (remaining time, state)
+    DELETE ends it: relay and UV off, and the slot's fingerprint released
+    """
+    if request.method == 'GET':
+        session = charging_sessions.get(slot_number)
+        if session is None:
+            return jsonify({'success': False, 'error': 'No session for this slot'}), 404
+        return jsonify(session), 200
     
-    return jsonify(result), 200 if result.get('success') else 500
+    if charging_sessions.get(slot_number) is None:
+        return jsonify({'success': False, 'error': 'No session for this slot'}), 404
+    
+    # The session is only ended once the relay is confirmed off
+    try:
+        powered_off = not power_off_slots([slot_number])
+    except DeadlineExceeded:
+        powered_off = False
+    payload, status = end_session(slot_number, powered_off)
+    return jsonify(payload), status
 
-@app.route('/api/fingerprint/verify', methods=['POST'])
-def verify_fingerprint():
+def end_session(slot_number, powered_off):
+    """End the session if its slot confirmed the power-off, else have it retried; response and status"""
+    if not powered_off:
+        session = charging_sessions.retry_power_off(slot_number)
+        log.error(f"❌ Slot {slot_number} did not power off, retrying", extra={'fields': {
+            'sessionId': session['sessionId'] if session else None}})
+        return {'success': False, 'poweredOff': False, **(session or {})}, 500
+    
+    session = charging_sessions.end(slot_number)
+    fingerprint_index.release_slot(slot_number)
+    log.info(f"🔌 Slot {slot_number} session ended", extra={'fields': {'sessionId': session['sessionId']}})
+    return {'success': True, 'poweredOff': True, **session}, 200
+
+@app.route('/api/sessions/<int:slot_number>/extend', methods=['POST'])
+def extend_charging_session(slot_number):
     """
-    Verify fingerprint against AS608 database
-    Returns: { "isValid": true/false, "fingerprintId": matched_id, "confidence": score }
+    Add paid minutes to a running session (coins inserted mid-session)
+    Body: { "minutes": 15 }
     """
-    data = request.json
-    expected_id = data.get('fingerprintId')
+    minutes = (request.get_json(silent=True) or {}).get('minutes')
+    if not isinstance(minutes, (int, float)) or minutes <= 0:
+        return jsonify({'success': False, 'error': 'Needs positive minutes'}), 400
     
-    print(f"\n{'='*50}")
-    print(f"FINGERPRINT VERIFICATION REQUEST")
-    print(f"{'='*50}")
-    print(f"Expected Fingerprint ID: {expected_id}")
-    print(f"Request from: {request.remote_addr}")
-    print(f"Timestamp: {time.strftime('%Y-%m-%d %H:%M:%S')}")
-    print("Waiting for finger scan on AS608 sensor...")
-    print(f"{'='*50}\n")
+    session = charging_sessions.extend(slot_number, minutes)
+    if session is None:
+        return jsonify({'success': False, 'error': 'No charging session for this slot'}), 404
     
-    result = send_arduino_command('FINGERPRINT_VERIFY', {
-        'id': expected_id
-    }, timeout=10)
+    return jsonify({'success': True, **session}), 200
+
+@app.route('/api/timers', methods=['GET'])
+def get_timers():
+    """Pending re-locks and UV-offs of timed actions, soonest first"""
+    return jsonify({'timers': slot_timers.all()}), 200
+
+@app.route('/api/timers/<int:timer_id>', methods=['DELETE'])
+def cancel_timer(timer_id):
+    """
+    Cancel a timer without running it (e.g. keep a slot unlocked)
+    Returns the cancelled timer
+    """
+    timer = slot_timers.cancel(timer_id)
+    if timer is None:
+        return jsonify({'success': False, 'error': 'Timer not found'}), 404
+    
+    return jsonify({'success': True, **timer}), 200
+
+@app.route('/api/telemetry', methods=['GET'])
+def get_telemetry():
+    """
+    Charging current, bus voltage and power per slot over time (no serial I/O)
+    Query: ?resolution=1s|1m|1h&slot=7,8&since=<unix time>&limit=60
+    Returns one array per field, a value per bucket (see telemetry.py)
+    """
+    resolution = request.args.get('resolution', '1m')
+    if resolution not in RESOLUTIONS:
+        return jsonify({'success': False, 'error': f"resolution must be one of {', '.join(RESOLUTIONS)}"}), 400
+    try:
+        slots = [int(slot) for slot in request.args['slot'].split(',')] if request.args.get('slot') else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'slot must be comma-separated slot numbers'}), 400
     
-    print(f"\n{'='*50}")
-    print(f"ARDUINO RESPONSE")
-    print(f"{'='*50}")
-    print(f"Raw result: {result}")
-    print(f"{'='*50}\n")
+    return jsonify(telemetry.query(resolution, slots, request.args.get('since', type=float),
+                                   request.args.get('limit', 60, type=int))), 200
+
+def parse_batch_request(data):
+    """Validated (command, slot, value) operations; raises BatchError"""
+    operations = [parse_operation(operation) for operation in (data or {}).get('operations', [])]
+    if not operations:
+        raise BatchError('No operations')
+    
+    log.info(f"Batch control - {len(operations)} operations")
+    return operations
+
+def skip_redundant_operations(operations, force=False):
+    """Per-operation skip results, None where the operation must be sent"""
+    results = []
+    for command, slot, value in operations:
+        if not force and slot_states.is_redundant(command, slot, value):
+            results.append({
+                'command': command,
+                'slotNumber': slot,
+                'value': value,
+                'success': True,
+                'skipped': True,
+                'message': 'Slot already in requested state'
+            })
+        else:
+            results.append(None)
+    return results
+
+def split_timed_operations(operations):
+    """
+    Batch operations for the board, and each one's follow-up timer (see
+    split_timed_command): an UNLOCK_TEMP still goes out as one, so the
+    board re-locks by itself as well
+    """
+    timers = []
+    for command, slot, value in operations:
+        if command == 'UNLOCK_TEMP':
+            timers.append((RELOCK, TEMP_UNLOCK_SECONDS, 'SOLENOID', {'slot': slot, 'lock': True}))
+        else:
+            timers.append(None)
+    return operations, timers
+
+def schedule_batch_follow_ups(operations, timers, results):
+    """schedule_follow_up for every sent operation"""
+    for (command, slot, _), timer, result in zip(operations, timers, results):
+        schedule_follow_up(command, {'slot': slot}, timer, result)
+    return results
+
+def send_frames(operations):
+    """Send operations for one board as BATCH frames, one after another"""
+    results = []
+    for frame in split_frames(operations):
+        reply = send_arduino_command('BATCH', encode_frame(frame))
+        results.extend(decode_results(frame, reply))
+    return results
+
+async def send_frames_async(operations):
+    results = []
+    for frame in split_frames(operations):
+        reply = await send_arduino_command_async('BATCH', encode_frame(frame))
+        results.extend(decode_results(frame, reply))
+    return results
+
+def send_batch(operations):
+    """
+    Per-operation results for a batch, in request order
+    Each board gets its own operations, and the boards work in parallel
+    """
+    if broker:
+        return broker.call('send_batch', operations)
+    
+    groups = boards.group(operations)
+    if len(groups) <= 1:
+        return send_frames(operations)
+    
+    with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+        # Each thread runs in a copy of this context, so profiling still applies
+        futures = [pool.submit(contextvars.copy_context().run, send_frames, grouped)
+                   for _, _, grouped in groups]
+        return reassemble_batch(len(operations), groups, [future.result() for future in futures])
+
+async def send_batch_async(operations):
+    if broker:
+        return await broker.call_async('send_batch', operations)
+    
+    groups = boards.group(operations)
+    grouped_results = await asyncio.gather(*(send_frames_async(grouped) for _, _, grouped in groups))
+    return reassemble_batch(len(operations), groups, grouped_results)
+
+def reassemble_batch(count, groups, grouped_results):
+    results = [None] * count
+    for (_, indexes, _), group_results in zip(groups, grouped_results):
+        for index, result in zip(indexes, group_results):
+            results[index] = result
+    return results
+
+def merge_batch_results(skipped, sent):
+    """Fill the sent operations' results back in request order"""
+    sent = iter(sent)
+    return [result if result is not None else next(sent) for result in skipped]
+
+def batch_response(results):
+    all_succeeded = all(result['success'] for result in results)
+    return {
+        'success': all_succeeded,
+        'results': results
+    }, 200 if all_succeeded else 500
+
+@app.route('/api/batch', methods=['POST'])
+def run_batch():
+    """
+    Apply several actuator operations with one serial write per 16 operations
+    (per board; the boards of a multi-board kiosk are driven in parallel)
+    Body: {
+      "operations": [
+        { "command": "RELAY", "slotNumber": 1, "state": false },
+        { "command": "SOLENOID", "slotNumber": 4, "locked": true },
+        { "command": "UV_LIGHT", "slotNumber": 7, "state": false },
+        { "command": "UNLOCK_TEMP", "slotNumber": 5 }
+      ]
+    }
+    Returns: { "success": all_succeeded, "results": [ per-operation result ] }
+    """
+    try:
+        operations = parse_batch_request(request.json)
+    except BatchError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    skipped = skip_redundant_operations(operations, request.json.get('force', False))
+    to_send = [operation for operation, result in zip(operations, skipped) if result is None]
+    
+    board_operations, timers = split_timed_operations(to_send)
+    sent = schedule_batch_follow_ups(to_send, timers, send_batch(board_operations))
+    payload, status = batch_response(merge_batch_results(skipped, sent))
+    return jsonify(payload), status
+
+def log_verification_request(expected_id, remote_addr):
+    log.info("FINGERPRINT VERIFICATION REQUEST: waiting for finger scan on AS608 sensor...",
+             extra={'fields': {'expectedId': expected_id, 'remote': remote_addr}})
+
+def verification_response(expected_id, result):
+    """Log the verification outcome and build the API response"""
+    log.debug(f"Raw verification result: {result}")
     
     # Simulate successful verification for demo (when no Arduino connected)
     if result.get('simulated'):
-        print("⚠ WARNING: Running in SIMULATION mode (no Arduino)")
-        print("⚠ Returning simulated success for testing")
+        log.warning("⚠ SIMULATION mode (no Arduino): returning simulated success for testing")
         result['isValid'] = True
         result['fingerprintId'] = expected_id
         result['confidence'] = 95
@@ -278,122 +916,234 @@ def verify_fingerprint():
     confidence = result.get('confidence', 0)
     error_msg = result.get('error', '')
     
-    print(f"\n{'='*50}")
-    print(f"VERIFICATION RESULT")
-    print(f"{'='*50}")
-    
     if is_valid:
-        print(f"✓ SUCCESS: Fingerprint matched!")
-        print(f"  Matched ID: {matched_id}")
-        print(f"  Expected ID: {expected_id}")
-        print(f"  Confidence: {confidence}")
-        print(f"  Match: {'CORRECT' if matched_id == expected_id else 'WRONG FINGER'}")
+        log.info("✓ VERIFICATION SUCCESS: Fingerprint matched!", extra={'fields': {
+            'matchedId': matched_id,
+            'expectedId': expected_id,
+            'confidence': confidence,
+            'match': 'CORRECT' if matched_id == expected_id else 'WRONG FINGER',
+        }})
     else:
-        print(f"✗ FAILED: Fingerprint not matched")
-        print(f"  Expected ID: {expected_id}")
-        print(f"  Error: {error_msg or 'No match found'}")
+        fields = {'expectedId': expected_id, 'error': error_msg or 'No match found'}
         if 'matchedId' in result:
-            print(f"  Wrong finger detected - Matched ID: {result['matchedId']}")
-    
-    print(f"{'='*50}\n")
+            fields['wrongFingerId'] = result['matchedId']
+        log.warning("✗ VERIFICATION FAILED: Fingerprint not matched", extra={'fields': fields})
     
-    return jsonify({
+    return {
         'isValid': is_valid,
         'fingerprintId': matched_id,
         'confidence': confidence,
         'error': error_msg
-    }), 200
+    }
 
-@app.route('/api/coin-slot', methods=['GET'])
-def get_coin_value():
+@app.route('/api/fingerprint/verify', methods=['POST'])
+def verify_fingerprint():
     """
-    Get coin slot value - called by UI every 2 seconds for real-time detection
-    Returns: { "value": coin_amount, "timestamp": detection_time }
+    Verify fingerprint against AS608 database
+    Returns: { "isValid": true/false, "fingerprintId": matched_id, "confidence": score }
+    With "background": true it returns 202 and runs as a job (see enroll)
     """
-    result = send_arduino_command('READ_COIN', {}, timeout=2)
+    data = request.json
+    expected_id = data.get('fingerprintId')
     
-    coin_value = result.get('value', 0)
-    timestamp = result.get('timestamp', 0)
+    log_verification_request(expected_id, request.remote_addr)
     
-    # Log only when coin is detected (avoid spam)
-    if coin_value > 0:
-        print(f"💰 Coin detected: ₱{coin_value:.2f} (Timestamp: {timestamp})")
+    if data.get('background'):
+        payload, status = start_sensor_job('fingerprint-verify', verify_fingerprint_job, 'Verification started',
+                                           expected_id=expected_id)
+        return jsonify(payload), status
+    
+    result = send_arduino_command('FINGERPRINT_VERIFY', {
+        'id': expected_id
+    }, timeout=10)
+    
+    return jsonify(verification_response(expected_id, result)), 200
+
+def log_identification_request(unlock, remote_addr):
+    log.info("FINGERPRINT IDENTIFICATION REQUEST: waiting for finger scan on AS608 sensor...",
+             extra={'fields': {'unlock': unlock, 'remote': remote_addr}})
+
+# Firmware without FINGERPRINT_IDENTIFY: a verify for ID 0 (never enrolled)
+# searches the whole database too, and reports any match as matchedId
+IDENTIFY_FALLBACK = ('FINGERPRINT_VERIFY', {'id': 0})
+
+def needs_identify_fallback(result):
+    return result.get('message') == 'Unknown command'
+
+def identification_response(result):
+    """Resolve the matched ID to its slot and build the API response"""
+    log.debug(f"Raw identification result: {result}")
     
-    # Simulate coin value for demo/testing (when no Arduino)
     if result.get('simulated'):
-        # Return 0 normally (no simulation) - user can use "Simulate" button in UI
-        coin_value = 0
+        log.warning("⚠ SIMULATION mode (no Arduino): no sensor to identify a finger with")
+        result = {'found': False, 'error': 'Simulation mode: no fingerprint sensor'}
     
-    return jsonify({
-        'value': coin_value,
-        'timestamp': timestamp
-    }), 200
+    # 'matchedId' is the older firmware's verify reply (see needs_identify_fallback)
+    found = result.get('found', 'matchedId' in result)
+    fingerprint_id = result.get('fingerprintId', result.get('matchedId')) if found else None
+    binding = fingerprint_index.lookup(fingerprint_id) if found else None
+    error_msg = result.get('error', '') if not found else ''
+    
+    if binding:
+        log.info("✓ IDENTIFICATION SUCCESS: Fingerprint belongs to a slot", extra={'fields': {
+            'fingerprintId': fingerprint_id,
+            'slot': binding['slotNumber'],
+            'confidence': result.get('confidence', 0),
+        }})
+    elif found:
+        error_msg = 'Fingerprint is not bound to a slot'
+        log.warning("✗ IDENTIFICATION: Enrolled fingerprint has no slot", extra={'fields': {
+            'fingerprintId': fingerprint_id
+        }})
+    else:
+        log.warning("✗ IDENTIFICATION FAILED: Fingerprint not found",
+                    extra={'fields': {'error': error_msg or 'No match found'}})
+    
+    return {
+        'found': found,
+        'fingerprintId': fingerprint_id,
+        'confidence': result.get('confidence', 0) if found else 0,
+        'slotNumber': binding['slotNumber'] if binding else None,
+        'sessionId': binding['sessionId'] if binding else None,
+        'unlocked': False,
+        'error': error_msg
+    }
 
-@app.route('/api/solenoid/unlock-temp', methods=['POST'])
-def unlock_temp():
+@app.route('/api/fingerprint/identify', methods=['POST'])
+def identify_fingerprint():
     """
-    Temporarily unlock solenoid for 2 seconds (for device access during charging)
-    Sends pulse to unlock, waits 2 seconds, then automatically re-locks
+    Identify a finger against the whole AS608 database and find its slot
+    Body (optional): { "unlock": true } also opens that slot (UNLOCK_TEMP)
+    Returns: { "found", "fingerprintId", "confidence", "slotNumber", "sessionId", "unlocked" }
     """
-    data = request.json
-    slot_number = data.get('slotNumber')
+    unlock = (request.get_json(silent=True) or {}).get('unlock', False)
+    log_identification_request(unlock, request.remote_addr)
     
-    print(f"Temporary unlock - Slot {slot_number}")
+    result = send_arduino_command('FINGERPRINT_IDENTIFY', {}, timeout=10)
+    if needs_identify_fallback(result):
+        result = send_arduino_command(*IDENTIFY_FALLBACK, timeout=10)
     
-    result = send_arduino_command('UNLOCK_TEMP', {
-        'slot': slot_number
-    })
+    payload = identification_response(result)
+    if unlock and payload['slotNumber'] is not None:
+        command, data, timeout = unlock_temp_command({'slotNumber': payload['slotNumber']})
+        command, data, timer = split_timed_command(command, data)
+        reply = schedule_follow_up(command, data, timer, send_arduino_command(command, data, timeout=timeout))
+        payload['unlocked'] = reply.get('success', False)
     
-    return jsonify(result), 200 if result.get('success') else 500
+    return jsonify(payload), 200
 
-@app.route('/api/fingerprint/enroll', methods=['POST'])
-def enroll_fingerprint():
+@app.route('/api/fingerprint/index', methods=['GET'])
+def get_fingerprint_index():
+    """Fingerprint ID -> slot bindings used by identify"""
+    return jsonify({'bindings': fingerprint_index.all()}), 200
+
+@app.route('/api/fingerprint/index/<int:fingerprint_id>', methods=['PUT', 'DELETE'])
+def bind_fingerprint(fingerprint_id):
     """
-    Enroll new fingerprint on AS608 sensor
-    Multi-step process:
-    1. Place finger (first scan)
-    2. Remove finger
-    3. Place same finger (second scan)
-    4. Create and store template
+    PUT binds an enrolled fingerprint to a slot, replacing the slot's owner
+    Body: { "slotNumber": 5, "sessionId": "optional" }. DELETE unbinds it.
     """
-    data = request.json
-    fingerprint_id = data.get('userId', data.get('fingerprintId', 1))
+    if request.method == 'DELETE':
+        if not fingerprint_index.unbind(fingerprint_id):
+            return jsonify({'success': False, 'error': 'Fingerprint is not bound'}), 404
+        return jsonify({'success': True}), 200
     
-    print(f"\n{'='*50}")
-    print(f"FINGERPRINT ENROLLMENT REQUEST")
-    print(f"{'='*50}")
-    print(f"Fingerprint ID: {fingerprint_id}")
-    print(f"Request from: {request.remote_addr}")
-    print(f"Timestamp: {time.strftime('%Y-%m-%d %H:%M:%S')}")
-    print("Starting AS608 enrollment process...")
-    print(f"{'='*50}\n")
+    data = request.get_json(silent=True) or {}
+    slot_number = data.get('slotNumber')
+    if not 1 <= fingerprint_id <= MAX_FINGERPRINT_ID or not isinstance(slot_number, int):
+        return jsonify({
+            'success': False,
+            'error': f'Needs a fingerprint ID within 1-{MAX_FINGERPRINT_ID} and an integer slotNumber'
+        }), 400
     
-    result = send_arduino_command('FINGERPRINT_ENROLL', {
-        'userId': fingerprint_id
-    }, timeout=30)  # Longer timeout for enrollment
+    binding = fingerprint_index.bind(fingerprint_id, slot_number, data.get('sessionId'))
+    return jsonify({'success': True, **binding}), 200
+
+@app.route('/api/coin-slot', methods=['GET'])
+def get_coin_value():
+    """
+    Get coin slot value - called by UI for real-time detection
+    Served from coins the Arduino pushed on its own, so no serial round trip
+    Returns: { "value": coin_amount, "timestamp": detection_time }
+    """
+    event = coin_hub.claim()
+    
+    # Simulation mode never sees a coin - user can use "Simulate" button in UI
+    if event is None:
+        return jsonify({
+            'value': 0,
+            'timestamp': 0
+        }), 200
+    
+    log.info(f"💰 Coin detected: ₱{event.value:.2f}", extra={'fields': {'timestamp': event.timestamp}})
+    
+    return jsonify({
+        'value': event.value,
+        'timestamp': event.timestamp
+    }), 200
+
+@app.route('/api/coins', methods=['GET'])
+def get_coins():
+    """
+    Coins recorded in the ledger after a cursor, oldest first
+    Query: ?since=<id>&limit=100. Pass the returned cursor as `since` next time.
+    Returns: { "coins": [ { "id", "board", "value", "timestamp", "pulses", "receivedAt" } ], "cursor": id }
+    """
+    since = request.args.get('since', 0, type=int)
+    limit = request.args.get('limit', 100, type=int)
     
-    print(f"\n{'='*50}")
-    print(f"ENROLLMENT RESULT")
-    print(f"{'='*50}")
-    print(f"Raw result: {result}")
-    print(f"{'='*50}\n")
+    coins = broker.call('coins_since', since, limit) if broker else coin_ledger.since(since, limit)
+    return jsonify({
+        'coins': coins,
+        'cursor': coins[-1]['id'] if coins else since
+    }), 200
+
+def parse_event_id(value):
+    """Last-Event-ID (or ?since=) of a reconnecting stream client; 0 if missing or garbled"""
+    try:
+        return int(value)
+    except ValueError:
+        return 0
+
+@app.route('/api/coin-events', methods=['GET'])
+def stream_coin_events():
+    """
+    Stream coin events as they are pushed by the Arduino (server-sent events)
+    Reconnecting clients send Last-Event-ID (or ?since=) to replay missed coins
+    """
+    last_event_id = parse_event_id(request.headers.get('Last-Event-ID', request.args.get('since', '0')))
+    return Response(coin_hub.stream(last_event_id), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def log_enrollment_request(fingerprint_id, remote_addr):
+    log.info("FINGERPRINT ENROLLMENT REQUEST: starting AS608 enrollment process...",
+             extra={'fields': {'fingerprintId': fingerprint_id, 'remote': remote_addr}})
+
+def enrollment_response(fingerprint_id, result, slot_number=None, session_id=None):
+    """
+    Log the enrollment outcome and build the API response and status
+    A successful enrollment for a slot binds the ID to it (see identify)
+    """
+    log.debug(f"Raw enrollment result: {result}")
     
     if result.get('success'):
-        print(f"✓ SUCCESS: Fingerprint {fingerprint_id} enrolled!")
-        print(f"=== Enrollment Complete ===\n")
-        return jsonify({
+        log.info(f"✓ ENROLLMENT SUCCESS: Fingerprint {fingerprint_id} enrolled!")
+        if slot_number is not None:
+            fingerprint_index.bind(fingerprint_id, slot_number, session_id)
+        return {
             'success': True,
             'fingerprintId': fingerprint_id,
             'message': 'Fingerprint enrolled successfully'
-        }), 200
+        }, 200
     else:
         error_msg = result.get('message', result.get('error', 'Unknown error'))
         hint = result.get('hint', '')
-        print(f"✗ FAILED: Enrollment unsuccessful")
-        print(f"  Error: {error_msg}")
+        fields = {'fingerprintId': fingerprint_id, 'error': error_msg}
         if hint:
-            print(f"  Hint: {hint}")
-        print(f"=== Enrollment Failed ===\n")
+            fields['hint'] = hint
+        log.warning("✗ ENROLLMENT FAILED: Enrollment unsuccessful", extra={'fields': fields})
         
         response_data = {
             'success': False,
@@ -403,53 +1153,373 @@ def enroll_fingerprint():
         if hint:
             response_data['hint'] = hint
         
-        return jsonify(response_data), 500
+        return response_data, 500
+
+@app.route('/api/fingerprint/enroll', methods=['POST'])
+def enroll_fingerprint():
+    """
+    Enroll new fingerprint on AS608 sensor
+    Multi-step process:
+    1. Place finger (first scan)
+    2. Remove finger
+    3. Place same finger (second scan)
+    4. Create and store template
+    Optional "slotNumber" (and "sessionId") bind the new ID to that slot
+    With "background": true it returns 202 at once and the steps stream
+    from /api/jobs/<jobId>/events (see start_sensor_job)
+    """
+    data = request.json
+    fingerprint_id = data.get('userId', data.get('fingerprintId', 1))
+    
+    log_enrollment_request(fingerprint_id, request.remote_addr)
+    
+    if data.get('background'):
+        payload, status = start_sensor_job('fingerprint-enroll', enroll_fingerprint_job, 'Enrollment started',
+                                           fingerprint_id=fingerprint_id, slot_number=data.get('slotNumber'),
+                                           session_id=data.get('sessionId'))
+        return jsonify(payload), status
+    
+    result = send_arduino_command('FINGERPRINT_ENROLL', {
+        'userId': fingerprint_id
+    }, timeout=30)  # Longer timeout for enrollment
+    
+    payload, status = enrollment_response(fingerprint_id, result, data.get('slotNumber'), data.get('sessionId'))
+    return jsonify(payload), status
+
+@app.route('/api/slots', methods=['GET'])
+def get_slots():
+    """Last confirmed relay/lock/UV state of every slot (no serial I/O)"""
+    return jsonify({'slots': slot_states.all()}), 200
+
+@app.route('/api/slots/<int:slot_number>', methods=['GET'])
+def get_slot(slot_number):
+    """Last confirmed relay/lock/UV state of one slot (no serial I/O)"""
+    state = slot_states.get(slot_number)
+    if state is None:
+        return jsonify({'success': False, 'error': 'Slot not found'}), 404
+    
+    return jsonify(state), 200
+
+def health_status():
+    """`arduino` is the primary board; `boards` lists every board"""
+    primary = boards.primary
+    return {
+        'status': 'healthy' if boards.ready else 'warming',
+        'arduino_connected': primary.link is not None,
+        'arduino': primary.status(),
+        'command_queues': primary.scheduler.queue_stats() if primary.scheduler else {},
+        'boards': boards.status(),
+        'sessions': {
+            'charging': sum(session['state'] == 'charging' for session in charging_sessions.all()),
+            'expiredTotal': charging_sessions.expired,
+            'cancelledTotal': charging_sessions.cancelled,
+            'powerOffAlerts': charging_sessions.power_off_alerts,
+            'powerOffBatches': charging_sessions.power_off_batches
+        }
+    }
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
+    return jsonify(broker.call('health_status') if broker else health_status()), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics (text exposition format)"""
+    body = broker.call('render_metrics') if broker else metrics.registry.render()
+    return Response(body, content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/debug/profiles', methods=['GET', 'DELETE'])
+def get_profiles():
+    """
+    Timelines of the slowest profiled requests, slowest first
+    Query: ?limit=10. DELETE clears them.
+    """
+    if request.method == 'DELETE':
+        profiler.clear()
+        return jsonify({'success': True}), 200
+    
     return jsonify({
-        'status': 'healthy',
-        'arduino_connected': arduino is not None
+        'profiled': profiler.profiled,
+        'slowest': profiler.slowest(request.args.get('limit', 10, type=int))
     }), 200
 
-@app.route('/api/fingerprint/delete-all', methods=['POST'])
-def delete_all_fingerprints():
-    """Delete all fingerprints manually"""
-    print("\n⚠️ Attempting to delete all fingerprints...")
+@app.route('/api/debug/serial-traffic', methods=['GET'])
+def get_serial_traffic():
+    """
+    Most recent serial lines in both directions, newest last
+    Query: ?limit=100&command=READ_COIN
+    """
+    limit = request.args.get('limit', 100, type=int)
+    command = request.args.get('command')
+
+    return jsonify({
+        'traffic': broker.call('serial_traffic', limit, command) if broker else serial_traffic.recent(limit, command),
+        'droppedLogRecords': dropped_records()
+    }), 200
+
+def delete_fingerprints_job(job, first_id, last_id):
+    """
+    Background job: delete a range of fingerprints from the AS608
+    The whole database is cleared with one FINGERPRINT_EMPTY command; a
+    partial range with one FINGERPRINT_DELETE_RANGE command. Firmware that
+    knows neither gets one FINGERPRINT_DELETE per ID.
+    """
+    total = last_id - first_id + 1
+    job.update(done=0, total=total, message='Deleting fingerprints...')
+    
+    def report_progress(message):
+        if 'progress' in message:
+            job.update(done=message['progress'], message=message.get('status'))
+    
+    if first_id == 1 and last_id == MAX_FINGERPRINT_ID:
+        result = send_arduino_command('FINGERPRINT_EMPTY', {}, timeout=30)
+    else:
+        result = send_arduino_command('FINGERPRINT_DELETE_RANGE', {
+            'from': first_id,
+            'to': last_id
+        }, timeout=60, on_update=report_progress)
+    
+    if result.get('message') != 'Unknown command':
+        if not result.get('success'):
+            raise RuntimeError(result.get('message', result.get('error', 'Unknown error')))
+        
+        deleted_count = result.get('deletedCount', total)
+        fingerprint_index.unbind_range(first_id, last_id)
+        job.update(done=total, message=f'Deleted {deleted_count} fingerprints')
+        log.info(f"✓ Deleted {deleted_count} fingerprints total")
+        return {'deleted_count': deleted_count}
     
-    # Delete fingerprints one by one (IDs 1-127)
+    # Older firmware: delete one by one (still goes through the scheduler,
+    # so other commands get through between deletes)
     deleted_count = 0
-    for fid in range(1, 128):
+    for done, fid in enumerate(range(first_id, last_id + 1), start=1):
         result = send_arduino_command('FINGERPRINT_DELETE', {
             'fingerprintId': fid
         })
         if result.get('success'):
             deleted_count += 1
-            print(f"✓ Deleted fingerprint ID {fid}")
+            fingerprint_index.unbind(fid)
+        job.update(done=done, message=f'Deleted fingerprint ID {fid}')
     
-    print(f"✓ Deleted {deleted_count} fingerprints total\n")
+    job.update(message=f'Deleted {deleted_count} fingerprints')
+    log.info(f"✓ Deleted {deleted_count} fingerprints total")
+    return {'deleted_count': deleted_count}
+
+@app.route('/api/fingerprint/delete-all', methods=['POST'])
+def delete_all_fingerprints():
+    """
+    Delete all fingerprints (or an ID range) as a background job
+    Body (optional): { "from": 1, "to": 127 }
+    Returns 202: { "jobId": ..., "statusUrl": "/api/jobs/<jobId>" }
+    """
+    data = request.get_json(silent=True) or {}
+    first_id = data.get('from', 1)
+    last_id = data.get('to', MAX_FINGERPRINT_ID)
+    
+    if not (isinstance(first_id, int) and isinstance(last_id, int)
+            and 1 <= first_id <= last_id <= MAX_FINGERPRINT_ID):
+        return jsonify({
+            'success': False,
+            'error': f'Fingerprint IDs must be within 1-{MAX_FINGERPRINT_ID}'
+        }), 400
+    
+    log.warning(f"⚠️ Deleting fingerprints {first_id}-{last_id} in the background...")
+    
+    job = jobs.start('fingerprint-delete', delete_fingerprints_job, first_id=first_id, last_id=last_id)
     
     return jsonify({
         'success': True,
-        'deleted_count': deleted_count,
-        'message': f'Deleted {deleted_count} fingerprints'
-    }), 200
+        'jobId': job.id,
+        'statusUrl': f'/api/jobs/{job.id}',
+        'message': f'Deleting fingerprints {first_id}-{last_id}'
+    }), 202
+
+# Status lines the firmware prints during enrollment, in order (job progress)
+ENROLL_STEPS = [
+    'Place finger on sensor',
+    'Remove finger',
+    'Place same finger again',
+    'Creating fingerprint template...',
+    'Storing fingerprint...',
+]
+
+def run_sensor_job(job, command, data, timeout):
+    """
+    Send a fingerprint command for a job: its status lines become job
+    events, and cancelling the job sends SENSOR_CANCEL to the firmware
+    """
+    started = threading.Event()
+    finished = threading.Event()
+    
+    def send_cancel():
+        # Only once our command holds the sensor; before that the firmware
+        # would cancel whichever fingerprint command is running instead
+        if started.is_set() and not finished.is_set():
+            log.info(f"✋ Cancelling {SENSOR_PROCESSES[command].lower()} job {job.id}")
+            send_arduino_command('SENSOR_CANCEL', {})
+    
+    def report_progress(message):
+        log_status_update(message)
+        if 'status' not in message:
+            return
+        step = message['status']
+        if command == 'FINGERPRINT_ENROLL' and step in ENROLL_STEPS:
+            job.update(done=ENROLL_STEPS.index(step), message=step)
+        else:
+            job.update(message=step)
+        if not started.is_set():
+            started.set()
+            if job.cancel_requested:
+                # Called on the reader thread, which must not wait for a reply
+                threading.Thread(target=send_cancel, name='sensor-cancel', daemon=True).start()
+    
+    job.on_cancel(send_cancel)
+    try:
+        return send_arduino_command(command, data, timeout=timeout, on_update=report_progress)
+    finally:
+        finished.set()
+
+def enroll_fingerprint_job(job, fingerprint_id, slot_number=None, session_id=None):
+    """Background job: enroll a fingerprint, reporting each step"""
+    job.update(done=0, total=len(ENROLL_STEPS), message='Starting enrollment...')
+    result = run_sensor_job(job, 'FINGERPRINT_ENROLL', {'userId': fingerprint_id}, timeout=30)
+    
+    payload, _ = enrollment_response(fingerprint_id, result, slot_number, session_id)
+    if not payload['success']:
+        job.result = payload
+        raise RuntimeError(payload['error'])
+    
+    job.update(done=len(ENROLL_STEPS), message=payload['message'])
+    return payload
+
+def verify_fingerprint_job(job, expected_id):
+    """Background job: verify a fingerprint; a non-match is a result, not a failure"""
+    job.update(message='Starting verification...')
+    result = run_sensor_job(job, 'FINGERPRINT_VERIFY', {'id': expected_id}, timeout=10)
+    if result.get('cancelled'):
+        raise RuntimeError('Cancelled')
+    
+    payload = verification_response(expected_id, result)
+    job.update(message='Fingerprint matched' if payload['isValid'] else 'Fingerprint not matched')
+    return payload
+
+def start_sensor_job(kind, target, message, **params):
+    """Start a fingerprint job ("background": true); returns the 202 response and status"""
+    job = jobs.start(kind, target, **params)
+    return {
+        'success': True,
+        'jobId': job.id,
+        'statusUrl': f'/api/jobs/{job.id}',
+        'eventsUrl': f'/api/jobs/{job.id}/events',
+        'cancelUrl': f'/api/jobs/{job.id}/cancel',
+        'message': message
+    }, 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Progress and result of a background job"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    return jsonify(job.to_dict()), 200
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """
+    Ask a background job to stop; fingerprint jobs release the sensor
+    Returns the job; it ends as "cancelled" unless it finished first
+    """
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    return jsonify(job.to_dict()), 200
+
+def job_event_stream(job_id, since, ndjson):
+    """
+    Yield a job's events until it finishes, then its final state
+    SSE: "progress" events, then one "finished" event. NDJSON: one object
+    per line, {"event": "progress" | "finished", ...}.
+    """
+    while True:
+        news = jobs.events(job_id, since, timeout=JOB_EVENTS_KEEPALIVE)
+        if news is None:
+            return
+        
+        yield from job_news_chunks(news, ndjson)
+        if news['job']['state'] in JOB_FINAL_STATES:
+            return
+        if news['events']:
+            since = news['events'][-1]['id']
+
+async def job_event_stream_async(job_id, since, ndjson):
+    """Same as job_event_stream, for the asyncio server: each long poll waits off the event loop"""
+    loop = asyncio.get_running_loop()
+    while True:
+        if broker:
+            news = await broker.call_async('job_events', job_id, since, JOB_EVENTS_KEEPALIVE)
+        else:
+            news = await loop.run_in_executor(None, functools.partial(
+                jobs.events, job_id, since, timeout=JOB_EVENTS_KEEPALIVE))
+        if news is None:
+            return
+        
+        for chunk in job_news_chunks(news, ndjson):
+            yield chunk
+        if news['job']['state'] in JOB_FINAL_STATES:
+            return
+        if news['events']:
+            since = news['events'][-1]['id']
+
+def job_news_chunks(news, ndjson):
+    """One long poll's events, then "finished" if the job has ended, or a keepalive if nothing happened"""
+    chunks = [format_job_event('progress', event, ndjson) for event in news['events']]
+    if news['job']['state'] in JOB_FINAL_STATES:
+        chunks.append(format_job_event('finished', news['job'], ndjson))
+    elif not news['events']:
+        chunks.append('{"event": "keepalive"}\n' if ndjson else ': keepalive\n\n')
+    return chunks
+
+def format_job_event(name, payload, ndjson):
+    if ndjson:
+        return json.dumps({'event': name, **payload}) + '\n'
+    event_id = f"id: {payload['id']}\n" if name == 'progress' else ''
+    return f"{event_id}event: {name}\ndata: {json.dumps(payload)}\n\n"
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """
+    Follow a background job as it runs (server-sent events)
+    ?format=ndjson (or Accept: application/x-ndjson) streams JSON lines
+    instead. Reconnecting clients send Last-Event-ID (or ?since=).
+    """
+    if jobs.get(job_id) is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    since = parse_event_id(request.headers.get('Last-Event-ID', request.args.get('since', '0')))
+    ndjson = (request.args.get('format') == 'ndjson'
+              or request.accept_mimetypes.best == 'application/x-ndjson')
+    return Response(job_event_stream(job_id, since, ndjson),
+                    mimetype='application/x-ndjson' if ndjson else 'text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 if __name__ == '__main__':
     print("\n" + "="*60)
     print("SOLAR CHARGING STATION - Python API")
     print("="*60)
     print(f"Port: 8000")
-    print(f"Arduino: {'Connected ✓' if arduino else 'Simulated mode ⚠️'}")
+    for port, first, last in ARDUINO_BOARDS:
+        print(f"Arduino: {port}, slots {first}-{last} (attaching in background, see /health)")
     print("="*60 + "\n")
     
-    if arduino:
-        print("Ready to receive commands from Blazor app!")
-        print("Watch this terminal for real-time Arduino communication.\n")
-    else:
-        print("⚠️  Running in SIMULATION mode!")
-        print("Connect Arduino and restart for hardware control.\n")
+    print("Ready to receive commands from Blazor app!")
+    print("Watch this terminal for real-time Arduino communication.\n")
     
-    app.run(host='127.0.0.1', port=8000, debug=True)
+    # No reloader: it would re-run this module in a second process, and both
+    # processes' reader threads would then compete for the serial port
+    app.run(host='127.0.0.1', port=8000, debug=True, use_reloader=False)
 
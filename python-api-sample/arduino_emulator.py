@@ -0,0 +1,761 @@
+"""
+Virtual Arduino for hardware-free testing
+Opens a pseudo-terminal and speaks the solar5.ino serial protocol on it:
+RELAY, SOLENOID (with duration), UV_LIGHT, READ_COIN, UNLOCK_TEMP, BATCH,
+FINGERPRINT_*, SENSOR_CANCEL, TELEMETRY, LINK_UPGRADE/PING, seq echo and
+binary frames. Command latency and the UART's baud-rate throughput are modelled,
+and coins, noise lines and stalls can be injected, so the bridge sees
+realistic timing instead of SIMULATION mode's instant replies.
+
+Run with:
+    python arduino_emulator.py --link /tmp/ttyARDUINO
+    ARDUINO_PORT=/tmp/ttyARDUINO python app.py
+
+Type `help` at the emulator prompt for the injection commands.
+"""
+
+import argparse
+import json
+import math
+import os
+import pty
+import random
+import select
+import struct
+import sys
+import threading
+import time
+import tty
+
+import binary_protocol
+from slot_state import SOLENOID_SLOTS, TOTAL_SLOTS, UV_LIGHT_SLOTS
+
+BOOT_BAUD_RATE = 9600
+SUPPORTED_BAUD_RATES = (9600, 19200, 38400, 57600, 115200)
+LINK_UPGRADE_TIMEOUT = 2
+
+# Seconds of board time per command, before the reply is written
+COMMAND_LATENCY = {
+    'RELAY': 0.001,
+    'SOLENOID': 0.001,
+    'UV_LIGHT': 0.001,
+    'READ_COIN': 0.001,
+    'BATCH': 0.002,
+    'PING': 0.0005,
+    'LINK_UPGRADE': 0.001,
+    'TELEMETRY': 0.0005,
+}
+TEMP_UNLOCK_TIME = 2.0          # TEMP_UNLOCK_MS
+FINGER_DELAY = 1.5              # How long a user takes to present a finger
+SENSOR_OPERATION_TIME = 0.15    # image2Tz/search/store on the AS608
+DELETE_MODEL_TIME = 0.03        # One deleteModel round trip to the AS608
+VERIFY_TIMEOUT = 5
+ENROLL_REMOVE_FINGER_TIME = 2.0
+
+MAX_BATCH_OPS = 16
+MAX_FINGERPRINT_ID = 127
+
+# Matches the firmware's coin constants
+COIN_PULSES_PER_PESO = 4
+COIN_SETTLE_TIME = 0.3
+COIN_HOLD_WINDOW = 5
+COIN_CLEAR_DELAY = 8
+
+# Telemetry: slots with a current sensor (CURRENT_SENSE_PINS) and the
+# current a charging device draws, in mA
+TELEMETRY_SLOTS = range(7, 16)
+LAPTOP_SLOTS = range(13, 16)
+PHONE_DRAW = (900, 2100)
+LAPTOP_DRAW = (2500, 4000)
+SENSOR_NOISE = 25  # mA around zero with the relay off
+MIN_TELEMETRY_INTERVAL = 0.25
+
+# Outcomes the virtual finger can produce on the next scan
+FINGER_MODES = ('match', 'wrong', 'unknown', 'none', 'messy')
+
+
+class SensorCancelled(Exception):
+    """SENSOR_CANCEL arrived while a fingerprint job was waiting"""
+
+
+class VirtualArduino:
+    """
+    A board on the master side of a pty.
+    Like the firmware, one command runs at a time (the `cpu` lock); a
+    fingerprint job releases it while it waits on the sensor, which is
+    when short commands get through (waitServicingSerial).
+    """
+
+    def __init__(self, latency_scale=1.0, finger_delay=FINGER_DELAY, enrolled=(), boot_time=0.5,
+                 telemetry_interval=0):
+        self.latency_scale = latency_scale
+        self.finger_delay = finger_delay
+        self.boot_time = boot_time
+        self.baud_rate = BOOT_BAUD_RATE
+        self.finger_mode = 'match'
+        self.finger_id = None  # Template the next finger matches on identify (lowest if None)
+        self.templates = set(enrolled)
+        self.telemetry_interval = telemetry_interval
+        self._draw = {}  # slot -> mA its device draws while the relay is on
+
+        self.master = None
+        self.path = None
+        self._link_path = None
+        self._cpu = threading.Lock()
+        self._tx = threading.Lock()
+        self._sensor_busy = False
+        self._sensor_cancel = threading.Event()
+        self._running = False
+        self.port_open = False  # Someone has the slave side open
+
+        self.relays = {}
+        self.locks = {}
+        self.uv_lights = {}
+        self._relocks = {}  # slot -> pending relock (relockAt in the firmware)
+        self._coin_value = 0.0
+        self._coin_time = 0
+        self._coin_processed = False
+        self._boot_monotonic = time.monotonic()
+        self.stats = {'commands': 0, 'frames': 0, 'bytesIn': 0, 'bytesOut': 0}
+
+    # --- Port -------------------------------------------------------------
+
+    def open(self, link_path=None):
+        """Create the pty; returns the path the bridge should open"""
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.path = os.ttyname(slave)
+        # Not kept open: the master then sees a hangup until the bridge opens
+        # the port, which is how _serve notices an open (see there)
+        os.close(slave)
+
+        if link_path:
+            if os.path.islink(link_path):
+                os.unlink(link_path)
+            os.symlink(self.path, link_path)
+            self._link_path = link_path
+        return link_path or self.path
+
+    def close(self):
+        self._running = False
+        if self._link_path and os.path.islink(self._link_path):
+            os.unlink(self._link_path)
+        if self.master is not None:
+            os.close(self.master)
+            self.master = None
+
+    def start(self):
+        """Boot and serve the port from a background thread"""
+        self._running = True
+        threading.Thread(target=self._serve, name='virtual-arduino', daemon=True).start()
+        threading.Thread(target=self._push_telemetry, name='virtual-telemetry', daemon=True).start()
+
+    def _transfer_time(self, byte_count):
+        # 8N1 framing: 10 bits on the wire per byte
+        return byte_count * 10 / self.baud_rate
+
+    def write(self, data):
+        """Write bytes at the current baud rate; the TX line is shared"""
+        with self._tx:
+            time.sleep(self._transfer_time(len(data)))
+            if self.master is None or not self.port_open:
+                return  # Unplugged, or nobody listening (a UART drops it too)
+            os.write(self.master, data)
+            self.stats['bytesOut'] += len(data)
+
+    def send_json(self, message, seq=None):
+        if seq is not None:
+            message = dict(message, seq=seq)
+        self.write((json.dumps(message, separators=(',', ':')) + '\r\n').encode())
+
+    def send_response(self, success, message, seq=None):
+        self.send_json({'success': success, 'message': message}, seq)
+
+    def send_status(self, status, seq=None):
+        self.send_json({'status': status}, seq)
+
+    # --- Board lifecycle ----------------------------------------------------
+
+    def millis(self):
+        return int((time.monotonic() - self._boot_monotonic) * 1000)
+
+    def reset(self):
+        """Power-on defaults and the startup banner, as after a DTR reset"""
+        with self._cpu:
+            self.baud_rate = BOOT_BAUD_RATE
+            self._boot_monotonic = time.monotonic()
+            self.relays = {slot: False for slot in range(1, TOTAL_SLOTS + 1)}
+            self.locks = {slot: True for slot in SOLENOID_SLOTS}
+            self.uv_lights = {slot: False for slot in UV_LIGHT_SLOTS}
+            self._coin_value = 0.0
+            self._coin_processed = False
+            time.sleep(self.boot_time)
+
+            self.send_status('AS608 Fingerprint sensor found and verified')
+            if self.templates:
+                self.send_status(f'AS608 has {len(self.templates)} fingerprints enrolled')
+            else:
+                self.send_status('AS608 database is empty (no fingerprints enrolled)')
+            self.send_status('Arduino Ready')
+
+    def _serve(self):
+        self.reset()
+        buffer = bytearray()
+        while self._running:
+            # With the slave side closed the master reads as hung up at once;
+            # a quiet open port just times out
+            chunk = None
+            if select.select([self.master], [], [], 0.1)[0]:
+                try:
+                    chunk = os.read(self.master, 1024)
+                except OSError:
+                    chunk = b''
+                if not chunk:
+                    # No reader on the slave side (bridge not started or gone)
+                    self.port_open = False
+                    time.sleep(0.1)
+                    continue
+            if not self.port_open:
+                # Opening the port raises DTR, which resets a Mega: it boots
+                # again (bytes sent meanwhile are lost in the bootloader) and
+                # the bridge gets a fresh banner
+                self.port_open = True
+                buffer.clear()
+                self.reset()
+                continue
+            if chunk is None:
+                continue
+
+            self.stats['bytesIn'] += len(chunk)
+            time.sleep(self._transfer_time(len(chunk)))
+            buffer.extend(chunk)
+            self._consume(buffer)
+
+    def _consume(self, buffer):
+        while buffer:
+            if buffer[0] == binary_protocol.FRAME_START:
+                if len(buffer) < 2 or len(buffer) < buffer[1] + 3:
+                    return
+                length = buffer[1]
+                payload = bytes(buffer[2:2 + length])
+                checksum = buffer[2 + length]
+                del buffer[:length + 3]
+                if binary_protocol.crc8(bytes([length]) + payload) == checksum:
+                    self._run_short(self.handle_frame, payload)
+                continue
+
+            end = buffer.find(b'\n')
+            if end < 0:
+                return
+            line = bytes(buffer[:end]).decode('utf-8', errors='ignore').strip()
+            del buffer[:end + 1]
+            if line:
+                self._dispatch_line(line)
+
+    def _dispatch_line(self, line):
+        try:
+            message = json.loads(line)
+            command = message['command']
+        except (ValueError, KeyError, TypeError):
+            self.send_response(False, 'Invalid JSON')
+            return
+
+        data = message.get('data') or {}
+        seq = message.get('seq')
+        self.stats['commands'] += 1
+
+        if command.startswith('FINGERPRINT_'):
+            if self._sensor_busy:
+                self.send_response(False, 'Fingerprint sensor busy', seq)
+                return
+            self._sensor_busy = True
+            self._sensor_cancel.clear()
+            threading.Thread(target=self._run_sensor_job, args=(command, data, seq), daemon=True).start()
+        else:
+            self._run_short(self.handle_command, command, data, seq)
+
+    def _run_short(self, handler, *args):
+        with self._cpu:
+            handler(*args)
+
+    def _run_sensor_job(self, command, data, seq):
+        try:
+            handler = SENSOR_HANDLERS.get(command)
+            if handler is None:
+                with self._cpu:
+                    self.send_response(False, 'Unknown command', seq)
+            else:
+                handler(self, data, seq)
+        except SensorCancelled:
+            with self._cpu:
+                self.send_json({'success': False, 'cancelled': True, 'message': 'Cancelled',
+                                'error': 'Cancelled'}, seq)
+        finally:
+            self._sensor_busy = False
+
+    def _sensor_wait(self, seconds):
+        """waitServicingSerial: short commands (SENSOR_CANCEL too) run while the job waits"""
+        if self._sensor_cancel.wait(seconds * self.latency_scale):
+            raise SensorCancelled()
+
+    def _sensor_step(self, callback):
+        """A blocking AS608 transaction: the board does nothing else"""
+        with self._cpu:
+            time.sleep(SENSOR_OPERATION_TIME * self.latency_scale)
+            return callback()
+
+    # --- Short commands -----------------------------------------------------
+
+    def handle_command(self, command, data, seq):
+        time.sleep(COMMAND_LATENCY.get(command, 0.001) * self.latency_scale)
+
+        if command == 'RELAY':
+            ok = self._set('RELAY', data.get('slot'), data.get('state'))
+            self.send_response(ok, 'Relay controlled' if ok else 'Invalid slot number for relay', seq)
+        elif command == 'SOLENOID':
+            self._handle_solenoid(data, seq)
+        elif command == 'UV_LIGHT':
+            ok = self._set('UV_LIGHT', data.get('slot'), data.get('state'))
+            self.send_response(ok, 'UV light controlled' if ok else 'Slot does not support UV sanitization', seq)
+        elif command == 'READ_COIN':
+            self.send_json(self._read_coin(), seq)
+        elif command == 'UNLOCK_TEMP':
+            slot = data.get('slot')
+            if slot not in self.locks:
+                self.send_response(False, 'Slot does not support temporary unlock', seq)
+                return
+            self._unlock_for(slot, TEMP_UNLOCK_TIME)
+            self.send_response(True, 'Temporary unlock started', seq)
+        elif command == 'BATCH':
+            self._handle_batch(data.get('ops'), seq)
+        elif command == 'LINK_UPGRADE':
+            self._handle_link_upgrade(data, seq)
+        elif command == 'SENSOR_CANCEL':
+            if self._sensor_busy:
+                self._sensor_cancel.set()
+                self.send_response(True, 'Cancelling', seq)
+            else:
+                self.send_response(False, 'No fingerprint job running', seq)
+        elif command == 'TELEMETRY':
+            interval = data.get('interval', 1000)
+            self.telemetry_interval = interval and max(interval / 1000, MIN_TELEMETRY_INTERVAL)
+            self.send_response(True, 'Telemetry interval set' if interval else 'Telemetry off', seq)
+        elif command == 'PING':
+            self.send_response(True, 'pong', seq)
+        else:
+            self.send_response(False, 'Unknown command', seq)
+
+    def _set(self, command, slot, value):
+        table = {'RELAY': self.relays, 'SOLENOID': self.locks, 'UV_LIGHT': self.uv_lights}[command]
+        if slot not in table:
+            return False
+        if command == 'SOLENOID':
+            self._cancel_relock(slot)  # An explicit command replaces any timed unlock
+        table[slot] = bool(value)
+        return True
+
+    def _unlock_for(self, slot, seconds):
+        """Unlock now and re-lock later without blocking (unlockFor)"""
+        self._cancel_relock(slot)
+        self.locks[slot] = False
+        relock = threading.Timer(seconds * self.latency_scale, self._relock, args=(slot,))
+        relock.daemon = True
+        self._relocks[slot] = relock
+        relock.start()
+
+    def _relock(self, slot):
+        self._relocks.pop(slot, None)
+        self.locks[slot] = True
+
+    def _cancel_relock(self, slot):
+        relock = self._relocks.pop(slot, None)
+        if relock is not None:
+            relock.cancel()
+
+    def _handle_solenoid(self, data, seq):
+        slot, lock, duration = data.get('slot'), data.get('lock'), data.get('duration') or 0
+        if not self._set('SOLENOID', slot, lock):
+            self.send_response(False, 'Slot does not support solenoid control', seq)
+            return
+        if duration > 0 and not lock:
+            self._unlock_for(slot, duration)
+            self.send_response(True, 'Solenoid timed unlock started', seq)
+        else:
+            self.send_response(True, 'Solenoid controlled', seq)
+
+    def _handle_batch(self, ops, seq):
+        if not ops:
+            self.send_response(False, 'Batch has no operations', seq)
+            return
+        if len(ops) > MAX_BATCH_OPS:
+            self.send_response(False, 'Too many operations in batch', seq)
+            return
+
+        results = []
+        for name, slot, value in ops:
+            if name == 'UNLOCK_TEMP':
+                supported = slot in self.locks
+                if supported:
+                    self._unlock_for(slot, TEMP_UNLOCK_TIME)
+            elif name in ('RELAY', 'SOLENOID', 'UV_LIGHT'):
+                supported = self._set(name, slot, value)
+            else:
+                results.append(2)
+                continue
+            results.append(0 if supported else 1)
+
+        self.send_json({'success': True, 'results': results}, seq)
+
+    def _handle_link_upgrade(self, data, seq):
+        baud = data.get('baud', self.baud_rate)
+        if baud not in SUPPORTED_BAUD_RATES:
+            self.send_response(False, 'Unsupported baud rate', seq)
+            return
+        self.send_json({'success': True, 'baud': baud, 'binary': bool(data.get('binary'))}, seq)
+        # A pty has no real line rate; only the throughput model changes
+        self.baud_rate = baud
+
+    def _read_coin(self):
+        now = self.millis()
+        reply = {'success': True, 'value': 0.0}
+        if self._coin_value > 0 and not self._coin_processed and now - self._coin_time <= COIN_HOLD_WINDOW * 1000:
+            reply = {'success': True, 'value': self._coin_value, 'timestamp': self._coin_time}
+            self._coin_processed = True
+        if self._coin_value > 0 and now - self._coin_time > COIN_CLEAR_DELAY * 1000:
+            self._coin_value = 0.0
+            self._coin_processed = False
+        return reply
+
+    # --- Binary frames ------------------------------------------------------
+
+    def handle_frame(self, payload):
+        if len(payload) < 3:
+            return
+        opcode, seq = struct.unpack_from('<BH', payload)
+        command = binary_protocol.COMMANDS.get(opcode)
+        self.stats['frames'] += 1
+        time.sleep(COMMAND_LATENCY.get(command, 0.001) * self.latency_scale)
+
+        code = binary_protocol.RESULT_OK
+        extra = b''
+        if command == 'READ_COIN':
+            coin = self._read_coin()
+            extra = struct.pack('<HI', round(coin['value'] * 100), coin.get('timestamp', 0))
+        elif command in ('RELAY', 'UV_LIGHT') and len(payload) >= 5:
+            if not self._set(command, payload[3], payload[4]):
+                code = binary_protocol.RESULT_UNSUPPORTED_SLOT
+        elif command == 'SOLENOID' and len(payload) >= 7:
+            slot, lock, duration = struct.unpack_from('<BBH', payload, 3)
+            if not self._set(command, slot, lock):
+                code = binary_protocol.RESULT_UNSUPPORTED_SLOT
+            elif duration and not lock:
+                self._unlock_for(slot, duration)
+        else:
+            return  # Malformed; the firmware drops it and the bridge times out
+
+        reply = struct.pack('<BHB', opcode | binary_protocol.REPLY_FLAG, seq, code) + extra
+        self.write(binary_protocol.frame(reply))
+
+    # --- Telemetry ----------------------------------------------------------
+
+    def _push_telemetry(self):
+        """serviceTelemetry: averaged sensor readings every interval, no seq"""
+        while self._running:
+            time.sleep(self.telemetry_interval or 0.5)
+            if not self.telemetry_interval or self.master is None:
+                continue
+            with self._cpu:
+                self.send_json({'telemetry': {'v': self._bus_voltage(), 'i': [
+                    self._current(slot) for slot in range(1, TOTAL_SLOTS + 1)]}})
+
+    def _current(self, slot):
+        if slot not in TELEMETRY_SLOTS:
+            return None
+        if not self.relays.get(slot):
+            self._draw.pop(slot, None)  # The next device draws its own current
+            return round(random.gauss(0, SENSOR_NOISE))
+        if slot not in self._draw:
+            self._draw[slot] = random.uniform(*(LAPTOP_DRAW if slot in LAPTOP_SLOTS else PHONE_DRAW))
+        return round(self._draw[slot] * random.uniform(0.95, 1.05))
+
+    def _bus_voltage(self):
+        """Solar bus in mV, following the time of day"""
+        day = time.localtime()
+        phase = (day.tm_hour * 3600 + day.tm_min * 60 + day.tm_sec) / 86400
+        return round(12000 + 1500 * math.sin(2 * math.pi * (phase - 0.25)) + random.gauss(0, 20))
+
+    # --- Injection ----------------------------------------------------------
+
+    def inject_coin(self, value):
+        """Drop a coin: push coinDetected once the pulse train settles"""
+        def settle():
+            time.sleep(COIN_SETTLE_TIME)
+            with self._cpu:
+                self._coin_value = float(value)
+                self._coin_time = self.millis()
+                self._coin_processed = False
+                self.send_json({
+                    'coinDetected': float(value),
+                    'pulses': int(value * COIN_PULSES_PER_PESO),
+                    'timestamp': self._coin_time,
+                })
+        threading.Thread(target=settle, daemon=True).start()
+
+    def inject_noise(self, text=None):
+        """A garbled or non-JSON line, as from a loose cable or debug print"""
+        self.write((text or 'X\x13?{"stat').encode() + b'\r\n')
+
+    def stall(self, seconds):
+        """Hang the main loop (e.g. a brown-out or a stuck sensor read)"""
+        def hang():
+            with self._cpu:
+                time.sleep(seconds)
+        threading.Thread(target=hang, daemon=True).start()
+
+    def run_chaos(self, coin_interval=0, noise_interval=0, stall_interval=0, stall_time=3):
+        """Background injections at random (exponential) intervals"""
+        def every(interval, action):
+            while self._running:
+                time.sleep(random.expovariate(1 / interval))
+                action()
+
+        if coin_interval:
+            threading.Thread(target=every, daemon=True, args=(
+                coin_interval, lambda: self.inject_coin(random.choice((1, 5, 10, 20))))).start()
+        if noise_interval:
+            threading.Thread(target=every, daemon=True, args=(noise_interval, self.inject_noise)).start()
+        if stall_interval:
+            threading.Thread(target=every, daemon=True, args=(
+                stall_interval, lambda: self.stall(stall_time))).start()
+
+
+# --- Fingerprint jobs ---------------------------------------------------------
+
+def verify_fingerprint(board, data, seq):
+    expected_id = data.get('id')
+    with board._cpu:
+        board.send_status('Waiting for finger on AS608 sensor...', seq)
+
+    mode = board.finger_mode
+    if mode == 'none':
+        board._sensor_wait(VERIFY_TIMEOUT)
+        reply = {'success': True, 'isValid': False, 'error': 'No finger detected or timeout'}
+    else:
+        board._sensor_wait(board.finger_delay)
+        if mode == 'messy':
+            reply = {'success': True, 'isValid': False, 'error': 'Image conversion failed'}
+        elif mode == 'wrong' and board.templates - {expected_id}:
+            matched = min(board.templates - {expected_id})
+            reply = {'success': True, 'isValid': False, 'error': 'Wrong fingerprint detected',
+                     'matchedId': matched, 'expectedId': expected_id, 'confidence': 87}
+        elif mode == 'match' and expected_id in board.templates:
+            reply = {'success': True, 'isValid': True, 'fingerprintId': expected_id,
+                     'confidence': 142, 'matchScore': 142}
+        else:
+            reply = {'success': True, 'isValid': False, 'error': 'No match found in database'}
+
+    board._sensor_step(lambda: board.send_json(reply, seq))
+
+
+def identify_fingerprint(board, data, seq):
+    with board._cpu:
+        board.send_status('Waiting for finger on AS608 sensor...', seq)
+
+    mode = board.finger_mode
+    if mode == 'none':
+        board._sensor_wait(VERIFY_TIMEOUT)
+        reply = {'success': True, 'found': False, 'error': 'No finger detected or timeout'}
+    else:
+        board._sensor_wait(board.finger_delay)
+        matched = board.finger_id if board.finger_id in board.templates else min(board.templates, default=None)
+        if mode == 'messy':
+            reply = {'success': True, 'found': False, 'error': 'Image conversion failed'}
+        elif mode in ('match', 'wrong') and matched is not None:
+            reply = {'success': True, 'found': True, 'fingerprintId': matched, 'confidence': 142}
+        else:
+            reply = {'success': True, 'found': False, 'error': 'No match found in database'}
+
+    board._sensor_step(lambda: board.send_json(reply, seq))
+
+
+def enroll_fingerprint(board, data, seq):
+    fingerprint_id = data.get('userId')
+
+    def status(text):
+        with board._cpu:
+            board.send_status(text, seq)
+
+    status('Starting AS608 fingerprint enrollment...')
+    status('Checking for existing fingerprint...')
+    existed = board._sensor_step(lambda: fingerprint_id in board.templates)
+    board.templates.discard(fingerprint_id)
+    status('Deleted existing fingerprint - ready for re-enrollment' if existed
+           else 'No existing fingerprint found - proceeding with enrollment')
+
+    status('Place finger on sensor')
+    if board.finger_mode == 'none':
+        board._sensor_wait(10)
+        return board._sensor_step(lambda: board.send_response(False, 'Timeout waiting for finger', seq))
+    board._sensor_wait(board.finger_delay)
+    if board.finger_mode == 'messy':
+        return board._sensor_step(lambda: board.send_response(
+            False, 'Image too messy - clean sensor and finger, press firmly', seq))
+    board._sensor_step(lambda: None)
+
+    status('Remove finger')
+    board._sensor_wait(ENROLL_REMOVE_FINGER_TIME)
+    status('Place same finger again')
+    board._sensor_wait(board.finger_delay)
+    board._sensor_step(lambda: None)
+
+    status('Creating fingerprint template...')
+    board._sensor_step(lambda: None)
+    status('Storing fingerprint...')
+
+    if not 1 <= (fingerprint_id or 0) <= MAX_FINGERPRINT_ID:
+        reply = {'success': False, 'fingerprintId': fingerprint_id,
+                 'error': 'Invalid fingerprint ID location', 'message': 'Use fingerprint ID between 1-127'}
+    else:
+        board.templates.add(fingerprint_id)
+        reply = {'success': True, 'message': 'Fingerprint enrolled successfully',
+                 'fingerprintId': fingerprint_id}
+    board._sensor_step(lambda: board.send_json(reply, seq))
+
+
+def delete_fingerprint(board, data, seq):
+    fingerprint_id = data.get('fingerprintId')
+    with board._cpu:
+        board.send_status('Deleting fingerprint from AS608 sensor...', seq)
+    board._sensor_step(lambda: board.templates.discard(fingerprint_id))
+    with board._cpu:
+        board.send_json({'success': True, 'message': 'Fingerprint deleted successfully',
+                         'fingerprintId': fingerprint_id}, seq)
+
+
+def delete_fingerprint_range(board, data, seq):
+    first_id, last_id = data.get('from', 1), data.get('to', MAX_FINGERPRINT_ID)
+    total = last_id - first_id + 1
+    deleted = 0
+    for fingerprint_id in range(first_id, last_id + 1):
+        with board._cpu:
+            time.sleep(DELETE_MODEL_TIME * board.latency_scale)
+            if fingerprint_id in board.templates:
+                board.templates.discard(fingerprint_id)
+                deleted += 1
+            done = fingerprint_id - first_id + 1
+            if done % 16 == 0 and done < total:
+                board.send_json({'status': 'Deleting fingerprints...', 'progress': done, 'total': total}, seq)
+        # waitServicingSerial(0) between deletes
+    with board._cpu:
+        board.send_json({'success': True, 'message': 'Fingerprint range deleted', 'deletedCount': deleted}, seq)
+
+
+def empty_fingerprints(board, data, seq):
+    with board._cpu:
+        board.send_status('Clearing fingerprint database...', seq)
+    count = board._sensor_step(lambda: len(board.templates))
+    board.templates.clear()
+    with board._cpu:
+        board.send_json({'success': True, 'message': 'Fingerprint database cleared', 'deletedCount': count}, seq)
+
+
+SENSOR_HANDLERS = {
+    'FINGERPRINT_VERIFY': verify_fingerprint,
+    'FINGERPRINT_IDENTIFY': identify_fingerprint,
+    'FINGERPRINT_ENROLL': enroll_fingerprint,
+    'FINGERPRINT_DELETE': delete_fingerprint,
+    'FINGERPRINT_DELETE_RANGE': delete_fingerprint_range,
+    'FINGERPRINT_EMPTY': empty_fingerprints,
+}
+
+
+# --- Console ------------------------------------------------------------------
+
+CONSOLE_HELP = """Commands:
+  coin <value>        drop a coin (1, 5, 10, 20)
+  noise [text]        write a non-JSON line
+  stall <seconds>     hang the board's main loop
+  finger <mode> [id]  next scans: match | wrong | unknown | none | messy
+                      (id: the template an identify scan matches)
+  enroll <id>         add a template to the virtual AS608
+  reset               reboot (banners, outputs back to defaults)
+  state               print slot outputs and counters
+  quit"""
+
+
+def run_console(board):
+    print(CONSOLE_HELP)
+    for line in sys.stdin:
+        parts = line.split()
+        if not parts:
+            continue
+        command, args = parts[0], parts[1:]
+        try:
+            if command == 'coin':
+                board.inject_coin(float(args[0]) if args else 5.0)
+            elif command == 'noise':
+                board.inject_noise(' '.join(args) or None)
+            elif command == 'stall':
+                board.stall(float(args[0]) if args else 3)
+            elif command == 'finger' and args and args[0] in FINGER_MODES:
+                board.finger_mode = args[0]
+                board.finger_id = int(args[1]) if len(args) > 1 else None
+            elif command == 'enroll':
+                board.templates.add(int(args[0]))
+            elif command == 'reset':
+                threading.Thread(target=board.reset, daemon=True).start()
+            elif command == 'state':
+                print(json.dumps({'baud': board.baud_rate, 'relays': board.relays, 'locks': board.locks,
+                                  'uvLights': board.uv_lights, 'templates': sorted(board.templates),
+                                  'stats': board.stats}))
+            elif command == 'quit':
+                return
+            else:
+                print(CONSOLE_HELP)
+        except (ValueError, IndexError) as e:
+            print(f"⚠ {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Virtual solar5.ino board on a pseudo-terminal')
+    parser.add_argument('--link', default='/tmp/ttyARDUINO', help='symlink to create for the pty slave')
+    parser.add_argument('--latency-scale', type=float, default=1.0, help='multiply all board-side delays')
+    parser.add_argument('--finger-delay', type=float, default=FINGER_DELAY, help='seconds to present a finger')
+    parser.add_argument('--enrolled', default='', help='comma-separated fingerprint IDs already enrolled')
+    parser.add_argument('--coin-interval', type=float, default=0, help='mean seconds between random coins')
+    parser.add_argument('--noise-interval', type=float, default=0, help='mean seconds between noise lines')
+    parser.add_argument('--stall-interval', type=float, default=0, help='mean seconds between stalls')
+    parser.add_argument('--stall-time', type=float, default=3, help='length of each injected stall')
+    parser.add_argument('--telemetry-interval', type=float, default=0,
+                        help='seconds between telemetry pushes (0 = off until the bridge sends TELEMETRY)')
+    parser.add_argument('--no-console', action='store_true', help='run without the stdin console')
+    args = parser.parse_args()
+
+    enrolled = [int(part) for part in args.enrolled.split(',') if part.strip()]
+    board = VirtualArduino(args.latency_scale, args.finger_delay, enrolled,
+                           telemetry_interval=args.telemetry_interval)
+    path = board.open(args.link)
+    board.start()
+    board.run_chaos(args.coin_interval, args.noise_interval, args.stall_interval, args.stall_time)
+
+    print(f"\n{'='*60}")
+    print(f"VIRTUAL ARDUINO")
+    print(f"{'='*60}")
+    print(f"Port: {path} -> {board.path}")
+    print(f"Start the bridge with: ARDUINO_PORT={path} python app.py")
+    print(f"{'='*60}\n")
+
+    try:
+        if args.no_console:
+            while True:
+                time.sleep(3600)
+        else:
+            run_console(board)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        board.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+"""
+Solar Charging Station - asyncio (ASGI) server mode
+Serves the same routes as app.py. Routes that wait on the Arduino run as
+native coroutines over a non-blocking serial transport, so a request that
+is waiting for a finger on the AS608 costs an awaiting coroutine rather
+than a parked OS thread. Event streams are native too: behind WsgiToAsgi
+every Flask call runs on one shared thread, which an open stream would hold
+for as long as it lasts. Every other route is passed through to the Flask
+app unchanged.
+
+In a broker worker (BROKER_SOCKET set) the bridge's sync helpers - slot
+timers, slot state, the fingerprint index, jobs - are blocking calls to the
+broker, so the native routes run them on the default executor rather than
+on the event loop.
+
+Run with:
+    pip install -r requirements-async.txt
+    python asgi_app.py
+or:
+    uvicorn asgi_app:application --host 127.0.0.1 --port 8000
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import re
+import time
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+import app as bridge
+import profiling
+from actuator_batch import BatchError
+from command_scheduler import DeadlineExceeded
+from serial_broker import BrokerError
+
+flask_application = WsgiToAsgi(bridge.app)
+
+
+class Request:
+    """The parts of an ASGI HTTP request the native routes need"""
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope.get('headers', [])}
+        self.args = {name: values[-1] for name, values in
+                     parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+        client = scope.get('client')
+        self.remote_addr = client[0] if client else None
+        self.params = {}  # Path parameters, e.g. {'job_id': ...} for /api/jobs/<job_id>/events
+        try:
+            self.json = json.loads(body) if body else None
+        except ValueError:
+            self.json = None
+
+
+async def call_bridge(function, *args, **kwargs):
+    """Run a sync bridge helper, off the event loop when it talks to the broker"""
+    if bridge.broker is None:
+        return function(*args, **kwargs)
+    # In a copy of this context, so the request's profile still applies
+    call = functools.partial(contextvars.copy_context().run, function, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(None, call)
+
+
+def actuator_route(build_command):
+    async def handle(request):
+        body = request.json or {}
+        command, data, timeout = build_command(body)
+        command, data, timer = bridge.split_timed_command(command, data)
+        result = await bridge.send_arduino_command_async(command, data, timeout=timeout,
+                                                         force=body.get('force', False) or timer is not None)
+        result = await call_bridge(bridge.schedule_follow_up, command, data, timer, result)
+        return result, 200 if result.get('success') else 500
+    return handle
+
+
+async def run_batch(request):
+    try:
+        operations = bridge.parse_batch_request(request.json)
+    except BatchError as e:
+        return {'success': False, 'error': str(e)}, 400
+
+    skipped = await call_bridge(bridge.skip_redundant_operations, operations, request.json.get('force', False))
+    to_send = [operation for operation, result in zip(operations, skipped) if result is None]
+
+    board_operations, timers = bridge.split_timed_operations(to_send)
+    results = await bridge.send_batch_async(board_operations)
+    sent = await call_bridge(bridge.schedule_batch_follow_ups, to_send, timers, results)
+    return bridge.batch_response(bridge.merge_batch_results(skipped, sent))
+
+
+async def verify_fingerprint(request):
+    data = request.json or {}
+    expected_id = data.get('fingerprintId')
+    bridge.log_verification_request(expected_id, request.remote_addr)
+
+    if data.get('background'):
+        return await call_bridge(bridge.start_sensor_job, 'fingerprint-verify', bridge.verify_fingerprint_job,
+                                 'Verification started', expected_id=expected_id)
+
+    result = await bridge.send_arduino_command_async('FINGERPRINT_VERIFY', {
+        'id': expected_id
+    }, timeout=10)
+
+    return bridge.verification_response(expected_id, result), 200
+
+
+async def enroll_fingerprint(request):
+    data = request.json or {}
+    fingerprint_id = data.get('userId', data.get('fingerprintId', 1))
+    bridge.log_enrollment_request(fingerprint_id, request.remote_addr)
+
+    if data.get('background'):
+        return await call_bridge(bridge.start_sensor_job, 'fingerprint-enroll', bridge.enroll_fingerprint_job,
+                                 'Enrollment started', fingerprint_id=fingerprint_id,
+                                 slot_number=data.get('slotNumber'), session_id=data.get('sessionId'))
+
+    result = await bridge.send_arduino_command_async('FINGERPRINT_ENROLL', {
+        'userId': fingerprint_id
+    }, timeout=30)
+
+    return await call_bridge(bridge.enrollment_response, fingerprint_id, result, data.get('slotNumber'),
+                             data.get('sessionId'))
+
+
+async def identify_fingerprint(request):
+    unlock = (request.json or {}).get('unlock', False)
+    bridge.log_identification_request(unlock, request.remote_addr)
+
+    result = await bridge.send_arduino_command_async('FINGERPRINT_IDENTIFY', {}, timeout=10)
+    if bridge.needs_identify_fallback(result):
+        result = await bridge.send_arduino_command_async(*bridge.IDENTIFY_FALLBACK, timeout=10)
+
+    payload = await call_bridge(bridge.identification_response, result)
+    if unlock and payload['slotNumber'] is not None:
+        command, data, timeout = bridge.unlock_temp_command({'slotNumber': payload['slotNumber']})
+        command, data, timer = bridge.split_timed_command(command, data)
+        reply = await bridge.send_arduino_command_async(command, data, timeout=timeout)
+        reply = await call_bridge(bridge.schedule_follow_up, command, data, timer, reply)
+        payload['unlocked'] = reply.get('success', False)
+    return payload, 200
+
+
+async def start_charging_session(request):
+    data = request.json or {}
+    rejected = await call_bridge(bridge.session_request_error, data)
+    if rejected:
+        return rejected
+
+    result = await bridge.send_arduino_command_async('RELAY', {'slot': data['slotNumber'], 'state': True},
+                                                     force=True)
+    return await call_bridge(bridge.begin_session, data, result)
+
+
+async def end_charging_session(request):
+    slot_number = request.params['slot_number']
+    if await call_bridge(bridge.charging_sessions.get, slot_number) is None:
+        return {'success': False, 'error': 'No session for this slot'}, 404
+
+    operations = await call_bridge(bridge.power_off_operations, [slot_number])
+    try:
+        powered_off = not bridge.unconfirmed_slots(operations, await bridge.send_batch_async(operations))
+    except DeadlineExceeded:
+        powered_off = False
+    return await call_bridge(bridge.end_session, slot_number, powered_off)
+
+
+async def stream_coin_events(request, receive, send):
+    last_event_id = bridge.parse_event_id(request.headers.get('last-event-id', request.args.get('since', '0')))
+    await send_stream(send, receive, bridge.coin_hub.stream_async(last_event_id))
+
+
+async def stream_job_events(request, receive, send):
+    job_id = request.params['job_id']
+    try:
+        job = await call_bridge(bridge.jobs.get, job_id)
+    except BrokerError as e:
+        bridge.log.error(f"❌ {e}")
+        await send_json(send, {'success': False, 'error': str(e)}, 503)
+        return
+    if job is None:
+        await send_json(send, {'success': False, 'error': 'Job not found'}, 404)
+        return
+
+    since = bridge.parse_event_id(request.headers.get('last-event-id', request.args.get('since', '0')))
+    accept = parse_accept_header(request.headers.get('accept'), MIMEAccept)
+    ndjson = request.args.get('format') == 'ndjson' or accept.best == 'application/x-ndjson'
+    await send_stream(send, receive, bridge.job_event_stream_async(job_id, since, ndjson),
+                      'application/x-ndjson' if ndjson else 'text/event-stream')
+
+
+# (method, path) -> coroutine returning (payload, status). Paths take
+# parameters the way Flask's do: <name> or <int:name>
+ROUTES = {('POST', path): actuator_route(build) for path, build in bridge.ACTUATOR_ROUTES.items()}
+ROUTES.update({
+    ('POST', '/api/batch'): run_batch,
+    ('POST', '/api/fingerprint/verify'): verify_fingerprint,
+    ('POST', '/api/fingerprint/identify'): identify_fingerprint,
+    ('POST', '/api/fingerprint/enroll'): enroll_fingerprint,
+    ('POST', '/api/sessions'): start_charging_session,
+    ('DELETE', '/api/sessions/<int:slot_number>'): end_charging_session,
+})
+
+# (method, path) -> coroutine that sends the whole streamed response
+STREAMS = {
+    ('GET', '/api/coin-events'): stream_coin_events,
+    ('GET', '/api/jobs/<job_id>/events'): stream_job_events,
+}
+
+PATH_PARAMETER = re.compile(r'<(?:(int):)?(\w+)>')
+
+
+def compile_path(path):
+    def parameter(match):
+        return f"(?P<{match.group(2)}>{'[0-9]+' if match.group(1) else '[^/]+'})"
+    return re.compile(PATH_PARAMETER.sub(parameter, path) + '$'), set(
+        name for converter, name in PATH_PARAMETER.findall(path) if converter)
+
+
+def compile_routes(routes):
+    """Exact paths in a dict, parameterized ones as (key, pattern, int parameters)"""
+    exact = {key for key in routes if '<' not in key[1]}
+    patterns = [(key, *compile_path(key[1])) for key in routes if '<' in key[1]]
+    return exact, patterns
+
+
+def find_route(table, method, path):
+    """(route key, path parameters) for a request; (None, None) if no route matches"""
+    exact, patterns = table
+    if (method, path) in exact:
+        return (method, path), {}
+    for key, pattern, int_parameters in patterns:
+        match = pattern.match(path) if key[0] == method else None
+        if match:
+            return key, {name: int(value) if name in int_parameters else value
+                         for name, value in match.groupdict().items()}
+    return None, None
+
+
+ROUTE_TABLE = compile_routes(ROUTES)
+STREAM_TABLE = compile_routes(STREAMS)
+
+CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def send_json(send, payload, status, headers=()):
+    body = json.dumps(payload).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())] + CORS_HEADERS + list(headers),
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_stream(send, receive, chunks, content_type='text/event-stream'):
+    """Send server-sent events (or NDJSON lines) until the generator ends or the client leaves"""
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', content_type.encode()),
+                    (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no')] + CORS_HEADERS,
+    })
+
+    async def pump():
+        async for chunk in chunks:
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})  # The stream has ended
+
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(wait_for_disconnect())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Let the pump unwind first; closing a generator it is still inside fails
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await chunks.aclose()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Serial reads move from the reader thread onto this event loop
+            # (now, or as soon as each board has been attached). A broker
+            # worker has no boards: serial_broker.py reads the ports
+            if bridge.boards:
+                bridge.boards.attach_event_loop(asyncio.get_running_loop())
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if bridge.boards:
+                bridge.boards.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    if scope['type'] != 'http':
+        await flask_application(scope, receive, send)
+        return
+
+    key, params = find_route(ROUTE_TABLE, scope['method'], scope['path'])
+    if key is not None:
+        started = time.perf_counter()
+        request = Request(scope, await read_body(receive))
+        request.params = params
+        # The event loop thread serves every request, so no stack sampling here
+        profile = None
+        if profiling.requested_mode(request.headers.get(profiling.PROFILE_HEADER.lower())):
+            profile = bridge.profiler.start(*key, 'timeline')
+        status = 500
+        headers = []
+        try:
+            payload, status = await ROUTES[key](request)
+        except DeadlineExceeded as e:
+            bridge.log.warning(f"🚦 {e}")
+            payload, retry_after = bridge.shed_response(e)
+            status = 503
+            headers.append((b'retry-after', str(retry_after).encode()))
+        except BrokerError as e:
+            bridge.log.error(f"❌ {e}")
+            payload = {'success': False, 'error': str(e)}
+            status = 503
+        finally:
+            if profile is not None:
+                timeline = bridge.profiler.finish(profile, status)
+                headers += [(b'server-timing', timeline.server_timing().encode()),
+                            (b'x-profile-id', str(timeline.id).encode())]
+        await send_json(send, payload, status, headers)
+        await call_bridge(bridge.record_http, *key, status, time.perf_counter() - started)
+        return
+
+    key, params = find_route(STREAM_TABLE, scope['method'], scope['path'])
+    if key is not None:
+        request = Request(scope, b'')
+        request.params = params
+        await STREAMS[key](request, receive, send)
+        return
+
+    await flask_application(scope, receive, send)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    print("\n" + "="*60)
+    print("SOLAR CHARGING STATION - Python API (asyncio mode)")
+    print("="*60)
+    print(f"Port: 8000")
+    for port, first, last in bridge.ARDUINO_BOARDS:
+        print(f"Arduino: {port}, slots {first}-{last} (attaching in background, see /health)")
+    print("="*60 + "\n")
+
+    uvicorn.run(application, host='127.0.0.1', port=8000)
@@ -0,0 +1,253 @@
+"""
+Concurrent HTTP load benchmark for the Python API bridge
+Runs many virtual kiosk clients against a running bridge with a traffic mix
+like ours: coin polling, bursts of relay/solenoid/UV calls, and occasional
+fingerprint verifies. Reports p50/p95/p99 per endpoint, throughput and error
+rate, and can save results and compare them with an earlier run.
+
+Run with (bridge on the virtual board, see arduino_emulator.py):
+    python benchmark.py --clients 20 --duration 60 --save results/v2.json
+    python benchmark.py --clients 20 --duration 60 --compare results/v2.json
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+BASE_URL = "http://localhost:8000"
+
+# Slots that actually have the hardware (see slot_state.py)
+RELAY_SLOTS = range(1, 17)
+SOLENOID_SLOTS = range(4, 17)
+UV_LIGHT_SLOTS = range(7, 13)
+
+# One kiosk's behaviour: action -> relative weight per step
+KIOSK_MIX = {
+    'coin_poll': 70,
+    'actuator_burst': 25,
+    'verify': 5,
+}
+COIN_POLL_INTERVAL = 0.5
+BURST_SIZE = (3, 6)
+THINK_TIME = (0.05, 0.3)
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Recorder:
+    """Thread-safe latency samples, keyed by endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._errors = {}
+
+    def record(self, endpoint, seconds, ok):
+        with self._lock:
+            self._samples.setdefault(endpoint, []).append(seconds * 1000)
+            if not ok:
+                self._errors[endpoint] = self._errors.get(endpoint, 0) + 1
+
+    def summary(self, elapsed):
+        with self._lock:
+            endpoints = {}
+            total = errors = 0
+            for endpoint, samples in sorted(self._samples.items()):
+                samples = sorted(samples)
+                failed = self._errors.get(endpoint, 0)
+                total += len(samples)
+                errors += failed
+                endpoints[endpoint] = {
+                    'requests': len(samples),
+                    'errors': failed,
+                    'error_rate': failed / len(samples),
+                    'throughput': len(samples) / elapsed,
+                    'mean_ms': sum(samples) / len(samples),
+                    'max_ms': samples[-1],
+                    **{f'p{p}_ms': percentile(samples, p) for p in PERCENTILES},
+                }
+
+        return {
+            'elapsed': elapsed,
+            'requests': total,
+            'errors': errors,
+            'error_rate': errors / total if total else 0,
+            'throughput': total / elapsed,
+            'endpoints': endpoints,
+        }
+
+
+class KioskClient:
+    """One virtual kiosk with its own keep-alive connection"""
+
+    def __init__(self, base_url, recorder, rng, fingerprint_ids, force=True):
+        url = urlparse(base_url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.recorder = recorder
+        self.rng = rng
+        self.fingerprint_ids = fingerprint_ids
+        self.force = force
+        self.connection = None
+
+    def request(self, method, path, body=None):
+        """Send one request and record its latency; True if it succeeded"""
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload else {}
+        started = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            self.connection.request(method, path, body=payload, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+            ok = response.status < 400
+        except (OSError, http.client.HTTPException):
+            ok = False
+            self.connection = None  # Reconnect on the next request
+        self.recorder.record(f'{method} {path}', time.perf_counter() - started, ok)
+        return ok
+
+    def coin_poll(self):
+        self.request('GET', '/api/coin-slot')
+        time.sleep(COIN_POLL_INTERVAL)
+
+    def actuator_burst(self):
+        # force=True: measure the serial path, not the redundant-command skip
+        for _ in range(self.rng.randint(*BURST_SIZE)):
+            kind = self.rng.choice(('relay', 'solenoid', 'uv-light'))
+            if kind == 'relay':
+                body = {'slotNumber': self.rng.choice(RELAY_SLOTS), 'state': self.rng.random() < 0.5}
+            elif kind == 'solenoid':
+                body = {'slotNumber': self.rng.choice(SOLENOID_SLOTS), 'lock': self.rng.random() < 0.5}
+            else:
+                body = {'slotNumber': self.rng.choice(UV_LIGHT_SLOTS), 'state': self.rng.random() < 0.5}
+            body['force'] = self.force
+            self.request('POST', f'/api/{kind}', body)
+
+    def verify(self):
+        self.request('POST', '/api/fingerprint/verify', {
+            'fingerprintId': self.rng.choice(self.fingerprint_ids)
+        })
+
+    def run(self, deadline, mix):
+        actions = list(mix)
+        weights = [mix[action] for action in actions]
+        while time.monotonic() < deadline:
+            getattr(self, self.rng.choices(actions, weights)[0])()
+            time.sleep(self.rng.uniform(*THINK_TIME))
+
+
+def run_benchmark(base_url, clients, duration, mix=KIOSK_MIX, fingerprint_ids=(1,), seed=None, force=True):
+    recorder = Recorder()
+    rng = random.Random(seed)
+    deadline = time.monotonic() + duration
+
+    threads = []
+    for number in range(clients):
+        client = KioskClient(base_url, recorder, random.Random(rng.random()), list(fingerprint_ids), force)
+        threads.append(threading.Thread(target=client.run, args=(deadline, mix),
+                                        name=f'kiosk-{number}', daemon=True))
+
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return recorder.summary(time.monotonic() - started)
+
+
+def format_ms(value):
+    return '-' if value is None else f'{value:8.1f}'
+
+
+def print_report(results, baseline=None):
+    print(f"\n{'='*96}")
+    print(f"BENCHMARK: {results['clients']} clients, {results['elapsed']:.1f}s, "
+          f"{results['throughput']:.1f} req/s, error rate {results['error_rate']:.2%}")
+    print(f"{'='*96}")
+    print(f"{'endpoint':32} {'reqs':>6} {'err%':>6} {'req/s':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+
+    for endpoint, stats in results['endpoints'].items():
+        print(f"{endpoint:32} {stats['requests']:6d} {stats['error_rate']:6.1%} {stats['throughput']:7.1f} "
+              f"{format_ms(stats['p50_ms'])} {format_ms(stats['p95_ms'])} "
+              f"{format_ms(stats['p99_ms'])} {format_ms(stats['max_ms'])}")
+
+        before = (baseline or {}).get('endpoints', {}).get(endpoint)
+        if before:
+            deltas = []
+            for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+                if before[key]:
+                    deltas.append(f"{key[:-3]} {(stats[key] - before[key]) / before[key]:+.0%}")
+            deltas.append(f"err {stats['error_rate'] - before['error_rate']:+.1%}")
+            print(f"{'  vs ' + baseline.get('label', 'baseline'):32} {', '.join(deltas)}")
+
+    if baseline:
+        change = (results['throughput'] - baseline['throughput']) / baseline['throughput']
+        print(f"\nThroughput vs {baseline.get('label', 'baseline')}: {change:+.1%}")
+    print(f"{'='*96}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent load benchmark for the kiosk API bridge')
+    parser.add_argument('--url', default=BASE_URL)
+    parser.add_argument('--clients', type=int, default=10, help='concurrent virtual kiosks')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run')
+    parser.add_argument('--fingerprint-ids', default='1', help='comma-separated IDs used for verifies')
+    parser.add_argument('--no-verify', action='store_true', help='leave fingerprint verifies out of the mix')
+    parser.add_argument('--no-force', action='store_true', help='let the bridge skip redundant actuator calls')
+    parser.add_argument('--seed', type=int, help='seed for a repeatable request sequence')
+    parser.add_argument('--label', help='name for this run in saved results (e.g. a git tag)')
+    parser.add_argument('--save', help='write results as JSON to this path')
+    parser.add_argument('--compare', help='earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    mix = dict(KIOSK_MIX)
+    if args.no_verify:
+        mix.pop('verify')
+    fingerprint_ids = [int(part) for part in args.fingerprint_ids.split(',')]
+
+    print(f"Running {args.clients} kiosk clients against {args.url} for {args.duration:.0f}s...")
+    results = run_benchmark(args.url, args.clients, args.duration, mix, fingerprint_ids,
+                            args.seed, force=not args.no_force)
+    results.update({
+        'label': args.label or time.strftime('%Y-%m-%d %H:%M:%S'),
+        'url': args.url,
+        'clients': args.clients,
+        'duration': args.duration,
+        'mix': mix,
+        'seed': args.seed,
+        'recordedAt': time.time(),
+    })
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.save:
+        directory = os.path.dirname(args.save)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.save}")
+
+
+if __name__ == '__main__':
+    main()
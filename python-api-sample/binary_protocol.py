@@ -0,0 +1,159 @@
+"""
+Compact binary framing for the Arduino link
+An optional alternative to JSON lines for the high-frequency commands
+(RELAY, SOLENOID, UV_LIGHT, READ_COIN). Every frame is
+
+    0xFE | length | payload (length bytes) | CRC-8 of length + payload
+
+where the payload starts with a one-byte opcode and the 16-bit seq
+(little endian). 0xFE never occurs in UTF-8 text, so frames and the
+firmware's JSON lines can share the port. Replies use opcode | 0x80.
+Everything else (fingerprint jobs, status lines, coin pushes) stays JSON,
+and so does a SOLENOID whose duration does not fit the frame's uint16.
+"""
+
+import struct
+
+FRAME_START = 0xFE
+MAX_PAYLOAD = 32
+
+# Longest SOLENOID duration (seconds) a frame can carry
+MAX_DURATION = 0xFFFF
+
+OPCODES = {
+    'RELAY': 0x01,
+    'SOLENOID': 0x02,
+    'UV_LIGHT': 0x03,
+    'READ_COIN': 0x04,
+}
+COMMANDS = {opcode: command for command, opcode in OPCODES.items()}
+REPLY_FLAG = 0x80
+
+RESULT_OK = 0
+RESULT_UNSUPPORTED_SLOT = 1
+
+# Same texts the firmware sends in JSON mode, so callers see no difference
+SUCCESS_MESSAGES = {
+    'RELAY': 'Relay controlled',
+    'SOLENOID': 'Solenoid controlled',
+    'UV_LIGHT': 'UV light controlled',
+}
+FAILURE_MESSAGES = {
+    'RELAY': 'Invalid slot number for relay',
+    'SOLENOID': 'Slot does not support solenoid control',
+    'UV_LIGHT': 'Slot does not support UV sanitization',
+}
+
+# decode_frame outcomes besides a decoded message
+NEED_MORE = 'need_more'
+BAD_FRAME = 'bad_frame'
+
+
+def crc8(data):
+    """CRC-8 (polynomial 0x07), cheap enough for the Mega to compute inline"""
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def supports(command):
+    return command in OPCODES
+
+
+def encode_command(command, data, seq):
+    """Binary frame for a command, or None if it has no opcode or does not fit one"""
+    opcode = OPCODES.get(command)
+    if opcode is None:
+        return None
+    duration = int(data.get('duration') or 0)
+    if command == 'SOLENOID' and not 0 <= duration <= MAX_DURATION:
+        return None
+
+    payload = struct.pack('<BH', opcode, seq)
+    if command == 'RELAY':
+        payload += struct.pack('<BB', data.get('slot') or 0, bool(data.get('state')))
+    elif command == 'SOLENOID':
+        payload += struct.pack('<BBH', data.get('slot') or 0, bool(data.get('lock')), duration)
+    elif command == 'UV_LIGHT':
+        payload += struct.pack('<BB', data.get('slot') or 0, bool(data.get('state')))
+
+    return frame(payload)
+
+
+def decode_command(payload):
+    """(command, data, seq) of a command payload, the inverse of encode_command; None if unknown"""
+    opcode, seq = struct.unpack_from('<BH', payload)
+    command = COMMANDS.get(opcode)
+    if command is None:
+        return None
+
+    if command in ('RELAY', 'UV_LIGHT'):
+        slot, state = struct.unpack_from('<BB', payload, 3)
+        data = {'slot': slot, 'state': bool(state)}
+    elif command == 'SOLENOID':
+        slot, lock, duration = struct.unpack_from('<BBH', payload, 3)
+        data = {'slot': slot, 'lock': bool(lock)}
+        if duration:
+            data['duration'] = duration
+    else:
+        data = {}
+    return command, data, seq
+
+
+def frame(payload):
+    header = bytes([len(payload)])
+    return bytes([FRAME_START]) + header + payload + bytes([crc8(header + payload)])
+
+
+def decode_frame(buffer):
+    """
+    Decode the frame at the start of buffer.
+    Returns (message, consumed); message is NEED_MORE if the frame is
+    incomplete, or BAD_FRAME if it is corrupt (consumed = 1: resync).
+    """
+    if len(buffer) < 2:
+        return NEED_MORE, 0
+
+    length = buffer[1]
+    if length < 3 or length > MAX_PAYLOAD:
+        return BAD_FRAME, 1
+
+    total = length + 3
+    if len(buffer) < total:
+        return NEED_MORE, 0
+
+    payload = bytes(buffer[2:2 + length])
+    if crc8(bytes([length]) + payload) != buffer[2 + length]:
+        return BAD_FRAME, 1
+
+    message = decode_reply(payload)
+    if message is None:
+        return BAD_FRAME, 1
+    return message, total
+
+
+def decode_reply(payload):
+    """Turn a reply payload into the same dict the JSON firmware would send"""
+    opcode, seq = struct.unpack_from('<BH', payload)
+    command = COMMANDS.get(opcode & ~REPLY_FLAG)
+    if not opcode & REPLY_FLAG or command is None or len(payload) < 4:
+        return None
+
+    code = payload[3]
+    if command == 'READ_COIN':
+        if len(payload) < 10:
+            return None
+        centavos, timestamp = struct.unpack_from('<HI', payload, 4)
+        message = {'success': True, 'value': centavos / 100}
+        if centavos:
+            message['timestamp'] = timestamp
+    elif code == RESULT_OK:
+        message = {'success': True, 'message': SUCCESS_MESSAGES[command]}
+    else:
+        message = {'success': False, 'message': FAILURE_MESSAGES[command]}
+
+    message['seq'] = seq
+    return message
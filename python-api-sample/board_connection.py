@@ -0,0 +1,443 @@
+"""
+Supervised connection to the Arduino
+Opening the port resets the Mega, which then spends a few seconds on the
+AS608 checks (and the optional database clear) before printing
+"Arduino Ready". The connection waits for that on its own thread, so the
+HTTP server comes up at once; requests that arrive early wait for
+readiness with a bound.
+
+The same thread then watches the link. When the port fails (USB glitch,
+cable pulled, board hung) it re-opens it with backoff, also trying the
+path the board re-enumerated under, and commands that could not be sent
+during the outage are replayed once the board is back.
+
+With `capture_dir` set, every port it opens is recorded to a capture file
+there, and a `replay:` port name plays a capture back instead of opening a
+board (see serial_capture.py). A replay is played once: it gets no
+heartbeats, and when the capture ends the connection stays disconnected.
+"""
+
+import logging
+import threading
+import time
+
+import serial
+from serial.tools import list_ports
+
+from command_scheduler import CommandScheduler
+from serial_capture import REPLAY_PREFIX, CaptureWriter, RecordingPort, ReplayPort, capture_path
+from serial_link import Completion, LinkDisconnected, SerialLink
+
+log = logging.getLogger(__name__)
+
+# Connection states, as reported by /health
+CONNECTING = 'connecting'
+WARMING = 'warming'
+READY = 'ready'
+DISCONNECTED = 'disconnected'
+SIMULATED = 'simulated'
+
+# Printed by the firmware at the end of setup()
+READY_BANNER = 'Arduino Ready'
+
+# A board that did not reset when the port was opened never prints the
+# banner; after this long, PING it instead
+BANNER_TIMEOUT = 10
+PROBE_INTERVAL = 2
+PROBE_ATTEMPTS = 3
+
+# Re-open attempts back off from the first to the second delay
+RECONNECT_DELAYS = (0.5, 30)
+
+# PING an idle link this often; this many missed replies in a row means
+# the board is hung (or has reset to another baud rate) and is re-opened
+HEARTBEAT_INTERVAL = 5
+HEARTBEAT_MISSES = 2
+
+# How long a command waits for the board to come back during an outage
+OUTAGE_WAIT = 15
+
+# USB vendor ids of Mega boards and common clones (Arduino, Arduino.org, CH340)
+ARDUINO_VENDOR_IDS = {0x2341, 0x2A03, 0x1A86}
+
+# Commands that leave the board in the same state however often they run.
+# Only these are re-sent if the link died while they were in flight;
+# anything that never left the host is always safe to send again.
+IDEMPOTENT_COMMANDS = {
+    'RELAY', 'UV_LIGHT', 'PING',
+    'FINGERPRINT_DELETE', 'FINGERPRINT_DELETE_RANGE', 'FINGERPRINT_EMPTY',
+}
+
+
+def is_idempotent(command, data):
+    # A lock is; an unlock (timed or not) would open a door again that may
+    # have been closed meanwhile
+    if command == 'SOLENOID':
+        return bool(data.get('lock'))
+    if command == 'BATCH':
+        return all(op[0] in IDEMPOTENT_COMMANDS or (op[0] == 'SOLENOID' and op[2]) for op in data.get('ops', []))
+    return command in IDEMPOTENT_COMMANDS
+
+
+class BoardConnection:
+    """
+    Owns the port, the SerialLink and the CommandScheduler for one board.
+    The scheduler lives for the whole process; each re-attach gives it a
+    fresh link. `wait_ready` returns once the board is usable (or simulation
+    mode was chosen because there was no board at startup).
+    With `auto_detect` off it never tries other Arduinos it finds on USB,
+    only the configured port and the board first seen there (several boards
+    must not grab each other's ports).
+    """
+
+    def __init__(self, port_name, baud_rate, link_baud_rate=None, binary_frames=False, traffic=None,
+                 auto_detect=True, capture_dir=None, telemetry_interval=None):
+        self.port_name = port_name
+        self.telemetry_interval = telemetry_interval
+        self.capture_dir = capture_dir
+        self.capture = None
+        self.auto_detect = auto_detect
+        self.baud_rate = baud_rate
+        self.link_baud_rate = link_baud_rate
+        self.binary_frames = binary_frames
+        self.traffic = traffic
+        self.state = CONNECTING
+        self.error = None
+        self.port = None
+        self.link = None
+        self.scheduler = None
+        self.started_at = None
+        self.ready_at = None
+        self.connected_port = None
+        self.reconnects = 0
+        self.replayed = 0
+        self.outage_started = None
+        self.last_outage_seconds = None
+        self.total_outage_seconds = 0.0
+        self._retired_counters = {}
+        self._hardware_id = None
+        self._listeners = []
+        self._loop = None
+        self._lock = threading.Lock()
+        self._banner = threading.Event()
+        self._ready = Completion()
+        self._stopping = False
+        self._thread = None
+
+    @property
+    def simulated(self):
+        return self.state == SIMULATED
+
+    @property
+    def ready(self):
+        return self.state in (READY, SIMULATED)
+
+    @property
+    def replaying(self):
+        return self.port_name.startswith(REPLAY_PREFIX)
+
+    def add_listener(self, callback):
+        """Register a callback for unsolicited lines (banners, coin pushes)"""
+        self._listeners.append(callback)
+
+    def start(self):
+        """Open and supervise the board on a background thread"""
+        if self._thread is not None:
+            return
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._supervise, name=f'arduino-supervisor-{self.port_name}',
+                                        daemon=True)
+        self._thread.start()
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    async def wait_ready_async(self, timeout=None):
+        return await self._ready.wait_async(timeout)
+
+    def attach_event_loop(self, loop):
+        """Serve serial reads from this event loop, now and after re-attaches"""
+        with self._lock:
+            self._loop = loop
+            link = self.link
+        if link is not None and not link.closed:
+            link.attach_event_loop(loop)
+
+    def stop(self):
+        self._stopping = True
+        with self._lock:
+            link = self.link
+        if link is not None:
+            link.close('Shutting down')
+        if self.capture is not None:
+            self.capture.close()
+
+    def execute(self, command, data, timeout=10, on_update=None):
+        """
+        Run a command through the scheduler, riding out a link outage:
+        waits (bounded) for the board to come back and replays the command
+        if it never reached the board or is idempotent.
+        """
+        deadline = time.monotonic() + OUTAGE_WAIT
+        while True:
+            if not self._ready.wait(max(0, deadline - time.monotonic())):
+                raise LinkDisconnected(f"Arduino disconnected ({self.error})", sent=False)
+            try:
+                return self.scheduler.execute(command, data, timeout=timeout, on_update=on_update)
+            except LinkDisconnected as e:
+                if not self._should_replay(command, data, e, deadline):
+                    raise
+
+    async def execute_async(self, command, data, timeout=10, on_update=None):
+        """Same as execute, for the asyncio server"""
+        deadline = time.monotonic() + OUTAGE_WAIT
+        while True:
+            if not await self._ready.wait_async(max(0, deadline - time.monotonic())):
+                raise LinkDisconnected(f"Arduino disconnected ({self.error})", sent=False)
+            try:
+                return await self.scheduler.execute_async(command, data, timeout=timeout, on_update=on_update)
+            except LinkDisconnected as e:
+                if not self._should_replay(command, data, e, deadline):
+                    raise
+
+    def _should_replay(self, command, data, error, deadline):
+        if error.sent and not is_idempotent(command, data):
+            return False
+        if time.monotonic() >= deadline:
+            return False
+        log.warning(f"↻ {command} will be replayed once the Arduino is back")
+        self.replayed += 1
+        return True
+
+    def handle_message(self, message):
+        """SerialLink listener: the boot banner means setup() has finished"""
+        if message.get('status') == READY_BANNER:
+            self._banner.set()
+
+    def status(self):
+        outage = time.time() - self.outage_started if self.outage_started else None
+        return {
+            'state': self.state,
+            'port': self.connected_port or self.port_name,
+            'error': self.error,
+            'startupSeconds': round(self.ready_at - self.started_at, 2) if self.ready_at else None,
+            'reconnects': self.reconnects,
+            'replayedCommands': self.replayed,
+            'outageSeconds': round(outage, 2) if outage is not None else None,
+            'lastOutageSeconds': self.last_outage_seconds,
+            'totalOutageSeconds': round(self.total_outage_seconds, 2),
+            'capture': self.capture.path if self.capture else None,
+        }
+
+    def link_counters(self):
+        """Serial traffic totals over every link this connection has had"""
+        totals = dict(self._retired_counters)
+        link = self.link
+        if link is not None and not link.closed:
+            for name, value in link.counters().items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    # --- Supervisor thread ------------------------------------------------
+
+    def _supervise(self):
+        delay = RECONNECT_DELAYS[0]
+        while not self._stopping:
+            link = self._connect()
+            if link is None and self.replaying:
+                log.error(f"❌ Could not open {self.port_name}: {self.error}")
+                self.state = DISCONNECTED
+                return
+            if link is None:
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_DELAYS[1])
+                continue
+
+            delay = RECONNECT_DELAYS[0]
+            if self._bring_up(link):
+                self._watch(link)
+            link.close(link.error or 'Board not responding')
+            if self.replaying:
+                return  # Played once; there is nothing to reconnect to
+
+    def _connect(self):
+        """Open the first candidate port; None if there is none yet"""
+        for path in self._candidate_ports():
+            try:
+                if path.startswith(REPLAY_PREFIX):
+                    port = ReplayPort.open(path, self.baud_rate)
+                else:
+                    port = serial.Serial(path, self.baud_rate, timeout=1)
+            except Exception as e:
+                self.error = str(e)
+                continue
+            if self.capture_dir:
+                port = self._record(port, path)
+            return self._attach(port, path)
+
+        if self.state == CONNECTING and not self.replaying:
+            # No board at startup: serve simulated replies, keep looking
+            log.warning("⚠️  Could not connect to Arduino; running in SIMULATION mode "
+                        "(hardware commands are simulated, not secure!). Retrying in the background.",
+                        extra={'fields': {'port': self.port_name, 'error': self.error}})
+            self.state = SIMULATED
+            self._ready.set()
+        return None
+
+    def _record(self, port, path):
+        """Wrap a freshly opened port so its traffic goes to this board's capture"""
+        if self.capture is None:
+            self.capture = CaptureWriter(capture_path(self.capture_dir, self.port_name))
+            log.info(f"⏺ Recording serial traffic to {self.capture.path}")
+        self.capture.opened(path, self.baud_rate)
+        return RecordingPort(port, self.capture)
+
+    def _candidate_ports(self):
+        """The configured path, then wherever the same board re-enumerated"""
+        candidates = [self.port_name]
+        if self.replaying:
+            return candidates
+        try:
+            ports = list_ports.comports()
+        except Exception:
+            ports = []
+
+        for info in ports:
+            if self._hardware_id:
+                if (info.vid, info.pid, info.serial_number) == self._hardware_id:
+                    candidates.append(info.device)
+            elif self.auto_detect and info.vid in ARDUINO_VENDOR_IDS:
+                candidates.append(info.device)
+
+        return list(dict.fromkeys(candidates))
+
+    def _remember_hardware(self, path):
+        for info in list_ports.comports():
+            if info.device == path and info.vid is not None:
+                self._hardware_id = (info.vid, info.pid, info.serial_number)
+
+    def _attach(self, port, path):
+        log.info(f"Connected to Arduino on {path}, waiting for it to initialize...")
+
+        if self.state == SIMULATED:
+            self._ready = Completion()  # Stop simulating until the board is up
+        self.state = WARMING
+        self.connected_port = path
+        self._remember_hardware(path)
+        self._banner.clear()
+
+        # The link's reader owns all reads from here on, banners included
+        link = SerialLink(port, traffic=self.traffic)
+        for listener in self._listeners:
+            link.add_listener(listener)
+        link.add_listener(self.handle_message)
+        link.on_close = self._link_closed
+        link.start()
+
+        with self._lock:
+            self.port = port
+            self.link = link
+            if self.scheduler is None:
+                self.scheduler = CommandScheduler(link)
+            else:
+                self.scheduler.link = link
+            loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(link.attach_event_loop, loop)
+        return link
+
+    def _bring_up(self, link):
+        """Wait for the board to boot, negotiate the link and go READY"""
+        if not self._wait_for_board(link):
+            return False
+        if self.link_baud_rate and self.link_baud_rate != self.baud_rate or self.binary_frames:
+            link.upgrade(self.link_baud_rate, binary=self.binary_frames)
+        # The firmware boots with telemetry off; turn it on again after every reset
+        if self.telemetry_interval and not self._start_telemetry(link):
+            return False
+
+        now = time.time()
+        if self.outage_started:
+            self.last_outage_seconds = round(now - self.outage_started, 2)
+            self.total_outage_seconds += now - self.outage_started
+            self.outage_started = None
+            self.reconnects += 1
+            log.info(f"✓ Arduino reconnected after {self.last_outage_seconds}s (reconnect #{self.reconnects})")
+
+        self.error = None
+        self.ready_at = self.ready_at or now
+        self.state = READY
+        self._ready.set()
+
+        log.info(f"✓ Arduino initialization complete! ({now - self.started_at:.1f}s since start)")
+        return True
+
+    def _start_telemetry(self, link):
+        """False only if the link dropped; a board that refuses just sends none"""
+        try:
+            result, _ = link.request('TELEMETRY', {'interval': self.telemetry_interval}, timeout=PROBE_INTERVAL)
+        except LinkDisconnected:
+            return False
+        if not result or not result.get('success'):
+            log.warning(f"⚠ Telemetry not started: {(result or {}).get('message', 'no reply')}")
+        return True
+
+    def _wait_for_board(self, link):
+        if self._banner.wait(BANNER_TIMEOUT):
+            return True
+        if link.closed:
+            return False
+
+        log.warning("⚠ No startup banner from Arduino (no reset on open?), probing with PING...")
+        for _ in range(PROBE_ATTEMPTS):
+            if self._banner.is_set():
+                return True
+            # Any reply, even "Unknown command" from older firmware, means it is up
+            try:
+                result, _ = link.request('PING', {}, timeout=PROBE_INTERVAL)
+            except LinkDisconnected:
+                return False
+            if result is not None:
+                return True
+        return self._banner.is_set()
+
+    def _watch(self, link):
+        """Return once the link has failed or the board stopped answering"""
+        if self.replaying:
+            # A capture cannot answer a PING it did not record
+            link.wait_closed()
+            return
+        misses = 0
+        while not self._stopping:
+            if link.wait_closed(HEARTBEAT_INTERVAL):
+                return
+            if time.monotonic() - link.last_received < HEARTBEAT_INTERVAL:
+                misses = 0
+                continue
+
+            try:
+                result, _ = link.request('PING', {}, timeout=PROBE_INTERVAL)
+            except LinkDisconnected:
+                return
+            misses = 0 if result is not None else misses + 1
+            if misses >= HEARTBEAT_MISSES:
+                log.error(f"❌ Arduino missed {misses} heartbeats, re-opening the port")
+                link.error = 'Board stopped responding'
+                return
+
+    def _link_closed(self, link):
+        """SerialLink on_close hook: runs in whichever thread saw the failure"""
+        for name, value in link.counters().items():
+            self._retired_counters[name] = self._retired_counters.get(name, 0) + value
+        if self._stopping:
+            return
+        if self.replaying:
+            log.info(f"⏹ Replay of {self.port_name} ended ({link.error})")
+        else:
+            log.error(f"⚠️  Arduino link lost ({link.error}); reconnecting...")
+        if self._ready.is_set():
+            self._ready = Completion()  # New commands wait for the board again
+        self.state = DISCONNECTED
+        self.error = link.error
+        if not self.replaying:
+            self.outage_started = self.outage_started or time.time()
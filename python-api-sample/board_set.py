@@ -0,0 +1,161 @@
+"""
+Several Arduinos behind one bridge
+Each board drives a contiguous range of kiosk slots and has its own port,
+supervisor and command queue, so the boards work in parallel. The firmware
+numbers its slots from 1, so a command for kiosk slot 17 on a board that
+starts at 17 goes out as slot 1.
+
+The first board is the primary: commands without a slot (fingerprint
+sensor, coin reads, PING) go to it.
+"""
+
+from board_connection import BoardConnection
+from slot_state import TOTAL_SLOTS
+
+# Commands whose data names a slot, and are routed by it
+SLOT_COMMANDS = ('RELAY', 'SOLENOID', 'UV_LIGHT', 'UNLOCK_TEMP')
+
+
+def parse_boards(spec):
+    """
+    'port:first-last,port:first-last' -> [(port, first, last)], in the
+    given order (the first is the primary), e.g.
+    '/dev/ttyACM0:1-16,/dev/ttyACM1:17-32'
+    """
+    boards = []
+    for entry in spec.split(','):
+        port, _, slots = entry.strip().rpartition(':')
+        first, _, last = slots.partition('-')
+        if not port or not first.isdigit() or not last.isdigit():
+            raise ValueError(f"Bad board entry {entry!r}, expected port:first-last")
+        boards.append((port, int(first), int(last)))
+
+    by_slot = sorted(boards, key=lambda board: board[1])
+    for (port, first, last), following in zip(by_slot, by_slot[1:] + [None]):
+        if first < 1 or last < first or last - first + 1 > TOTAL_SLOTS:
+            raise ValueError(f"{port}: slots {first}-{last} must be 1-{TOTAL_SLOTS} slots wide")
+        if following and following[1] <= last:
+            raise ValueError(f"{port} and {following[0]} share slot {following[1]}")
+    return boards
+
+
+class Shard:
+    """One board and the kiosk slots it drives"""
+
+    def __init__(self, board, first_slot, last_slot):
+        self.board = board
+        self.first_slot = first_slot
+        self.last_slot = last_slot
+
+    @property
+    def slots(self):
+        return range(self.first_slot, self.last_slot + 1)
+
+    @property
+    def name(self):
+        return self.board.port_name
+
+    def local_slot(self, slot):
+        return slot - self.first_slot + 1
+
+    def to_local(self, command, data):
+        """Command data with kiosk slot numbers replaced by the board's own"""
+        if command == 'BATCH':
+            return dict(data, ops=[[name, self.local_slot(slot), value] for name, slot, value in data['ops']])
+        if command in SLOT_COMMANDS:
+            return dict(data, slot=self.local_slot(data['slot']))
+        return data
+
+
+class BoardSet:
+    """The kiosk's boards, addressed by kiosk slot number"""
+
+    def __init__(self, boards, baud_rate, link_baud_rate=None, binary_frames=False, traffic=None,
+                 capture_dir=None, telemetry_interval=None):
+        # A lone board may be found wherever it enumerates; several stay on their ports
+        auto_detect = len(boards) == 1
+        self.shards = [
+            Shard(BoardConnection(port, baud_rate, link_baud_rate, binary_frames, traffic=traffic,
+                                  auto_detect=auto_detect, capture_dir=capture_dir,
+                                  telemetry_interval=telemetry_interval), first, last)
+            for port, first, last in boards
+        ]
+
+    @property
+    def primary(self):
+        return self.shards[0].board
+
+    @property
+    def ready(self):
+        return all(shard.board.ready for shard in self.shards)
+
+    def layout(self):
+        """kiosk slot -> slot number on its board, for SlotStateTable"""
+        return {slot: shard.local_slot(slot) for shard in self.shards for slot in shard.slots}
+
+    def shard_for(self, slot):
+        for shard in self.shards:
+            if isinstance(slot, int) and shard.first_slot <= slot <= shard.last_slot:
+                return shard
+        return None
+
+    def route(self, command, data):
+        """
+        (board, data in the board's slot numbers) for a command, or
+        (None, None) if its slot is not on any board. A BATCH must only
+        hold operations for one board (see group).
+        """
+        if command == 'BATCH':
+            shards = {id(self.shard_for(slot)): self.shard_for(slot) for _, slot, _ in data.get('ops', [])}
+            if len(shards) != 1 or None in shards.values():
+                return None, None
+            shard = next(iter(shards.values()))
+        elif command in SLOT_COMMANDS:
+            shard = self.shard_for(data.get('slot'))
+            if shard is None:
+                return None, None
+        else:
+            shard = self.shards[0]
+        return shard.board, shard.to_local(command, data)
+
+    def group(self, operations):
+        """
+        Split batch operations by board: [(shard, indexes, operations)],
+        with shard None for operations whose slot no board drives.
+        Each group keeps the request order.
+        """
+        groups = {}
+        for index, operation in enumerate(operations):
+            shard = self.shard_for(operation[1])
+            _, indexes, grouped = groups.setdefault(id(shard), (shard, [], []))
+            indexes.append(index)
+            grouped.append(operation)
+        return list(groups.values())
+
+    def add_listener(self, callback):
+        for shard in self.shards:
+            shard.board.add_listener(callback)
+
+    def start(self):
+        for shard in self.shards:
+            shard.board.start()
+
+    def attach_event_loop(self, loop):
+        for shard in self.shards:
+            shard.board.attach_event_loop(loop)
+
+    def stop(self):
+        for shard in self.shards:
+            shard.board.stop()
+
+    def status(self):
+        """Per board: its slots, connection state and command queues"""
+        return [
+            {
+                'slots': [shard.first_slot, shard.last_slot],
+                'arduino_connected': shard.board.link is not None,
+                **shard.board.status(),
+                'command_queues': shard.board.scheduler.queue_stats() if shard.board.scheduler else {},
+            }
+            for shard in self.shards
+        ]
@@ -0,0 +1,152 @@
+"""
+Structured logging for the bridge
+Request threads only build a log record and drop it on a bounded queue; a
+background listener formats and writes it, so a slow stdout or journald
+never stalls a request. When the queue is full records are dropped and
+counted rather than blocking. High-frequency serial traffic (READ_COIN,
+heartbeat PINGs) is sampled, and every serial line is kept in a small
+in-memory ring buffer that /api/debug/serial-traffic serves on demand.
+
+Configure with LOG_LEVEL (DEBUG, INFO, ...) and LOG_FORMAT (text or json).
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+LOG_QUEUE_SIZE = 10000
+
+# Log 1 in N lines of serial traffic for these commands
+SAMPLE_EVERY = {
+    'READ_COIN': 20,
+    'PING': 20,
+}
+
+TRAFFIC_BUFFER_SIZE = 500
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking"""
+
+    def __init__(self, maxsize=LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize))
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    One line per record. Structured fields passed as extra={'fields': {...}}
+    follow the message as key=value (text) or are merged into the object (json).
+    """
+
+    def __init__(self, output='text'):
+        super().__init__()
+        self.output = output
+
+    def format(self, record):
+        fields = getattr(record, 'fields', None) or {}
+        if self.output == 'json':
+            entry = {
+                'ts': round(record.created, 3),
+                'level': record.levelname,
+                'logger': record.name,
+                'msg': record.getMessage(),
+                **fields,
+            }
+            if record.exc_info:
+                entry['exc'] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+
+        line = (f"{time.strftime('%H:%M:%S', time.localtime(record.created))}"
+                f".{int(record.msecs):03d} {record.levelname:<7} {record.getMessage()}")
+        if fields:
+            line += '  ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+_handler = None
+_listener = None
+
+
+def setup_logging(level=LOG_LEVEL, output=LOG_FORMAT):
+    """Route all logging through the queue to one writer thread (idempotent)"""
+    global _handler, _listener
+    if _handler is not None:
+        return _handler
+
+    writer = logging.StreamHandler(sys.stdout)
+    writer.setFormatter(StructuredFormatter(output))
+
+    _handler = BoundedQueueHandler()
+    _listener = logging.handlers.QueueListener(_handler.queue, writer)
+    _listener.start()
+    atexit.register(_listener.stop)  # Flush what is queued on exit
+
+    root = logging.getLogger()
+    root.addHandler(_handler)
+    root.setLevel(level)
+    return _handler
+
+
+def dropped_records():
+    return _handler.dropped if _handler else 0
+
+
+class Sampler:
+    """
+    Decides which exchanges of a high-frequency command get logged.
+    Keyed on seq, so a command and its reply are logged (or skipped) together.
+    """
+
+    def __init__(self, every=None):
+        self.every = dict(SAMPLE_EVERY if every is None else every)
+
+    def should_log(self, command, seq=None):
+        rate = self.every.get(command)
+        if not rate or seq is None:
+            return True
+        return seq % rate == 0
+
+
+class SerialTrafficLog:
+    """Ring buffer of the most recent lines/frames in both directions"""
+
+    def __init__(self, size=TRAFFIC_BUFFER_SIZE):
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, direction, line, command=None, seq=None):
+        entry = {
+            'time': time.time(),
+            'direction': direction,
+            'command': command,
+            'seq': seq,
+            'line': line,
+        }
+        with self._lock:
+            self._entries.append(entry)
+
+    def recent(self, limit=100, command=None):
+        """Newest last; optionally only lines for one command"""
+        with self._lock:
+            entries = list(self._entries)
+        if command:
+            entries = [entry for entry in entries if entry['command'] == command]
+        return entries[-limit:] if limit else entries
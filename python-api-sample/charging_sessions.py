@@ -0,0 +1,233 @@
+"""
+Charging sessions
+The bridge tracks every slot's paid charging time itself, so a session
+ends on time even if the kiosk page that started it was closed or the
+browser stalled. One scheduler thread keeps all sessions in a heap ordered
+by expiry; sessions that run out within a second of each other have their
+relays and UV lights cut together by one batched serial action.
+
+An expired session stays listed (state "expired") until the UI ends it,
+i.e. until the user has collected the device. A power-off the board does
+not confirm is retried, with backoff, until it is: a session is never
+given up on while its relay may still be on. Sessions live in memory.
+
+Expiry runs on time.monotonic(): the kiosk Pi has no RTC, and its wall
+clock jumps when NTP syncs after boot. Wall-clock times are only reported.
+"""
+
+import heapq
+import logging
+import threading
+import time
+import uuid
+
+log = logging.getLogger(__name__)
+
+CHARGING = 'charging'
+EXPIRED = 'expired'
+CANCELLED = 'cancelled'  # Powered off early: the UI ended it, but the power-off had to be retried
+
+# Sessions due within this many seconds of the first are powered off with it
+COALESCE_WINDOW = 1.0
+
+# Retries of an unconfirmed power-off back off from the first to the second delay
+RETRY_DELAYS = (2.0, 30)
+
+# After this many failed attempts the slot is reported (logged as an error
+# and counted in /health), but the power-off is still retried
+ALERT_ATTEMPTS = 5
+
+
+class ChargingSession:
+    """One slot's paid charging time"""
+
+    def __init__(self, slot, minutes, session_id=None, fingerprint_id=None):
+        self.id = session_id or uuid.uuid4().hex[:12]
+        self.slot = slot
+        self.fingerprint_id = fingerprint_id
+        self.paid_minutes = minutes
+        self.started_at = time.time()
+        self._started = time.monotonic()
+        self.state = CHARGING
+        self.powered_off_at = None
+        self.power_off_error = None
+        self.attempts = 0
+        self.ending = False  # The UI ended it; the scheduler is retrying the power-off
+        self.due_at = None  # When the scheduler next acts on it (monotonic)
+
+    @property
+    def expires_at(self):
+        """Monotonic time the paid time runs out"""
+        return self._started + self.paid_minutes * 60
+
+    def to_dict(self):
+        remaining = self.expires_at - time.monotonic()
+        return {
+            'sessionId': self.id,
+            'slotNumber': self.slot,
+            'fingerprintId': self.fingerprint_id,
+            'state': self.state,
+            'paidMinutes': self.paid_minutes,
+            'startedAt': self.started_at,
+            'expiresAt': time.time() + remaining,
+            'remainingSeconds': round(max(0.0, remaining), 1) if self.state == CHARGING else 0,
+            'poweredOffAt': self.powered_off_at,
+            'powerOffError': self.power_off_error,
+        }
+
+
+class ChargingSessions:
+    """
+    Every slot's session, expired by one scheduler
+    `power_off(slots)` cuts power to several slots with one batched
+    command and returns the slots that failed.
+    """
+
+    def __init__(self, power_off):
+        self.power_off = power_off
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._sessions = {}  # slot -> ChargingSession
+        self._heap = []  # (due, slot, session id); stale entries are skipped
+        self._running = False
+        self.expired = 0
+        self.cancelled = 0
+        self.power_off_alerts = 0
+        self.power_off_batches = 0
+
+    def start(self):
+        self._running = True
+        threading.Thread(target=self._run, name='charging-sessions', daemon=True).start()
+
+    def stop(self):
+        with self._lock:
+            self._running = False
+            self._changed.notify_all()
+
+    def begin(self, slot, minutes, session_id=None, fingerprint_id=None):
+        """Start a session; None if the slot already has one"""
+        with self._lock:
+            if slot in self._sessions:
+                return None
+            session = ChargingSession(slot, minutes, session_id, fingerprint_id)
+            self._sessions[slot] = session
+            self._push(session.expires_at, session)
+        log.info(f"🔋 Slot {slot} charging for {minutes} min", extra={'fields': {'sessionId': session.id}})
+        return session.to_dict()
+
+    def extend(self, slot, minutes):
+        """Add paid minutes to a running session; None if it is not charging"""
+        with self._lock:
+            session = self._sessions.get(slot)
+            if session is None or session.state != CHARGING or session.ending:
+                return None
+            session.paid_minutes += minutes
+            self._push(session.expires_at, session)
+            return session.to_dict()
+
+    def end(self, slot):
+        """Forget a slot's session (the UI ended it); its last state, or None"""
+        with self._lock:
+            session = self._sessions.pop(slot, None)
+            return session.to_dict() if session else None
+
+    def retry_power_off(self, slot):
+        """
+        The UI's power-off of a charging slot failed: keep its session and
+        have the scheduler retry it like an expiry; its state, or None
+        """
+        with self._lock:
+            session = self._sessions.get(slot)
+            if session is None:
+                return None
+            session.attempts += 1
+            session.power_off_error = 'Power-off not confirmed, retrying'
+            if session.state == CHARGING:
+                session.ending = True
+                self._push(time.monotonic() + retry_delay(session.attempts), session)
+            return session.to_dict()
+
+    def get(self, slot):
+        with self._lock:
+            session = self._sessions.get(slot)
+            return session.to_dict() if session else None
+
+    def all(self):
+        with self._lock:
+            return [session.to_dict() for _, session in sorted(self._sessions.items())]
+
+    def _push(self, due, session):
+        session.due_at = due
+        heapq.heappush(self._heap, (due, session.slot, session.id))
+        self._changed.notify_all()
+
+    def _due_sessions(self, now):
+        """Pop every session that is due, or will be within COALESCE_WINDOW"""
+        due = []
+        while self._heap and self._heap[0][0] <= now + COALESCE_WINDOW:
+            when, slot, session_id = heapq.heappop(self._heap)
+            session = self._sessions.get(slot)
+            if session is None or session.id != session_id or session.state != CHARGING:
+                continue  # Ended, or a stale entry
+            if when != session.due_at:
+                continue  # Extended: a later entry stands for it
+            due.append(session)
+        return due
+
+    def _run(self):
+        with self._lock:
+            while self._running:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    due = self._due_sessions(now)
+                    if due:
+                        self._lock.release()
+                        try:
+                            self._expire(due)
+                        finally:
+                            self._lock.acquire()
+                        continue
+                self._changed.wait(self._heap[0][0] - now if self._heap else None)
+
+    def _expire(self, sessions):
+        slots = [session.slot for session in sessions]
+        expiring = [session.slot for session in sessions if not session.attempts]
+        if expiring:
+            log.info(f"⏰ Charging time up for slots {expiring}, powering off")
+        if len(expiring) < len(slots):
+            log.info(f"↻ Retrying power-off of slots {sorted(set(slots) - set(expiring))}")
+        try:
+            failed = set(self.power_off(slots))
+        except Exception as e:
+            log.error(f"❌ Power-off failed: {e}")
+            failed = set(slots)
+        self.power_off_batches += 1
+
+        with self._lock:
+            for session in sessions:
+                if self._sessions.get(session.slot) is not session:
+                    continue  # Ended while powering off
+                session.attempts += 1
+                if session.slot not in failed:
+                    session.state = CANCELLED if session.ending else EXPIRED
+                    session.powered_off_at = time.time()
+                    session.power_off_error = None
+                    if session.ending:
+                        self.cancelled += 1
+                    else:
+                        self.expired += 1
+                    continue
+
+                delay = retry_delay(session.attempts)
+                session.power_off_error = 'Power-off not confirmed, retrying'
+                self._push(time.monotonic() + delay, session)
+                fields = {'sessionId': session.id, 'attempts': session.attempts, 'retryIn': delay}
+                if session.attempts == ALERT_ATTEMPTS:
+                    self.power_off_alerts += 1
+                    log.error(f"❌ Slot {session.slot} may still be powered, retrying", extra={'fields': fields})
+                else:
+                    log.warning(f"⚠ Slot {session.slot} power-off not confirmed, retrying", extra={'fields': fields})
+
+
+def retry_delay(attempts):
+    return min(RETRY_DELAYS[0] * 2 ** (attempts - 1), RETRY_DELAYS[1])
@@ -0,0 +1,195 @@
+"""
+Coin event hub
+The firmware pushes a `coinDetected` line on its own as soon as a pulse
+train is decoded. The hub keeps those events in memory so `/api/coin-slot`
+needs no serial round trip, and fans them out to streaming subscribers.
+With a CoinLedger, every coin is also recorded durably and event ids are
+ledger ids, so they stay valid across restarts.
+"""
+
+import asyncio
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+# Matches COIN_HOLD_WINDOW_MS in the firmware: an unclaimed coin stays
+# readable through /api/coin-slot for this long
+COIN_HOLD_WINDOW = 5
+
+HISTORY_SIZE = 100
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class CoinEvent:
+    """One coin decoded by the board"""
+
+    def __init__(self, event_id, value, board_timestamp, pulses=None, board=None):
+        self.id = event_id
+        self.value = value
+        self.timestamp = board_timestamp
+        self.pulses = pulses
+        self.board = board
+        self.received_at = time.time()
+        self.received_monotonic = time.monotonic()
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild an event received from the serial broker or read from the ledger"""
+        event = cls(data['id'], data['value'], data['timestamp'], data.get('pulses'), data.get('board'))
+        event.received_at = data['receivedAt']
+        return event
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'value': self.value,
+            'timestamp': self.timestamp,
+            'pulses': self.pulses,
+            'board': self.board,
+            'receivedAt': self.received_at,
+        }
+
+
+class CoinEventHub:
+    """Collects coin pushes from the board and fans them out to clients"""
+
+    def __init__(self, hold_window=COIN_HOLD_WINDOW, ledger=None):
+        self.hold_window = hold_window
+        self.ledger = ledger
+        self._lock = threading.Lock()
+        self._next_id = ledger.last_id if ledger else 0
+        self._last_board_timestamps = {}
+        self._history = deque(maxlen=HISTORY_SIZE)
+        self._unclaimed = deque()
+        self._subscribers = set()
+
+    def handle_message(self, message, board=None):
+        """SerialLink listener: pick coin pushes out of unsolicited lines"""
+        if 'coinDetected' in message:
+            self.publish(message['coinDetected'], message.get('timestamp'), message.get('pulses'), board)
+
+    def publish(self, value, board_timestamp, pulses=None, board=None):
+        """Record a coin; a repeated board timestamp is the same coin"""
+        with self._lock:
+            if board_timestamp is not None and board_timestamp == self._last_board_timestamps.get(board):
+                return None
+            self._last_board_timestamps[board] = board_timestamp
+
+            if self.ledger:
+                entry = self.ledger.record(board, value, board_timestamp, pulses)
+                if entry is None:
+                    return None
+                self._next_id = entry['id']
+            else:
+                self._next_id += 1
+            event = CoinEvent(self._next_id, value, board_timestamp, pulses, board)
+            self._history.append(event)
+            self._unclaimed.append(event)
+            subscribers = list(self._subscribers)
+
+        for subscriber in subscribers:
+            subscriber(event)
+
+        return event
+
+    def claim(self):
+        """Take the oldest unclaimed coin still inside the hold window"""
+        with self._lock:
+            now = time.monotonic()
+            while self._unclaimed:
+                event = self._unclaimed.popleft()
+                if now - event.received_monotonic <= self.hold_window:
+                    return event
+        return None
+
+    def history_since(self, event_id):
+        """
+        Events newer than event_id: from memory, or from the ledger when
+        some of them are older than the in-memory history
+        """
+        with self._lock:
+            history = [event for event in self._history if event.id > event_id]
+            oldest = self._history[0].id if self._history else self._next_id + 1
+        if self.ledger and event_id + 1 < oldest:
+            return [CoinEvent.from_dict(entry) for entry in self.ledger.since(event_id, HISTORY_SIZE)]
+        return history
+
+    def subscribe(self, callback):
+        """Call callback(event) for every new coin until unsubscribed"""
+        with self._lock:
+            self._subscribers.add(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers.discard(callback)
+
+    def stream(self, last_event_id=0, keepalive=15):
+        """Server-sent events: replay missed coins, then push new ones"""
+        events = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+        def deliver(event):
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                pass  # Slow client; it can catch up with Last-Event-ID
+
+        self.subscribe(deliver)
+        try:
+            sent_id = last_event_id
+            for event in self.history_since(last_event_id):
+                sent_id = event.id
+                yield format_sse(event)
+
+            while True:
+                try:
+                    event = events.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+
+                if event.id > sent_id:
+                    sent_id = event.id
+                    yield format_sse(event)
+        finally:
+            self.unsubscribe(deliver)
+
+    async def stream_async(self, last_event_id=0, keepalive=15):
+        """Same as stream, for the asyncio server: waits in a coroutine"""
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+        def put(event):
+            try:
+                events.put_nowait(event)
+            except asyncio.QueueFull:
+                pass
+
+        def deliver(event):
+            loop.call_soon_threadsafe(put, event)
+
+        self.subscribe(deliver)
+        try:
+            sent_id = last_event_id
+            for event in self.history_since(last_event_id):
+                sent_id = event.id
+                yield format_sse(event)
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(events.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+
+                if event.id > sent_id:
+                    sent_id = event.id
+                    yield format_sse(event)
+        finally:
+            self.unsubscribe(deliver)
+
+
+def format_sse(event):
+    return f"id: {event.id}\nevent: coin\ndata: {json.dumps(event.to_dict())}\n\n"
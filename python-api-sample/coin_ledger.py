@@ -0,0 +1,174 @@
+"""
+Coin ledger
+Every coin the boards push is appended to a SQLite database in WAL mode, so
+money inserted while no client was polling (or while the UI reloaded) is
+never lost. Entries are numbered in arrival order; clients keep the last
+number they saw and fetch everything after it with /api/coins?since=.
+
+A coin is identified by its board and the board's millis() timestamp, so a
+push seen twice is recorded once. millis() restarts when the board resets,
+so a timestamp going backwards starts a new boot and the same values can be
+recorded again.
+
+Writes are queued and committed by a writer thread in batches, so a burst
+of coins shares one commit and no request waits on the disk. The commit
+runs outside the queue's lock, so the serial reader recording a coin never
+waits for an fsync either.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+# Queued coins are committed after at most this long
+FLUSH_DELAY = 0.1
+
+# Board timestamps remembered per board to recognise repeated pushes
+RECENT_TIMESTAMPS = 32
+
+# Largest page /api/coins returns
+MAX_PAGE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS coins (
+    id INTEGER PRIMARY KEY,
+    board TEXT NOT NULL,
+    boot INTEGER NOT NULL,
+    board_timestamp INTEGER,
+    value REAL NOT NULL,
+    pulses INTEGER,
+    received_at REAL NOT NULL,
+    UNIQUE (board, boot, board_timestamp)
+)
+"""
+
+
+class CoinLedger:
+    """Append-only, deduplicated record of coins, readable by cursor"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()  # Queue and dedup state
+        self._db_lock = threading.Lock()  # The connection; taken before _lock
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')  # WAL stays consistent; only the last batch is at risk
+        self._db.execute(SCHEMA)
+        self._db.commit()
+
+        self._last_id = self._db.execute('SELECT COALESCE(MAX(id), 0) FROM coins').fetchone()[0]
+        self._boards = {}  # board -> [boot, recent timestamps]
+        for board, boot, timestamp in self._db.execute(
+                'SELECT board, boot, board_timestamp FROM coins WHERE id IN '
+                '(SELECT MAX(id) FROM coins GROUP BY board)'):
+            self._boards[board] = [boot, deque([timestamp], maxlen=RECENT_TIMESTAMPS)]
+
+        self._pending = []
+        self._inflight = []  # Taken off the queue, commit in progress
+        self.recorded = 0
+        self.duplicates = 0
+        self._wake = threading.Event()
+        self._stopping = False
+        self._writer = threading.Thread(target=self._write_loop, name='coin-ledger', daemon=True)
+        self._writer.start()
+
+    def record(self, board, value, board_timestamp, pulses=None, received_at=None):
+        """Queue a coin; returns its entry, or None if it was already recorded"""
+        board = board or ''
+        with self._lock:
+            boot, recent = self._boards.setdefault(board, [0, deque(maxlen=RECENT_TIMESTAMPS)])
+            if board_timestamp is not None:
+                if board_timestamp in recent:
+                    self.duplicates += 1
+                    return None
+                if recent and recent[-1] is not None and board_timestamp < recent[-1]:
+                    boot += 1  # millis() went backwards: the board reset
+                    recent.clear()
+                    self._boards[board][0] = boot
+            recent.append(board_timestamp)
+
+            self._last_id += 1
+            entry = {
+                'id': self._last_id,
+                'board': board,
+                'value': value,
+                'timestamp': board_timestamp,
+                'pulses': pulses,
+                'receivedAt': received_at or time.time(),
+            }
+            self._pending.append((entry, boot))
+            self.recorded += 1
+        self._wake.set()
+        return entry
+
+    def since(self, cursor=0, limit=100):
+        """Entries after `cursor`, oldest first (committed or still queued)"""
+        limit = max(1, min(limit, MAX_PAGE))
+        with self._db_lock:
+            rows = self._db.execute(
+                'SELECT id, board, value, board_timestamp, pulses, received_at FROM coins '
+                'WHERE id > ? ORDER BY id LIMIT ?', (cursor, limit)).fetchall()
+            with self._lock:
+                pending = [entry for entry, _ in self._inflight + self._pending if entry['id'] > cursor]
+
+        entries = [{
+            'id': entry_id,
+            'board': board,
+            'value': value,
+            'timestamp': timestamp,
+            'pulses': pulses,
+            'receivedAt': received_at,
+        } for entry_id, board, value, timestamp, pulses, received_at in rows]
+        seen = {entry['id'] for entry in entries}
+        entries.extend(entry for entry in pending if entry['id'] not in seen)
+        return entries[:limit]
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def flush(self):
+        """Commit everything queued so far"""
+        with self._db_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._inflight = batch
+            if not batch:
+                return
+            try:
+                self._db.executemany(
+                    'INSERT OR IGNORE INTO coins (id, board, boot, board_timestamp, value, pulses, received_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(entry['id'], entry['board'], boot, entry['timestamp'], entry['value'],
+                      entry['pulses'], entry['receivedAt']) for entry, boot in batch])
+                self._db.commit()
+                failed = None
+            except sqlite3.Error as e:
+                self._db.rollback()
+                failed = e
+            with self._lock:
+                self._inflight = []
+                if failed is not None:
+                    self._pending = batch + self._pending  # Retried on the next flush
+                    queued = len(self._pending)
+        if failed is not None:
+            log.error(f"❌ Coin ledger write failed: {failed}", extra={'fields': {'queued': queued}})
+
+    def close(self):
+        self._stopping = True
+        self._wake.set()
+        self._writer.join()
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+
+    def _write_loop(self):
+        while not self._stopping:
+            self._wake.wait()
+            self._wake.clear()
+            time.sleep(FLUSH_DELAY)  # Let a burst of coins share one commit
+            self.flush()
@@ -0,0 +1,360 @@
+"""
+Priority command scheduler in front of the Arduino serial link
+Commands are queued by class (safety: door locks and unlocks, actuators,
+coin reads, fingerprint) and granted access to the board in priority order with
+weighted round robin between classes and round robin between slots.
+
+Admission is bounded: each class queue has a size limit, and a command is
+turned away at once (Overloaded) when the backlog ahead of it - estimated
+from how long each class has recently held the port - means it could not
+reach the board before its deadline. Overload then costs callers a fast
+rejection they can retry, instead of a wait that ends in a timeout.
+Safety commands are exempt: a re-lock must never be shed.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+import profiling
+from serial_link import Completion
+
+SAFETY = 'safety'
+ACTUATOR = 'actuator'
+COIN = 'coin'
+FINGERPRINT = 'fingerprint'
+
+CLASSES = [SAFETY, ACTUATOR, COIN, FINGERPRINT]
+
+# How long a command may wait in the queue before it is dropped (seconds).
+# A coin read that could not be sent within a second is stale anyway.
+DEFAULT_DEADLINES = {
+    SAFETY: 5,
+    ACTUATOR: 10,
+    COIN: 1,
+    FINGERPRINT: 30,
+}
+
+# Commands a class may have waiting at once; more are rejected outright.
+# Safety commands (door locks and unlocks) are never turned away.
+DEFAULT_QUEUE_LIMITS = {
+    SAFETY: None,
+    ACTUATOR: 64,
+    COIN: 8,
+    FINGERPRINT: 4,
+}
+
+# How long each class holds its lane before anything has been measured
+# (seconds); replaced by a moving average of the real hold times
+DEFAULT_SERVICE_TIMES = {
+    SAFETY: 0.05,
+    ACTUATOR: 0.05,
+    COIN: 0.03,
+    FINGERPRINT: 5.0,
+}
+SERVICE_TIME_SMOOTHING = 0.2
+
+# Safety always goes first; the rest share the port in this ratio so that
+# a stream of actuator calls can never starve coin reads or fingerprints.
+ROUND_ROBIN_WEIGHTS = [(ACTUATOR, 4), (COIN, 2), (FINGERPRINT, 1)]
+
+# Fingerprint jobs hold the sensor for seconds; they run in their own lane
+# so the board can still service short commands while waiting for a finger.
+LONG_LANE = 'long'
+SHORT_LANE = 'short'
+
+WAIT_SAMPLES = 200
+
+
+class DeadlineExceeded(Exception):
+    """A command could not be sent to the board before its deadline"""
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after  # Seconds until the backlog should have cleared
+
+
+class Overloaded(DeadlineExceeded):
+    """A command was turned away without queueing: full queue or too much backlog"""
+
+
+def lane_of(command_class):
+    return LONG_LANE if command_class == FINGERPRINT else SHORT_LANE
+
+
+def classify(command, data):
+    """Map a firmware command onto its scheduling class"""
+    if command in ('UNLOCK_TEMP', 'SOLENOID'):
+        return SAFETY  # Unlocks, and the re-locks that must follow them
+    if command == 'BATCH':
+        doors = any(op[0] in ('UNLOCK_TEMP', 'SOLENOID') for op in data.get('ops', []))
+        return SAFETY if doors else ACTUATOR
+    if command == 'READ_COIN':
+        return COIN
+    if command.startswith('FINGERPRINT_'):
+        return FINGERPRINT
+    return ACTUATOR
+
+
+class Ticket:
+    """A queued command waiting for its turn on the port"""
+
+    def __init__(self, command, data, command_class, flow, deadline):
+        self.command = command
+        self.data = data
+        self.command_class = command_class
+        self.flow = flow
+        self.lane = lane_of(command_class)
+        self.enqueued_at = time.monotonic()
+        self.deadline = self.enqueued_at + deadline
+        self.granted_at = None
+        self.granted = Completion()
+
+
+class ClassStats:
+    """Queue wait statistics for one scheduling class"""
+
+    def __init__(self):
+        self.dispatched = 0
+        self.expired = 0
+        self.rejected = 0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+
+    def record_wait(self, seconds):
+        self.dispatched += 1
+        self.waits.append(seconds * 1000)
+
+    def snapshot(self, queued):
+        waits = sorted(self.waits)
+        summary = {
+            'queued': queued,
+            'dispatched': self.dispatched,
+            'expired': self.expired,
+            'rejected': self.rejected,
+            'wait_ms_avg': 0.0,
+            'wait_ms_p95': 0.0,
+            'wait_ms_max': 0.0,
+        }
+        if waits:
+            summary['wait_ms_avg'] = round(sum(waits) / len(waits), 1)
+            summary['wait_ms_p95'] = round(waits[math.ceil(0.95 * len(waits)) - 1], 1)
+            summary['wait_ms_max'] = round(waits[-1], 1)
+        return summary
+
+
+class CommandScheduler:
+    """
+    Grants commands access to the serial link one lane at a time.
+    Callers block in `execute` until granted, then talk to the link
+    themselves and release their lane when the reply is in.
+    """
+
+    def __init__(self, link, deadlines=None, queue_limits=None):
+        self.link = link
+        self.deadlines = dict(DEFAULT_DEADLINES, **(deadlines or {}))
+        self.queue_limits = dict(DEFAULT_QUEUE_LIMITS, **(queue_limits or {}))
+        self._lock = threading.Lock()
+        # class -> flow -> deque of tickets
+        self._queues = {name: OrderedDict() for name in CLASSES}
+        self._busy_lanes = set()
+        self._holders = {}  # lane -> granted ticket
+        self._service_times = dict(DEFAULT_SERVICE_TIMES)
+        self._measured = set()  # Classes whose service time is no longer the default
+        self._stats = {name: ClassStats() for name in CLASSES}
+        self._rotation = [name for name, weight in ROUND_ROBIN_WEIGHTS for _ in range(weight)]
+        self._rotation_index = 0
+
+    def execute(self, command, data, timeout=10, deadline=None, on_update=None):
+        """
+        Queue a command, wait for its turn, send it and wait for the reply.
+        Returns (result, updates) like SerialLink.request.
+        Raises Overloaded if it cannot be sent in time, without queueing it,
+        or DeadlineExceeded if its wait ran out anyway.
+        """
+        ticket = self._admit(command, data, deadline)
+        if not ticket.granted.wait(max(0, ticket.deadline - time.monotonic())):
+            self._check_expired(ticket)
+        profiling.mark(profiling.QUEUE_WAIT)
+
+        try:
+            return self.link.request(command, data, timeout=timeout, on_update=on_update)
+        finally:
+            self._release(ticket)
+
+    async def execute_async(self, command, data, timeout=10, deadline=None, on_update=None):
+        """Like execute, but awaits its turn and the reply in a coroutine"""
+        ticket = self._admit(command, data, deadline)
+        if not await ticket.granted.wait_async(max(0, ticket.deadline - time.monotonic())):
+            self._check_expired(ticket)
+        profiling.mark(profiling.QUEUE_WAIT)
+
+        try:
+            return await self.link.request_async(command, data, timeout=timeout, on_update=on_update)
+        finally:
+            self._release(ticket)
+
+    def _admit(self, command, data, deadline):
+        command_class = classify(command, data)
+        if deadline is None:
+            deadline = self.deadlines[command_class]
+
+        ticket = Ticket(command, data, command_class, data.get('slot'), deadline)
+        profiling.mark(profiling.HANDLER)
+        self._enqueue(ticket, deadline)
+        return ticket
+
+    def _check_expired(self, ticket):
+        """Raise for a ticket whose wait timed out, unless granted meanwhile"""
+        if self._withdraw(ticket):
+            waited = ticket.deadline - ticket.enqueued_at
+            with self._lock:
+                backlog = self._backlog(ticket.command_class)
+            raise DeadlineExceeded(
+                f"{ticket.command} waited more than {waited:g}s for the serial port", backlog)
+
+    def queue_stats(self):
+        """Per-class queue depth, wait times and backlog estimate, for /health"""
+        with self._lock:
+            stats = {}
+            for name in CLASSES:
+                stats[name] = self._stats[name].snapshot(self._queued(name))
+                stats[name]['service_ms'] = round(self._service_times[name] * 1000, 1)
+                stats[name]['backlog_ms'] = round(self._backlog(name) * 1000, 1)
+            return stats
+
+    def _queued(self, command_class):
+        return sum(len(tickets) for tickets in self._queues[command_class].values())
+
+    def _backlog(self, command_class):
+        """
+        Seconds until a ticket of this class queued now would be granted
+        (lock held): what is left of the command holding its lane, the
+        tickets of its class ahead of it, and the share of the other
+        classes' tickets the rotation serves in between
+        """
+        lane = lane_of(command_class)
+        wait = 0.0
+        holder = self._holders.get(lane)
+        if holder is not None:
+            held = time.monotonic() - holder.granted_at
+            wait += max(0.0, self._service_times[holder.command_class] - held)
+
+        ahead = self._queued(command_class)
+        wait += ahead * self._service_times[command_class]
+        if command_class == SAFETY:
+            return wait
+
+        weights = dict(ROUND_ROBIN_WEIGHTS)
+        for name in CLASSES:
+            if name == command_class or lane_of(name) != lane:
+                continue
+            queued = self._queued(name)
+            if name != SAFETY:
+                # Served in proportion to the weights until it is this ticket's turn
+                queued = min(queued, math.ceil((ahead + 1) * weights[name] / weights[command_class]))
+            wait += queued * self._service_times[name]
+        return wait
+
+    def _enqueue(self, ticket, deadline):
+        with self._lock:
+            self._admit_or_reject(ticket, deadline)
+            flows = self._queues[ticket.command_class]
+            flows.setdefault(ticket.flow, deque()).append(ticket)
+            self._grant()
+
+    def _admit_or_reject(self, ticket, deadline):
+        """Raise Overloaded if the ticket cannot reach the board in time (lock held)"""
+        command_class = ticket.command_class
+        if self.queue_limits[command_class] is None:
+            return  # Never shed
+        queued = self._queued(command_class)
+        if queued >= self.queue_limits[command_class]:
+            self._stats[command_class].rejected += 1
+            raise Overloaded(f"{ticket.command} rejected: {queued} {command_class} commands already waiting",
+                             self._backlog(command_class))
+
+        backlog = self._backlog(command_class)
+        if backlog > deadline:
+            self._stats[command_class].rejected += 1
+            raise Overloaded(f"{ticket.command} rejected: the serial backlog ({backlog:.1f}s) "
+                             f"is longer than its {deadline:g}s deadline", backlog - deadline)
+
+    def _withdraw(self, ticket):
+        """Remove an expired ticket; False if it was granted meanwhile"""
+        with self._lock:
+            if ticket.granted.is_set():
+                return False
+            flows = self._queues[ticket.command_class]
+            tickets = flows.get(ticket.flow)
+            if tickets and ticket in tickets:
+                tickets.remove(ticket)
+                if not tickets:
+                    del flows[ticket.flow]
+            self._stats[ticket.command_class].expired += 1
+            return True
+
+    def _release(self, ticket):
+        with self._lock:
+            held = time.monotonic() - ticket.granted_at
+            if ticket.command_class in self._measured:
+                average = self._service_times[ticket.command_class]
+                held = average + SERVICE_TIME_SMOOTHING * (held - average)
+            self._service_times[ticket.command_class] = held
+            self._measured.add(ticket.command_class)
+            self._busy_lanes.discard(ticket.lane)
+            self._holders.pop(ticket.lane, None)
+            self._grant()
+
+    def _grant(self):
+        """Hand free lanes to the next eligible tickets (lock held)"""
+        while True:
+            ticket = self._next_ticket()
+            if ticket is None:
+                return
+            self._busy_lanes.add(ticket.lane)
+            self._holders[ticket.lane] = ticket
+            ticket.granted_at = time.monotonic()
+            self._stats[ticket.command_class].record_wait(ticket.granted_at - ticket.enqueued_at)
+            ticket.granted.set()
+
+    def _next_ticket(self):
+        if SAFETY not in self._blocked_classes():
+            ticket = self._pop_from(SAFETY)
+            if ticket:
+                return ticket
+
+        blocked = self._blocked_classes()
+        for offset in range(len(self._rotation)):
+            index = (self._rotation_index + offset) % len(self._rotation)
+            name = self._rotation[index]
+            if name in blocked:
+                continue
+            ticket = self._pop_from(name)
+            if ticket:
+                self._rotation_index = (index + 1) % len(self._rotation)
+                return ticket
+        return None
+
+    def _blocked_classes(self):
+        blocked = set()
+        if SHORT_LANE in self._busy_lanes:
+            blocked.update([SAFETY, ACTUATOR, COIN])
+        if LONG_LANE in self._busy_lanes:
+            blocked.add(FINGERPRINT)
+        return blocked
+
+    def _pop_from(self, command_class):
+        """Pop the next live ticket, round robin across flows (slots)"""
+        flows = self._queues[command_class]
+        while flows:
+            flow, tickets = next(iter(flows.items()))
+            ticket = tickets.popleft()
+            del flows[flow]
+            if tickets:
+                flows[flow] = tickets  # Re-append: this flow goes to the back
+
+            if ticket.deadline >= time.monotonic():
+                return ticket
+            # Expired while queued; its caller will notice and raise
+        return None
@@ -0,0 +1,8 @@
+"""
+pytest configuration
+test_api.py, test_enrollment.py and test_fingerprint_debug.py are
+interactive scripts that talk to a running bridge (run them with python);
+everything else named test_*.py is a unit test run by `python -m pytest`.
+"""
+
+collect_ignore = ['test_api.py', 'test_enrollment.py', 'test_fingerprint_debug.py']
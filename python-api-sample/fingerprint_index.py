@@ -0,0 +1,72 @@
+"""
+Fingerprint ID -> slot index
+The AS608 only knows template IDs. The bridge remembers which slot (and
+charging session, if the UI gave one) each enrolled ID belongs to, so a
+one-to-many identify scan can go straight to the right slot without the
+user choosing it first.
+
+The index lives in memory: bindings are made on enrollment or by the UI,
+and dropped when the fingerprint is deleted or the slot is released.
+"""
+
+import threading
+import time
+
+
+class FingerprintIndex:
+    """Fingerprint ID <-> slot bindings; a slot has at most one owner"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_id = {}
+        self._by_slot = {}
+
+    def bind(self, fingerprint_id, slot, session_id=None):
+        """Bind an ID to a slot, replacing the slot's previous owner"""
+        entry = {
+            'fingerprintId': fingerprint_id,
+            'slotNumber': slot,
+            'sessionId': session_id,
+            'boundAt': time.time(),
+        }
+        with self._lock:
+            self._drop(fingerprint_id)
+            previous = self._by_slot.get(slot)
+            if previous is not None:
+                self._drop(previous)
+            self._by_id[fingerprint_id] = entry
+            self._by_slot[slot] = fingerprint_id
+        return dict(entry)
+
+    def unbind(self, fingerprint_id):
+        """Drop an ID's binding; False if it had none"""
+        with self._lock:
+            return self._drop(fingerprint_id)
+
+    def unbind_range(self, first_id, last_id):
+        """Drop the bindings of deleted templates; returns how many there were"""
+        with self._lock:
+            return sum(self._drop(fingerprint_id) for fingerprint_id in range(first_id, last_id + 1))
+
+    def release_slot(self, slot):
+        """Drop whoever owns a slot (its session ended)"""
+        with self._lock:
+            fingerprint_id = self._by_slot.get(slot)
+            return self._drop(fingerprint_id) if fingerprint_id is not None else False
+
+    def lookup(self, fingerprint_id):
+        with self._lock:
+            entry = self._by_id.get(fingerprint_id)
+            return dict(entry) if entry else None
+
+    def all(self):
+        with self._lock:
+            return [dict(entry) for _, entry in sorted(self._by_id.items())]
+
+    def _drop(self, fingerprint_id):
+        entry = self._by_id.pop(fingerprint_id, None)
+        if entry is None:
+            return False
+        if self._by_slot.get(entry['slotNumber']) == fingerprint_id:
+            del self._by_slot[entry['slotNumber']]
+        return True
@@ -0,0 +1,204 @@
+"""
+Background jobs
+Long-running bridge operations run on a worker thread and are tracked by
+job id, so the HTTP request returns at once and clients poll for progress.
+
+Every progress update is also kept as an event, so clients can instead
+follow a job as it happens (/api/jobs/<id>/events), and a job can be asked
+to stop early (/api/jobs/<id>/cancel).
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+# Finished jobs are kept for polling until this many newer jobs exist
+MAX_FINISHED_JOBS = 50
+
+
+class Job:
+    """One background operation and its progress"""
+
+    def __init__(self, kind, params):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params
+        self.state = QUEUED
+        self.done = 0
+        self.total = None
+        self.message = ''
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self._events = []
+        self._cancel_callbacks = []
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def update(self, done=None, total=None, message=None):
+        """Record progress from the worker"""
+        with self._lock:
+            if done is not None:
+                self.done = done
+            if total is not None:
+                self.total = total
+            if message is not None:
+                self.message = message
+            self._add_event()
+
+    def cancel(self):
+        """
+        Ask the job to stop; its on_cancel callbacks run on this thread.
+        False if it had already finished.
+        """
+        with self._lock:
+            if self.finished:
+                return False
+            first_request = not self.cancel_requested
+            self.cancel_requested = True
+            self.message = 'Cancelling...'
+            self._add_event()
+            callbacks = list(self._cancel_callbacks) if first_request else []
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                log.error(f"❌ Cancelling job {self.kind} {self.id} failed: {e}")
+        return True
+
+    def on_cancel(self, callback):
+        """Called by the worker: run callback() when the job is cancelled"""
+        with self._lock:
+            self._cancel_callbacks.append(callback)
+            cancelled = self.cancel_requested
+        if cancelled:
+            callback()
+
+    def wait_events(self, since, timeout):
+        """
+        Events after the first `since`, waiting up to `timeout` for one if
+        there are none yet. Returns (events, finished).
+        """
+        with self._lock:
+            if len(self._events) <= since and not self.finished:
+                self._changed.wait(timeout)
+            return self._events[since:], self.finished
+
+    def _finish(self, state):
+        with self._lock:
+            self.state = state
+            if state == CANCELLED:
+                self.message = 'Cancelled'
+            self.finished_at = time.time()
+            self._changed.notify_all()
+
+    def _add_event(self):
+        self._events.append({
+            'id': len(self._events) + 1,
+            'time': time.time(),
+            'progress': {'done': self.done, 'total': self.total},
+            'message': self.message,
+        })
+        self._changed.notify_all()
+
+    @property
+    def finished(self):
+        return self.state in (SUCCEEDED, FAILED, CANCELLED)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'jobId': self.id,
+                'kind': self.kind,
+                'state': self.state,
+                'progress': {'done': self.done, 'total': self.total},
+                'message': self.message,
+                'result': self.result,
+                'error': self.error,
+                'cancelRequested': self.cancel_requested,
+                'createdAt': self.created_at,
+                'startedAt': self.started_at,
+                'finishedAt': self.finished_at,
+            }
+
+
+class JobRegistry:
+    """Starts jobs on daemon threads and keeps them for status queries"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+
+    def start(self, kind, target, **params):
+        """
+        Run target(job, **params) in the background and return the Job.
+        The target returns the job result or raises to fail the job. A job
+        that raises after it was asked to cancel ends as cancelled; one that
+        finished anyway still succeeds.
+        """
+        job = Job(kind, params)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+
+        thread = threading.Thread(target=self._run, args=(job, target), name=f'job-{kind}', daemon=True)
+        thread.start()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        """The job, after asking it to stop; None if there is no such job"""
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
+
+    def events(self, job_id, since=0, timeout=15):
+        """Long poll: {'events': [...], 'job': snapshot} once there is news, None if unknown"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        events, _ = job.wait_events(since, timeout)
+        return {'events': events, 'job': job.to_dict()}
+
+    def _run(self, job, target):
+        job.state = RUNNING
+        job.started_at = time.time()
+        state = SUCCEEDED
+        try:
+            job.result = target(job, **job.params)
+        except Exception as e:
+            job.error = str(e)
+            if job.cancel_requested:
+                state = CANCELLED
+            else:
+                state = FAILED
+                log.error(f"❌ Job {job.kind} {job.id} failed: {e}")
+        finally:
+            job._finish(state)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
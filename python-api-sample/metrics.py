@@ -0,0 +1,201 @@
+"""
+Prometheus metrics for the bridge
+Counters, gauges and histograms kept in process and rendered in the
+Prometheus text exposition format by GET /metrics. Values that already live
+elsewhere (queue depth, serial byte counts, link state) are read at scrape
+time by collector callbacks instead of being mirrored on every change.
+"""
+
+import math
+import threading
+
+# Histogram buckets (seconds, upper bounds; +Inf is implied)
+COMMAND_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+FINGERPRINT_BUCKETS = (0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 60)
+HTTP_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metric:
+    """One metric family; each distinct label tuple is one series"""
+
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, values):
+        if len(values) != len(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {values}")
+        return tuple(str(value) for value in values)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            series = sorted(self._series.items())
+        for values, state in series:
+            lines.extend(self._render_series(values, state))
+        return lines
+
+    def _render_series(self, values, value):
+        return [f'{self.name}{format_labels(self.labels, values)} {format_value(value)}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def set_total(self, *labels, value):
+        """For totals counted elsewhere and copied in by a collector"""
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, *labels, value):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=COMMAND_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, *labels, value):
+        key = self._key(labels)
+        with self._lock:
+            state = self._series.get(key)
+            if state is None:
+                state = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][index] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    def _render_series(self, values, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state['counts']):
+            cumulative += count
+            labels = format_labels(self.labels, values, [('le', format_value(float(bound)))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = format_labels(self.labels, values)
+        lines.append(f'{self.name}_sum{labels} {format_value(round(state["sum"], 6))}')
+        lines.append(f'{self.name}_count{labels} {state["count"]}')
+        return lines
+
+
+class Registry:
+    """The metrics of one process, plus callbacks refreshed on each scrape"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self.register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=COMMAND_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def add_collector(self, callback):
+        """callback() runs before every render and sets gauges/counters"""
+        self._collectors.append(callback)
+
+    def render(self):
+        for collect in self._collectors:
+            collect()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+command_seconds = registry.histogram(
+    'bridge_command_duration_seconds',
+    'Round trip of send_arduino_command (scheduler wait + serial exchange)',
+    ('command',))
+command_results = registry.counter(
+    'bridge_command_results_total',
+    'Commands sent to the Arduino by outcome (ok, failed, timeout, error, shed, simulated, skipped, no_board)',
+    ('command', 'outcome'))
+fingerprint_seconds = registry.histogram(
+    'bridge_fingerprint_duration_seconds',
+    'Duration of AS608 enrollments and verifications by outcome',
+    ('operation', 'outcome'), FINGERPRINT_BUCKETS)
+
+serial_bytes = registry.counter(
+    'bridge_serial_bytes_total', 'Bytes moved over each Arduino serial port', ('board', 'direction'))
+serial_discarded = registry.counter(
+    'bridge_serial_discarded_total',
+    'Serial input the bridge could not use (non_json, unexpected, late_reply, bad_frame)',
+    ('board', 'reason'))
+
+queue_depth = registry.gauge(
+    'bridge_queue_depth', 'Commands waiting for a serial port, per board and scheduler class', ('board', 'class'))
+queue_dispatched = registry.counter(
+    'bridge_queue_dispatched_total', 'Commands granted a serial port, per board and scheduler class',
+    ('board', 'class'))
+queue_expired = registry.counter(
+    'bridge_queue_expired_total', 'Commands dropped after waiting past their deadline', ('board', 'class'))
+queue_rejected = registry.counter(
+    'bridge_queue_rejected_total', 'Commands turned away on arrival (queue full or backlog past their deadline)',
+    ('board', 'class'))
+queue_backlog = registry.gauge(
+    'bridge_queue_backlog_seconds', 'Estimated wait before a command queued now would reach the board',
+    ('board', 'class'))
+
+arduino_state = registry.gauge(
+    'bridge_arduino_state', '1 for the current connection state of each Arduino', ('board', 'state'))
+arduino_reconnects = registry.counter(
+    'bridge_arduino_reconnects_total', 'Times an Arduino link came back after an outage', ('board',))
+arduino_outage_seconds = registry.counter(
+    'bridge_arduino_outage_seconds_total', 'Time spent with an Arduino link down', ('board',))
+
+http_seconds = registry.histogram(
+    'bridge_http_request_duration_seconds', 'HTTP request latency per route',
+    ('method', 'route', 'status'), HTTP_BUCKETS)
@@ -0,0 +1,194 @@
+"""
+Opt-in per-request profiling
+A profiled request carries a Timeline through the scheduler and the serial
+link, which mark the end of each phase as it happens: handler work before
+the command is queued, queue wait, serial write, waiting on the board (until
+the first byte of its reply), transfer (until the last byte), parse, and
+building the response. Optionally a sampling profiler records the request
+thread's stacks while it runs.
+
+Finished timelines are kept so the slowest can be dumped from
+/api/debug/profiles. Turn it on per request with an `X-Profile: timeline`
+(or `sample`) header, or for every request with PROFILE_REQUESTS.
+"""
+
+import contextvars
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# '' (off unless asked for by header), 'timeline' or 'sample'
+PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS', '')
+PROFILE_HEADER = 'X-Profile'
+PROFILE_KEEP = 50
+
+SAMPLE_INTERVAL = 0.005
+SAMPLE_STACKS = 20  # Most frequent stacks kept per request
+
+# Phases in the order they normally happen; each is marked when it ends
+HANDLER = 'handler'
+QUEUE_WAIT = 'queue_wait'
+SERIAL_WRITE = 'serial_write'
+BOARD = 'board'
+TRANSFER = 'transfer'
+PARSE = 'parse'
+RESPONSE = 'response'
+BROKER = 'broker'  # HTTP worker waiting on serial_broker.py, which has the serial phases
+
+_current = contextvars.ContextVar('profile_timeline', default=None)
+_ids = itertools.count(1)
+
+
+def requested_mode(header_value):
+    """Profiling mode for a request, from its X-Profile header or the config"""
+    value = (header_value or '').strip().lower()
+    if value in ('1', 'true', 'timeline'):
+        return 'timeline'
+    if value == 'sample':
+        return 'sample'
+    return PROFILE_REQUESTS or None
+
+
+def current():
+    return _current.get()
+
+
+def mark(phase, at=None):
+    """Mark the end of a phase on the current request's timeline, if profiled"""
+    timeline = _current.get()
+    if timeline is not None:
+        timeline.mark(phase, at)
+
+
+class Timeline:
+    """Marks (phase, perf_counter time) for one request"""
+
+    def __init__(self, method, path):
+        self.id = next(_ids)
+        self.method = method
+        self.path = path
+        self.status = None
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+        self.marks = []
+        self.stacks = None
+
+    def mark(self, phase, at=None):
+        self.marks.append((phase, time.perf_counter() if at is None else at))
+
+    @property
+    def total(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    def phases(self):
+        """Time per phase: each mark counts from the mark before it"""
+        totals = {}
+        previous = self.start
+        for phase, at in sorted(self.marks, key=lambda item: item[1]):
+            totals[phase] = totals.get(phase, 0.0) + max(0.0, at - previous)
+            previous = max(previous, at)
+        return totals
+
+    def server_timing(self):
+        """Server-Timing header value, so browser dev tools show the phases"""
+        return ', '.join(f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in self.phases().items())
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'status': self.status,
+            'startedAt': self.started_at,
+            'totalMs': round(self.total * 1000, 2),
+            'phasesMs': {phase: round(seconds * 1000, 2) for phase, seconds in self.phases().items()},
+            'marks': [{'phase': phase, 'atMs': round((at - self.start) * 1000, 2)}
+                      for phase, at in sorted(self.marks, key=lambda item: item[1])],
+            'stacks': self.stacks,
+        }
+
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval"""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def top(self, limit=SAMPLE_STACKS):
+        """Most frequent stacks, in collapsed (flame graph) format"""
+        return [{'stack': stack, 'samples': count} for stack, count in self.samples.most_common(limit)]
+
+
+class Profiler:
+    """Starts and finishes request timelines and keeps the slowest ones"""
+
+    def __init__(self, keep=PROFILE_KEEP):
+        self.keep = keep
+        self._slowest = []  # Min-heap of (total, id, timeline)
+        self._lock = threading.Lock()
+        self.profiled = 0
+
+    def start(self, method, path, mode='timeline'):
+        """Begin profiling the current request; returns the handle for finish()"""
+        timeline = Timeline(method, path)
+        sampler = None
+        if mode == 'sample':
+            sampler = StackSampler(threading.get_ident())
+            sampler.start()
+        return timeline, sampler, _current.set(timeline)
+
+    def finish(self, handle, status):
+        timeline, sampler, token = handle
+        timeline.mark(RESPONSE)
+        timeline.end = time.perf_counter()
+        timeline.status = status
+        _current.reset(token)
+        if sampler is not None:
+            sampler.stop()
+            timeline.stacks = sampler.top()
+
+        with self._lock:
+            self.profiled += 1
+            entry = (timeline.total, timeline.id, timeline)
+            if len(self._slowest) < self.keep:
+                heapq.heappush(self._slowest, entry)
+            elif entry > self._slowest[0]:
+                heapq.heapreplace(self._slowest, entry)
+        return timeline
+
+    def slowest(self, limit=10):
+        with self._lock:
+            entries = heapq.nlargest(limit, self._slowest)
+        return [timeline.to_dict() for _, _, timeline in entries]
+
+    def clear(self):
+        with self._lock:
+            self._slowest = []
@@ -0,0 +1,466 @@
+"""
+Serial broker
+Only one process may own an Arduino's serial port. The broker is that
+process: it imports the bridge (app.py) normally, so it opens and supervises
+the boards and holds everything that must exist once - the command scheduler,
+coin pushes, slot state, slot timers, charging sessions, telemetry and
+background jobs - and serves it to HTTP workers over a local Unix socket.
+
+Workers import app.py with BROKER_SOCKET set. They then open no port and
+forward every bridge call here, so any number of them can run under a
+multi-worker server while serial access stays strictly serialized.
+
+The protocol is one JSON object per line. A call
+    {"call": "send_arduino_command", "args": [...], "kwargs": {...}}
+gets exactly one reply, {"result": ...} or {"error": "..."}. A subscription
+    {"subscribe": "coins", "since": 12}
+turns the connection into a stream of {"event": {...}} lines, with
+{"keepalive": true} while there is nothing to send.
+
+Run with:
+    python serial_broker.py
+    BROKER_SOCKET=/tmp/kiosk-broker.sock gunicorn -w 4 -b 0.0.0.0:8000 app:app
+"""
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+
+import profiling
+from coin_events import SUBSCRIBER_QUEUE_SIZE, CoinEvent, format_sse
+from command_scheduler import DeadlineExceeded
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = '/tmp/kiosk-broker.sock'
+
+# Idle sync connections kept per worker process
+POOL_SIZE = 8
+
+# A subscription sends a keepalive this often, so dead workers are noticed
+STREAM_KEEPALIVE = 15
+
+# Longest a call waits for its reply. The slowest is an enrollment: up to the
+# outage wait (15 s), a full queue deadline (30 s) and the sensor's 30 s
+CALL_TIMEOUT = 90
+
+# Longest reply line an async call reads (the serial traffic dump is the largest)
+ASYNC_LINE_LIMIT = 4 * 1024 * 1024
+
+# Background job targets a worker may start, by function name in app.py
+JOB_TARGETS = ('delete_fingerprints_job', 'enroll_fingerprint_job', 'verify_fingerprint_job')
+
+
+class BrokerError(RuntimeError):
+    """The broker could not be reached, or the call failed there"""
+
+
+def bridge_calls(bridge):
+    """The app.py functions workers may call, by name"""
+
+    def claim_coin():
+        event = bridge.coin_hub.claim()
+        return event.to_dict() if event else None
+
+    def start_job(kind, target, params):
+        if target not in JOB_TARGETS:
+            raise ValueError(f"Unknown job target {target}")
+        return bridge.jobs.start(kind, getattr(bridge, target), **params).to_dict()
+
+    def get_job(job_id):
+        job = bridge.jobs.get(job_id)
+        return job.to_dict() if job else None
+
+    def cancel_job(job_id):
+        job = bridge.jobs.cancel(job_id)
+        return job.to_dict() if job else None
+
+    return {
+        'send_arduino_command': bridge.send_arduino_command,
+        'send_batch': bridge.send_batch,
+        'health_status': bridge.health_status,
+        'render_metrics': bridge.metrics.registry.render,
+        'observe_http': bridge.observe_http,
+        'claim_coin': claim_coin,
+        'coins_since': bridge.coin_ledger.since,
+        'slot_state': bridge.slot_states.get,
+        'slot_states': bridge.slot_states.all,
+        'is_redundant': bridge.slot_states.is_redundant,
+        'fingerprint_lookup': bridge.fingerprint_index.lookup,
+        'fingerprint_bind': bridge.fingerprint_index.bind,
+        'fingerprint_unbind': bridge.fingerprint_index.unbind,
+        'fingerprint_bindings': bridge.fingerprint_index.all,
+        'fingerprint_release_slot': bridge.fingerprint_index.release_slot,
+        'start_job': start_job,
+        'get_job': get_job,
+        'cancel_job': cancel_job,
+        'job_events': bridge.jobs.events,
+        'serial_traffic': bridge.serial_traffic.recent,
+        'timer_schedule': bridge.slot_timers.schedule,
+        'timer_cancel': bridge.slot_timers.cancel,
+        'timer_cancel_slot': bridge.slot_timers.cancel_slot,
+        'timers': bridge.slot_timers.all,
+        'session_begin': bridge.charging_sessions.begin,
+        'session_extend': bridge.charging_sessions.extend,
+        'session_end': bridge.charging_sessions.end,
+        'session_retry_power_off': bridge.charging_sessions.retry_power_off,
+        'session': bridge.charging_sessions.get,
+        'sessions': bridge.charging_sessions.all,
+        'telemetry_query': bridge.telemetry.query,
+    }
+
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+    """One worker connection; calls on it are answered in order"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                self._send({'error': 'Bad request'})
+                continue
+
+            if request.get('subscribe') == 'coins':
+                self._stream_coins(request.get('since', 0))
+                return
+            self._send(self._call(request))
+
+    def _call(self, request):
+        function = self.server.calls.get(request.get('call'))
+        if function is None:
+            return {'error': f"Unknown call {request.get('call')}"}
+        try:
+            return {'result': function(*request.get('args', []), **request.get('kwargs', {}))}
+        except DeadlineExceeded as e:
+            return {'error': str(e), 'retryAfter': e.retry_after}  # Load shedding, not a fault
+        except Exception as e:
+            log.exception(f"❌ Broker call {request.get('call')} failed")
+            return {'error': str(e)}
+
+    def _stream_coins(self, since):
+        coin_hub = self.server.bridge.coin_hub
+        events = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+        def deliver(event):
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                pass  # The worker catches up with Last-Event-ID
+
+        coin_hub.subscribe(deliver)
+        try:
+            sent_id = since
+            for event in coin_hub.history_since(since):
+                sent_id = event.id
+                self._send({'event': event.to_dict()})
+            while True:
+                try:
+                    event = events.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    self._send({'keepalive': True})
+                    continue
+                if event.id > sent_id:
+                    sent_id = event.id
+                    self._send({'event': event.to_dict()})
+        except OSError:
+            pass  # Worker went away
+        finally:
+            coin_hub.unsubscribe(deliver)
+
+    def _send(self, message):
+        self.wfile.write((json.dumps(message) + '\n').encode())
+        self.wfile.flush()
+
+
+class BrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, bridge):
+        if os.path.exists(path):
+            os.unlink(path)  # Left over from a broker that did not shut down cleanly
+        self.bridge = bridge
+        self.calls = bridge_calls(bridge)
+        super().__init__(path, BrokerHandler)
+        os.chmod(path, 0o660)
+
+
+class BrokerClient:
+    """A worker's side of the socket: pooled sync calls, per-call async ones"""
+
+    def __init__(self, path):
+        self.path = path
+        self._pool = queue.LifoQueue(maxsize=POOL_SIZE)
+
+    def call(self, name, *args, **kwargs):
+        connection = self._checkout()
+        try:
+            connection.settimeout(CALL_TIMEOUT)
+            connection.sendall(encode_call(name, args, kwargs))
+            line = connection.makefile('rb').readline()
+        except OSError as e:  # Including socket.timeout
+            connection.close()
+            self._drain_pool()
+            raise BrokerError(f"Serial broker unavailable ({e})")
+        if not line:
+            connection.close()
+            self._drain_pool()
+            raise BrokerError("Serial broker closed the connection")
+
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+        profiling.mark(profiling.BROKER)
+        return decode_reply(line)
+
+    async def call_async(self, name, *args, **kwargs):
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.path, limit=ASYNC_LINE_LIMIT)
+        except OSError as e:
+            raise BrokerError(f"Serial broker unavailable ({e})")
+        try:
+            writer.write(encode_call(name, args, kwargs))
+            await writer.drain()
+            line = await asyncio.wait_for(reader.readline(), CALL_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise BrokerError(f"Serial broker did not reply within {CALL_TIMEOUT}s")
+        finally:
+            writer.close()
+        if not line:
+            raise BrokerError("Serial broker closed the connection")
+        profiling.mark(profiling.BROKER)
+        return decode_reply(line)
+
+    def subscribe_coins(self, since=0):
+        """Yield coin events (dicts) from `since` on; None for a keepalive"""
+        connection = self._connect()
+        try:
+            connection.sendall((json.dumps({'subscribe': 'coins', 'since': since}) + '\n').encode())
+            for line in connection.makefile('rb'):
+                message = json.loads(line)
+                yield message.get('event')
+        finally:
+            connection.close()
+
+    async def subscribe_coins_async(self, since=0):
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        try:
+            writer.write((json.dumps({'subscribe': 'coins', 'since': since}) + '\n').encode())
+            await writer.drain()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                yield json.loads(line).get('event')
+        finally:
+            writer.close()
+
+    def _drain_pool(self):
+        """The broker restarted: every idle connection is dead too"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _checkout(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _connect(self):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(self.path)
+        except OSError as e:
+            connection.close()
+            raise BrokerError(f"Serial broker unavailable ({e})")
+        return connection
+
+
+def encode_call(name, args, kwargs):
+    return (json.dumps({'call': name, 'args': list(args), 'kwargs': kwargs}) + '\n').encode()
+
+
+def decode_reply(line):
+    reply = json.loads(line)
+    if 'retryAfter' in reply:
+        raise DeadlineExceeded(reply['error'], reply['retryAfter'])
+    if 'error' in reply:
+        raise BrokerError(reply['error'])
+    return reply.get('result')
+
+
+class RemoteSlotStates:
+    """SlotStateTable reads served by the broker"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, slot):
+        return self.client.call('slot_state', slot)
+
+    def all(self):
+        return self.client.call('slot_states')
+
+    def is_redundant(self, command, slot, value):
+        return self.client.call('is_redundant', command, slot, value)
+
+
+class RemoteFingerprintIndex:
+    """FingerprintIndex kept in the broker"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def bind(self, fingerprint_id, slot, session_id=None):
+        return self.client.call('fingerprint_bind', fingerprint_id, slot, session_id)
+
+    def unbind(self, fingerprint_id):
+        return self.client.call('fingerprint_unbind', fingerprint_id)
+
+    def lookup(self, fingerprint_id):
+        return self.client.call('fingerprint_lookup', fingerprint_id)
+
+    def release_slot(self, slot):
+        return self.client.call('fingerprint_release_slot', slot)
+
+    def all(self):
+        return self.client.call('fingerprint_bindings')
+
+
+class RemoteSlotTimers:
+    """SlotTimers running in the broker"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def schedule(self, slot, kind, delay, command, data):
+        return self.client.call('timer_schedule', slot, kind, delay, command, data)
+
+    def cancel(self, timer_id):
+        return self.client.call('timer_cancel', timer_id)
+
+    def cancel_slot(self, slot, kind):
+        return self.client.call('timer_cancel_slot', slot, kind)
+
+    def all(self):
+        return self.client.call('timers')
+
+
+class RemoteChargingSessions:
+    """ChargingSessions scheduled in the broker"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def begin(self, slot, minutes, session_id=None, fingerprint_id=None):
+        return self.client.call('session_begin', slot, minutes, session_id, fingerprint_id)
+
+    def extend(self, slot, minutes):
+        return self.client.call('session_extend', slot, minutes)
+
+    def end(self, slot):
+        return self.client.call('session_end', slot)
+
+    def retry_power_off(self, slot):
+        return self.client.call('session_retry_power_off', slot)
+
+    def get(self, slot):
+        return self.client.call('session', slot)
+
+    def all(self):
+        return self.client.call('sessions')
+
+
+class RemoteTelemetry:
+    """TelemetryStore fed by the broker's boards"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def query(self, resolution='1m', slots=None, since=None, limit=60):
+        return self.client.call('telemetry_query', resolution, slots, since, limit)
+
+
+class RemoteCoinHub:
+    """CoinEventHub claims and streams served by the broker"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def claim(self):
+        event = self.client.call('claim_coin')
+        return CoinEvent.from_dict(event) if event else None
+
+    def stream(self, last_event_id=0, keepalive=STREAM_KEEPALIVE):
+        for event in self.client.subscribe_coins(last_event_id):
+            yield format_sse(CoinEvent.from_dict(event)) if event else ': keepalive\n\n'
+
+    async def stream_async(self, last_event_id=0, keepalive=STREAM_KEEPALIVE):
+        async for event in self.client.subscribe_coins_async(last_event_id):
+            yield format_sse(CoinEvent.from_dict(event)) if event else ': keepalive\n\n'
+
+
+class RemoteJob:
+    """Snapshot of a job running in the broker"""
+
+    def __init__(self, snapshot):
+        self.id = snapshot['jobId']
+        self._snapshot = snapshot
+
+    def to_dict(self):
+        return self._snapshot
+
+
+class RemoteJobRegistry:
+    """JobRegistry whose jobs run (and are polled) in the broker"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def start(self, kind, target, **params):
+        return RemoteJob(self.client.call('start_job', kind, target.__name__, params))
+
+    def get(self, job_id):
+        snapshot = self.client.call('get_job', job_id)
+        return RemoteJob(snapshot) if snapshot else None
+
+    def cancel(self, job_id):
+        snapshot = self.client.call('cancel_job', job_id)
+        return RemoteJob(snapshot) if snapshot else None
+
+    def events(self, job_id, since=0, timeout=15):
+        """Long poll held open in the broker (see JobRegistry.events)"""
+        return self.client.call('job_events', job_id, since, timeout)
+
+
+def main():
+    path = os.environ.pop('BROKER_SOCKET', DEFAULT_SOCKET)
+
+    # Imported with BROKER_SOCKET unset, so this process owns the port
+    import app as bridge
+
+    server = BrokerServer(path, bridge)
+    ports = ', '.join(port for port, _, _ in bridge.ARDUINO_BOARDS)
+    log.info(f"🔌 Serial broker for {ports} listening on {path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+        bridge.charging_sessions.stop()
+        bridge.slot_timers.stop()
+        bridge.boards.stop()
+
+
+if __name__ == '__main__':
+    main()
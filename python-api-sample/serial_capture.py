@@ -0,0 +1,313 @@
+"""
+Serial traffic capture and replay
+With SERIAL_RECORD set to a directory, every byte the bridge writes to a
+board and every chunk it reads back is appended to a capture file, with
+its monotonic time. Captures are compact (a few bytes of framing per
+chunk) so they can run on the kiosk for days.
+
+A capture can then stand in for the board. Opening the port
+`replay:<file>[?speed=10]` plays the board's side back into the bridge at
+the original pace (or faster), once: at the end of the capture the port
+reads as closed. Each chunk is held back until the bridge has written as
+often as it had when it was recorded, or for FOLLOW_TIMEOUT if it never
+does (`&follow=0` turns that off). Its replies only reach a caller whose
+seq they happen to match, so this suits unsolicited traffic best
+(banners, coins, telemetry, noise).
+serial_replay.py instead drives a SerialLink through a capture command by
+command, so parser changes and performance regressions can be checked
+against real traffic without hardware.
+
+File format: MAGIC, then records of
+
+    kind (1 byte) | time delta in us (varint) | length (varint) | bytes
+
+where the delta is from the previous record. OPEN records carry JSON
+({"path", "baud", "time"}) and mark each time the port was (re)opened;
+BAUD records carry the new rate as ASCII. A record cut short by a crash
+is ignored.
+"""
+
+import json
+import os
+import re
+import select
+import threading
+import time
+from urllib.parse import parse_qs
+
+MAGIC = b'KSCAP\x01\n'
+
+RX = 1  # Board -> bridge
+TX = 2  # Bridge -> board
+BAUD = 3
+OPEN = 4
+
+# Port names that open a capture instead of a serial device
+REPLAY_PREFIX = 'replay:'
+
+# How long a replayed chunk waits for a write the bridge may never make
+# (a command from a request that is not being repeated, or a heartbeat),
+# once the bridge has written anything at all
+FOLLOW_TIMEOUT = 1
+
+
+def encode_varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def decode_varint(data, offset):
+    """(value, next offset); raises IndexError if data ends mid-varint"""
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+class CaptureWriter:
+    """Appends records to one capture file; shared by every port it records"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._last = time.monotonic()
+        self.records = 0
+
+    def write(self, kind, payload):
+        with self._lock:
+            if self._file.closed:
+                return
+            now = time.monotonic()
+            delta = max(0, int((now - self._last) * 1_000_000))
+            self._last = now
+            self._file.write(bytes([kind]) + encode_varint(delta) + encode_varint(len(payload)) + payload)
+            self._file.flush()  # A few KB/s at most; keep the tail if the kiosk loses power
+            self.records += 1
+
+    def opened(self, path, baud):
+        self.write(OPEN, json.dumps({'path': path, 'baud': baud, 'time': time.time()}).encode())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def capture_path(directory, port_name):
+    """New capture file for a board, named after its port and the start time"""
+    os.makedirs(directory, exist_ok=True)
+    name = re.sub(r'[^A-Za-z0-9]+', '_', port_name).strip('_') or 'port'
+    return os.path.join(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.kcap")
+
+
+class RecordingPort:
+    """A serial port that records its traffic to a CaptureWriter"""
+
+    def __init__(self, port, capture):
+        self._port = port
+        self._capture = capture
+
+    def read(self, size=1):
+        data = self._port.read(size)
+        if data:
+            self._capture.write(RX, data)
+        return data
+
+    def write(self, data):
+        self._capture.write(TX, bytes(data))
+        return self._port.write(data)
+
+    @property
+    def baudrate(self):
+        return self._port.baudrate
+
+    @baudrate.setter
+    def baudrate(self, value):
+        self._capture.write(BAUD, str(value).encode())
+        self._port.baudrate = value
+
+    @property
+    def timeout(self):
+        return self._port.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._port.timeout = value
+
+    def __getattr__(self, name):
+        # in_waiting, fileno, close...
+        return getattr(self._port, name)
+
+
+def read_capture(path):
+    """[(kind, seconds since the capture started, bytes)]"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a serial capture")
+
+    records = []
+    offset = len(MAGIC)
+    elapsed = 0
+    while offset < len(data):
+        try:
+            kind = data[offset]
+            delta, offset = decode_varint(data, offset + 1)
+            length, offset = decode_varint(data, offset)
+        except IndexError:
+            break  # Cut short
+        if offset + length > len(data):
+            break
+        elapsed += delta
+        records.append((kind, elapsed / 1_000_000, data[offset:offset + length]))
+        offset += length
+    return records
+
+
+class ReplayPort:
+    """
+    Plays the board's side of a capture as if it were the serial port.
+    Received chunks arrive at their recorded times divided by `speed`
+    (0 = as fast as the reader takes them). With `follow_writes`, a chunk
+    is also held back until the bridge has written as many times as it had
+    when the chunk was recorded, so replies never overtake their commands.
+    `follow_timeout` bounds that wait; the writes it gave up on are then
+    taken as made. Writes are accepted and otherwise ignored. The bytes go
+    through a pipe, so the port has a fileno for the asyncio reader too.
+    Once the capture has been played and read, reads raise EOFError and the
+    SerialLink closes.
+    """
+
+    def __init__(self, records, speed=1.0, follow_writes=False, baudrate=9600, timeout=1, follow_timeout=None):
+        self.records = records
+        self.speed = speed
+        self.follow_writes = follow_writes
+        self.follow_timeout = follow_timeout
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.writes = 0
+        self.finished = threading.Event()
+        self._skipped_writes = 0
+        self._buffered = 0
+        self._lock = threading.Lock()
+        self._written = threading.Condition(self._lock)
+        self._closed = False
+        self._read_fd, self._write_fd = os.pipe()
+        self._feeder = threading.Thread(target=self._feed, name='serial-replay', daemon=True)
+        self._feeder.start()
+
+    @classmethod
+    def open(cls, name, baudrate=9600, timeout=1):
+        """Port for 'replay:<file>[?speed=N][&follow=0]'"""
+        path, _, query = name[len(REPLAY_PREFIX):].partition('?')
+        options = parse_qs(query)
+        speed = float(options.get('speed', ['1'])[0])
+        follow_writes = options.get('follow', ['1'])[0] not in ('0', 'false', '')
+        return cls(read_capture(path), speed, follow_writes, baudrate=baudrate, timeout=timeout,
+                   follow_timeout=FOLLOW_TIMEOUT)
+
+    @property
+    def in_waiting(self):
+        return self._buffered
+
+    def fileno(self):
+        return self._read_fd
+
+    def read(self, size=1):
+        if self._closed:
+            raise OSError('Replay port closed')
+        if not self._buffered and self.timeout != 0:
+            self._wait_readable()
+        if not self._buffered:
+            if self.finished.is_set():
+                raise EOFError('Replay finished')
+            return b''
+        data = os.read(self._read_fd, max(1, min(size, self._buffered)))
+        with self._lock:
+            self._buffered -= len(data)
+        return data
+
+    def write(self, data):
+        if self._closed:
+            raise OSError('Replay port closed')
+        with self._lock:
+            self.writes += 1
+            self._written.notify_all()
+        return len(data)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._written.notify_all()
+        if self._write_fd is not None:  # Still feeding
+            os.close(self._write_fd)
+        os.close(self._read_fd)
+
+    def _wait_readable(self):
+        try:
+            select.select([self._read_fd], [], [], self.timeout)
+        except (OSError, ValueError):
+            pass  # Closed meanwhile
+
+    def _feed(self):
+        started = time.monotonic()
+        writes_before = 0
+        for kind, offset, payload in self.records:
+            if kind == TX:
+                writes_before += 1
+                continue
+            if kind != RX:
+                continue
+
+            with self._lock:
+                self._follow(writes_before)
+                if self._closed:
+                    return
+            if self.speed:
+                time.sleep(max(0.0, started + offset / self.speed - time.monotonic()))
+
+            try:
+                os.write(self._write_fd, payload)
+            except OSError:
+                return  # Closed
+            with self._lock:
+                self._buffered += len(payload)
+
+        with self._lock:
+            if self._closed:
+                return
+            # EOF for the asyncio reader; read() then reports the end
+            os.close(self._write_fd)
+            self._write_fd = None
+            self.finished.set()
+
+    def _follow(self, writes_before):
+        """Wait (holding the lock) until the bridge has made `writes_before` writes"""
+        if not self.follow_writes:
+            return
+        deadline = None
+        while self.writes + self._skipped_writes < writes_before and not self._closed:
+            # Before its first write the bridge is still waiting for the board to boot
+            remaining = None
+            if self.follow_timeout is not None and self.writes:
+                deadline = deadline or time.monotonic() + self.follow_timeout
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._skipped_writes = writes_before - self.writes
+                    return
+            self._written.wait(remaining)
+
@@ -0,0 +1,550 @@
+"""
+Serial link to the Arduino Mega
+A single background reader owns the port, frames incoming lines and routes
+each reply to the waiting caller by the sequence id echoed by the board.
+After `upgrade` the link may also carry compact binary frames (see
+binary_protocol.py) and run at a higher baud rate.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import binary_protocol
+import profiling
+from bridge_log import Sampler
+
+log = logging.getLogger(__name__)
+
+# Sequence ids wrap so they always fit in the firmware's `long`
+MAX_SEQ = 65535
+
+# A line longer than this without a newline is noise; drop it
+MAX_LINE_BYTES = 4096
+
+# The firmware reverts to its boot baud rate if nothing valid arrives
+# within LINK_UPGRADE_TIMEOUT_MS of switching; settle well inside that
+BAUD_SETTLE_TIME = 0.1
+
+
+def is_standard_reply(message):
+    """Relay/solenoid/UV/coin replies are complete on the first result line"""
+    return 'success' in message
+
+
+def is_enrollment_reply(message):
+    """Enrollment is complete on a failure or a success with message/ID"""
+    if 'success' not in message:
+        return False
+    if not message.get('success'):
+        return True
+    return 'message' in message or 'fingerprintId' in message
+
+
+def is_verification_reply(message):
+    """Verification is complete on the first result line"""
+    return 'success' in message or 'isValid' in message
+
+
+class LinkDisconnected(Exception):
+    """
+    The port failed (e.g. the USB cable was pulled).
+    `sent` tells whether the command may have reached the board.
+    """
+
+    def __init__(self, message, sent):
+        super().__init__(message)
+        self.sent = sent
+
+
+REPLY_PREDICATES = {
+    'FINGERPRINT_ENROLL': is_enrollment_reply,
+    'FINGERPRINT_VERIFY': is_verification_reply,
+    'FINGERPRINT_IDENTIFY': is_verification_reply,
+}
+
+
+class Completion:
+    """A one-shot flag that threads can wait on and coroutines can await"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def set(self):
+        with self._lock:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    async def wait_async(self, timeout=None):
+        """Await the flag without parking a thread; False on timeout"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+        with self._lock:
+            if self._event.is_set():
+                return True
+            self._callbacks.append(wake)
+
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return self._event.is_set()
+
+
+class PendingReply:
+    """A command written to the Arduino that is waiting for its final reply"""
+
+    def __init__(self, seq, command, is_final, on_update=None):
+        self.seq = seq
+        self.command = command
+        self.is_final = is_final
+        self.on_update = on_update
+        self.updates = []
+        self.result = None
+        self.error = None
+        self.sent_at = time.monotonic()
+        self.finished_at = None
+        self.timeline = None
+        self._done = Completion()
+
+    def deliver(self, message):
+        """Record a line for this command; returns True once it is complete"""
+        if self.is_final(message):
+            self.result = message
+            self.finished_at = time.monotonic()
+            self._done.set()
+            return True
+
+        self.updates.append(message)
+        if self.on_update:
+            self.on_update(message)
+        return False
+
+    def fail(self, error):
+        """The link went down before the final reply"""
+        self.error = error
+        self.finished_at = time.monotonic()
+        self._done.set()
+
+    def wait(self, timeout):
+        return self._done.wait(timeout)
+
+    async def wait_async(self, timeout):
+        return await self._done.wait_async(timeout)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+
+class SerialLink:
+    """
+    Owns the Arduino serial port.
+    Writes are serialized by a lock; a single reader (a daemon thread, or an
+    asyncio event loop) frames every line and hands it either to the pending
+    command with the matching `seq`, or to the registered listeners when it
+    is unsolicited (coin pushes, banners...).
+    """
+
+    def __init__(self, port, traffic=None, sampler=None):
+        self.port = port
+        self.traffic = traffic
+        self.sampler = sampler or Sampler()
+        self._write_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending = OrderedDict()
+        self._next_seq = 0
+        self._listeners = []
+        self._reader = None
+        self._running = False
+        self._loop = None
+        self._buffer = bytearray()
+        self._first_byte_at = self._last_byte_at = 0.0
+        self.binary = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.non_json_lines = 0
+        self.unexpected_lines = 0
+        self.late_replies = 0
+        self.bad_frames = 0
+        self.last_received = time.monotonic()
+        self.error = None
+        self.on_close = None
+        self._closed = threading.Event()
+
+    def start(self):
+        """Start the background reader thread"""
+        if self._reader is not None or self._loop is not None:
+            return
+        self._running = True
+        self._reader = threading.Thread(target=self._read_loop, name='arduino-reader', daemon=True)
+        self._reader.start()
+
+    def stop(self):
+        """Stop reading; waits for the reader thread to let go of the port"""
+        self._running = False
+        if self._reader is not None:
+            if self._reader is not threading.current_thread():
+                self._reader.join()
+            self._reader = None
+        if self._loop is not None:
+            loop, self._loop = self._loop, None
+            try:
+                loop.call_soon_threadsafe(loop.remove_reader, self.port.fileno())
+            except (RuntimeError, ValueError):
+                pass  # Loop already closed, or port already closed
+
+    @property
+    def closed(self):
+        return self._closed.is_set()
+
+    def wait_closed(self, timeout=None):
+        """Block until the link fails or is closed; True if it has"""
+        return self._closed.wait(timeout)
+
+    def close(self, error='Link closed'):
+        """Stop reading, close the port and fail every waiting command"""
+        if self._closed.is_set():
+            return
+        self.error = str(error)
+        self._closed.set()
+        self.stop()
+        try:
+            self.port.close()
+        except Exception:
+            pass
+
+        # Before waking the callers, so they see the connection as down
+        if self.on_close:
+            self.on_close(self)
+
+        with self._pending_lock:
+            pending, self._pending = list(self._pending.values()), OrderedDict()
+        for waiting in pending:
+            waiting.fail(self.error)
+
+    def counters(self):
+        """Traffic totals for this link, for /metrics"""
+        return {
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'non_json': self.non_json_lines,
+            'unexpected': self.unexpected_lines,
+            'late_reply': self.late_replies,
+            'bad_frame': self.bad_frames,
+        }
+
+    def attach_event_loop(self, loop):
+        """
+        Move reading from the thread onto an asyncio event loop (call on the
+        loop's thread). The reader thread is told to stop and joined on an
+        executor, so the loop never waits for it; once it has let go, the
+        port is switched to non-blocking reads and serviced by
+        loop.add_reader. Where that is unsupported (Windows) the reader
+        thread is started again.
+        """
+        if self._loop is loop:
+            return
+
+        reader, self._reader = self._reader, None
+        self._running = False
+        if self._loop is not None:
+            self.stop()  # Leave the previous loop
+        self._loop = loop
+        if reader is None or reader is threading.current_thread():
+            self._add_reader(loop, restart_thread=reader is not None)
+        else:
+            loop.run_in_executor(None, reader.join).add_done_callback(
+                lambda _: self._add_reader(loop, restart_thread=True))
+
+    def _add_reader(self, loop, restart_thread):
+        if self._closed.is_set() or self._loop is not loop:
+            return  # Closed, or moved on, while the thread was finishing
+        try:
+            self.port.timeout = 0
+            loop.add_reader(self.port.fileno(), self._read_available)
+        except (NotImplementedError, AttributeError, ValueError) as e:
+            log.warning(f"⚠ Non-blocking serial reads unavailable ({e}), keeping reader thread")
+            self.port.timeout = 1
+            self._loop = None
+            if restart_thread:
+                self.start()
+
+    def add_listener(self, callback):
+        """Register a callback for lines that are not a reply to any command"""
+        self._listeners.append(callback)
+
+    def request(self, command, data, timeout=10, on_update=None):
+        """
+        Send a command and block until its final reply arrives.
+        Returns (result, updates); result is None on timeout.
+        """
+        pending = self.submit(command, data, on_update=on_update)
+        pending.wait(timeout)
+        self._forget(pending)
+        if pending.error:
+            raise LinkDisconnected(pending.error, sent=True)
+        return pending.result, pending.updates
+
+    async def request_async(self, command, data, timeout=10, on_update=None):
+        """Like request, but awaits the reply instead of blocking a thread"""
+        pending = self.submit(command, data, on_update=on_update)
+        await pending.wait_async(timeout)
+        self._forget(pending)
+        if pending.error:
+            raise LinkDisconnected(pending.error, sent=True)
+        return pending.result, pending.updates
+
+    def upgrade(self, baud_rate=None, binary=True, timeout=2):
+        """
+        Negotiate a faster link with the firmware.
+        Sends LINK_UPGRADE over JSON; a board that supports it replies at the
+        current rate and then switches. The host follows and confirms with a
+        PING at the new rate; if that fails both sides fall back to the old
+        rate. Firmware without LINK_UPGRADE answers "Unknown command" and the
+        link stays on plain JSON. Returns True if anything changed.
+        """
+        old_baud = self.port.baudrate
+        request = {'binary': binary}
+        if baud_rate and baud_rate != old_baud:
+            request['baud'] = baud_rate
+
+        result, _ = self.request('LINK_UPGRADE', request, timeout=timeout)
+        if not result or not result.get('success'):
+            log.warning(f"⚠ Link upgrade not supported: {(result or {}).get('message', 'no reply')}")
+            return False
+
+        new_baud = result.get('baud', old_baud)
+        if new_baud != old_baud:
+            with self._write_lock:
+                self.port.baudrate = new_baud
+            time.sleep(BAUD_SETTLE_TIME)
+
+        pong, _ = self.request('PING', {}, timeout=timeout)
+        if not pong or not pong.get('success'):
+            log.warning(f"⚠ No reply at {new_baud} baud, staying at {old_baud}")
+            with self._write_lock:
+                self.port.baudrate = old_baud
+            return False
+
+        self.binary = bool(result.get('binary'))
+        log.info(f"✓ Arduino link at {new_baud} baud, {'binary' if self.binary else 'JSON'} frames")
+        return True
+
+    def submit(self, command, data, on_update=None, seq=None):
+        """
+        Write a command and return its PendingReply without waiting.
+        `seq` sends it under that id instead of the next one (serial_replay.py
+        re-sends recorded commands with their original ids).
+        """
+        if self._closed.is_set():
+            raise LinkDisconnected(f"Arduino disconnected ({self.error})", sent=False)
+        is_final = REPLY_PREDICATES.get(command, is_standard_reply)
+
+        with self._pending_lock:
+            self._next_seq = seq if seq is not None else self._next_seq % MAX_SEQ + 1
+            seq = self._next_seq
+
+        # Encoded before it is registered: a command that cannot be encoded
+        # must not leave a waiter behind for seq-less replies to land on
+        frame = binary_protocol.encode_command(command, data or {}, seq) if self.binary else None
+        if frame is not None:
+            line = frame.hex(' ')
+        else:
+            line = json.dumps({"command": command, "data": data, "seq": seq})
+            frame = (line + '\n').encode()
+
+        pending = PendingReply(seq, command, is_final, on_update)
+        pending.timeline = profiling.current()
+        with self._pending_lock:
+            self._pending[seq] = pending
+        self._trace('tx', line, command, seq)
+
+        try:
+            with self._write_lock:
+                self.port.write(frame)
+                self.bytes_out += len(frame)
+        except Exception as e:
+            self._forget(pending)
+            log.error(f"❌ Arduino write error: {e}")
+            self.close(e)
+            raise LinkDisconnected(f"Arduino disconnected ({e})", sent=False)
+
+        if pending.timeline is not None:
+            pending.timeline.mark(profiling.SERIAL_WRITE)
+
+        return pending
+
+    def _forget(self, pending):
+        with self._pending_lock:
+            self._pending.pop(pending.seq, None)
+
+    def _read_loop(self):
+        while self._running:
+            try:
+                chunk = self.port.read(self.port.in_waiting or 1)
+            except EOFError as e:
+                self.close(e)  # A port with an end (a replayed capture) reached it
+                return
+            except Exception as e:
+                # On a serial port a read error means the device is gone
+                log.error(f"❌ Arduino read error: {e}")
+                self.close(e)
+                return
+
+            if chunk:
+                self._feed(chunk)
+
+    def _read_available(self):
+        """Event loop reader callback: drain whatever the port has buffered"""
+        try:
+            chunk = self.port.read(self.port.in_waiting or 1)
+        except EOFError as e:
+            self.close(e)
+            return
+        except Exception as e:
+            log.error(f"❌ Arduino read error: {e}")
+            self.close(e)
+            return
+
+        if chunk:
+            self._feed(chunk)
+
+    def _feed(self, chunk):
+        """Frame raw bytes into lines and binary frames and dispatch each one"""
+        self.last_received = time.monotonic()
+        self.bytes_in += len(chunk)
+
+        # When the message now being framed started and last grew (profiling)
+        arrived = time.perf_counter()
+        if not self._buffer:
+            self._first_byte_at = arrived
+        self._last_byte_at = arrived
+
+        self._buffer.extend(chunk)
+        while True:
+            if self._buffer and self._buffer[0] == binary_protocol.FRAME_START:
+                message, consumed = binary_protocol.decode_frame(self._buffer)
+                if message == binary_protocol.NEED_MORE:
+                    return
+                del self._buffer[:consumed]
+                if message == binary_protocol.BAD_FRAME:
+                    self.bad_frames += 1
+                    continue
+                self._dispatch(message, json.dumps(message))
+                continue
+
+            end = self._buffer.find(b'\n')
+
+            # 0xFE never occurs in text, so a frame start ends any partial line
+            frame_start = self._buffer.find(binary_protocol.FRAME_START)
+            if frame_start > 0 and (end < 0 or frame_start < end):
+                raw = bytes(self._buffer[:frame_start])
+                del self._buffer[:frame_start]
+                line = raw.decode('utf-8', errors='ignore').strip()
+                if line:
+                    self._dispatch_line(line)
+                continue
+
+            if end < 0:
+                if len(self._buffer) > MAX_LINE_BYTES:
+                    log.warning(f"⚠ Dropping {len(self._buffer)} bytes without a newline")
+                    self._buffer.clear()
+                return
+
+            raw = bytes(self._buffer[:end])
+            del self._buffer[:end + 1]
+
+            line = raw.decode('utf-8', errors='ignore').strip()
+            if line:
+                self._dispatch_line(line)
+
+    def _dispatch_line(self, line):
+        try:
+            message = json.loads(line)
+        except json.JSONDecodeError:
+            self.non_json_lines += 1
+            self._trace('rx', line)
+            log.warning(f"⚠ Non-JSON line from Arduino: {line}")
+            return
+
+        if not isinstance(message, dict):
+            self.unexpected_lines += 1
+            self._trace('rx', line)
+            log.warning(f"⚠ Unexpected line from Arduino: {line}")
+            return
+
+        self._dispatch(message, line)
+
+    def _dispatch(self, message, line):
+        # Anything left in the buffer arrived with the chunk that ended this message
+        first_byte_at, last_byte_at = self._first_byte_at, self._last_byte_at
+        self._first_byte_at = last_byte_at
+
+        seq = message.get('seq')
+        pending = self._match_pending(message)
+        if pending is None and seq is not None:
+            self.late_replies += 1
+            self._trace('rx', line, seq=seq)
+            log.warning(f"⚠ Late reply from Arduino (caller gave up): {line}")
+            return
+
+        if pending is None:
+            self._trace('rx', line)
+            for listener in self._listeners:
+                try:
+                    listener(message)
+                except Exception:
+                    log.exception("❌ Listener error")
+            return
+
+        self._trace('rx', line, pending.command, pending.seq)
+        if pending.timeline is not None and pending.is_final(message):
+            # Status updates (e.g. "place finger") count as time on the board
+            pending.timeline.mark(profiling.BOARD, first_byte_at)
+            pending.timeline.mark(profiling.TRANSFER, last_byte_at)
+            pending.timeline.mark(profiling.PARSE)
+        if pending.deliver(message):
+            self._forget(pending)
+
+    def _trace(self, direction, line, command=None, seq=None):
+        """Keep every line in the traffic buffer; log a sample at DEBUG"""
+        if self.traffic is not None:
+            self.traffic.record(direction, line, command, seq)
+        if log.isEnabledFor(logging.DEBUG) and self.sampler.should_log(command, seq):
+            arrow = '→ Sending to Arduino' if direction == 'tx' else '← Received from Arduino'
+            log.debug(f"{arrow}: {line}")
+
+    def _match_pending(self, message):
+        """Find the command a line belongs to; None for unsolicited lines"""
+        seq = message.pop('seq', None)
+
+        with self._pending_lock:
+            if seq is not None:
+                return self._pending.get(seq)
+
+            # Unsolicited events from the coin acceptor never carry a seq
+            if 'coinDetected' in message or 'warning' in message:
+                return None
+
+            # Older firmware does not echo seq: fall back to the oldest waiter
+            if self._pending and ('success' in message or 'isValid' in message or 'status' in message):
+                return next(iter(self._pending.values()))
+
+        return None
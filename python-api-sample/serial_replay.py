@@ -0,0 +1,223 @@
+"""
+Deterministic replay of a serial capture
+Drives a SerialLink through a capture recorded with SERIAL_RECORD (see
+serial_capture.py): every command the bridge wrote is submitted again
+under its original seq, and the board's recorded bytes are fed back in
+between, each only after the writes that preceded it. The current parser
+therefore sees exactly the production traffic, in the same order, at the
+original pace or faster.
+
+Reports what the link made of it (replies matched, commands left
+unanswered, unsolicited lines, lines it could not place) and how long
+it took, and can save the report and compare it with an earlier run: a
+parser change that places lines differently shows up as changed counts.
+
+Run with:
+    python serial_replay.py captures/dev_ttyACM0-20261017-091500.kcap
+    python serial_replay.py capture.kcap --speed 0 --save results/replay-v2.json
+    python serial_replay.py capture.kcap --speed 0 --compare results/replay-v2.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+import binary_protocol
+from benchmark import PERCENTILES, format_ms, percentile
+from serial_capture import OPEN, RX, TX, ReplayPort, read_capture
+from serial_link import SerialLink
+
+# After the last recorded byte, replies still in flight get this long
+DRAIN_TIMEOUT = 2
+
+# Report fields that describe how the traffic was parsed, not how fast
+OUTCOME_FIELDS = ('commands', 'replies', 'unanswered', 'undecoded', 'unsolicited',
+                  'non_json', 'unexpected', 'late_reply', 'bad_frame')
+
+
+def split_links(records):
+    """One list of records per time the port was opened"""
+    links = []
+    for record in records:
+        if record[0] == OPEN or not links:
+            links.append([])
+        links[-1].append(record)
+    return links
+
+
+def decode_write(payload):
+    """(command, data, seq) of one recorded write, or None"""
+    if payload[:1] == bytes([binary_protocol.FRAME_START]):
+        return binary_protocol.decode_command(payload[2:-1]) if len(payload) > 5 else None
+    try:
+        message = json.loads(payload)
+        return message['command'], message.get('data') or {}, message.get('seq')
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def unsolicited_kind(message):
+    for key in ('coinDetected', 'telemetry', 'status', 'warning', 'info'):
+        if key in message:
+            return key
+    return 'other'
+
+
+def replay_link(records, speed, report):
+    """Replay one link's records; adds to `report` and returns the finished commands"""
+    start = records[0][1]
+    port = ReplayPort([(kind, offset - start, payload) for kind, offset, payload in records],
+                      speed, follow_writes=True, timeout=0.05)
+    link = SerialLink(port)
+    link.add_listener(lambda message: report['unsolicited'].update([unsolicited_kind(message)]))
+    link.start()
+
+    started = time.monotonic()
+    commands = []
+    for kind, offset, payload in records:
+        if kind != TX:
+            continue
+        if speed:
+            time.sleep(max(0.0, started + (offset - start) / speed - time.monotonic()))
+        decoded = decode_write(payload)
+        if decoded is None:
+            report['undecoded'] += 1
+            port.write(payload)  # Still counts, so the replies after it are released
+            continue
+        command, data, seq = decoded
+        commands.append(link.submit(command, data, seq=seq))
+
+    port.finished.wait()
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    while port.in_waiting and time.monotonic() < deadline:
+        time.sleep(0.01)
+    for pending in commands:
+        pending.wait(max(0.0, deadline - time.monotonic()))
+
+    for name, value in link.counters().items():
+        report[name] = report.get(name, 0) + value
+    link.close('Replay finished')
+    return commands
+
+
+def run_replay(path, speed=1.0):
+    records = read_capture(path)
+    report = {'undecoded': 0, 'unsolicited': Counter()}
+    latencies = {}
+
+    started = time.monotonic()
+    links = split_links(records)
+    for records_of_link in links:
+        for pending in replay_link(records_of_link, speed, report):
+            if pending.result is not None:
+                latencies.setdefault(pending.command, []).append((pending.finished_at - pending.sent_at) * 1000)
+    elapsed = time.monotonic() - started
+
+    total = sum(1 for kind, _, _ in records if kind == TX) - report['undecoded']
+    replies = sum(len(samples) for samples in latencies.values())
+    commands = {}
+    for command, samples in sorted(latencies.items()):
+        samples = sorted(samples)
+        commands[command] = {
+            'replies': len(samples),
+            'mean_ms': sum(samples) / len(samples),
+            'max_ms': samples[-1],
+            **{f'p{p}_ms': percentile(samples, p) for p in PERCENTILES},
+        }
+
+    bytes_in = sum(len(payload) for kind, _, payload in records if kind == RX)
+    report.update({
+        'capture': path,
+        'speed': speed,
+        'links': len(links),
+        'recordedSeconds': records[-1][1] if records else 0,
+        'elapsed': elapsed,
+        'bytesIn': bytes_in,
+        'bytesPerSecond': bytes_in / elapsed if elapsed else 0,
+        'commands': total,
+        'replies': replies,
+        'unanswered': total - replies,
+        'unsolicited': dict(report['unsolicited']),
+        'perCommand': commands,
+    })
+    return report
+
+
+def outcome_changes(results, baseline):
+    """Outcome fields that differ from the baseline, as 'field: before -> now'"""
+    changes = []
+    for field in OUTCOME_FIELDS:
+        if results.get(field) != baseline.get(field):
+            changes.append(f"{field}: {baseline.get(field)} -> {results.get(field)}")
+    return changes
+
+
+def print_report(results, baseline=None):
+    print(f"\n{'='*80}")
+    print(f"REPLAY: {results['capture']} ({results['links']} link(s), "
+          f"{results['recordedSeconds']:.1f}s recorded, speed {results['speed'] or 'max'})")
+    print(f"{'='*80}")
+    print(f"Replayed in {results['elapsed']:.2f}s, {results['bytesIn']} bytes in "
+          f"({results['bytesPerSecond']:.0f} B/s)")
+    print(f"Commands {results['commands']}, replies {results['replies']}, unanswered {results['unanswered']}, "
+          f"undecoded writes {results['undecoded']}")
+    print(f"Unsolicited {results['unsolicited']}")
+    print(f"Discarded: non-JSON {results.get('non_json', 0)}, unexpected {results.get('unexpected', 0)}, "
+          f"late replies {results.get('late_reply', 0)}, bad frames {results.get('bad_frame', 0)}")
+    print(f"\n{'command':28} {'replies':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+
+    for command, stats in results['perCommand'].items():
+        print(f"{command:28} {stats['replies']:7d} {format_ms(stats['p50_ms'])} {format_ms(stats['p95_ms'])} "
+              f"{format_ms(stats['p99_ms'])} {format_ms(stats['max_ms'])}")
+
+        before = (baseline or {}).get('perCommand', {}).get(command)
+        if before:
+            deltas = [f"{key[:-3]} {(stats[key] - before[key]) / before[key]:+.0%}"
+                      for key in ('p50_ms', 'p95_ms') if before[key]]
+            print(f"{'  vs ' + baseline.get('label', 'baseline'):28} {', '.join(deltas)}")
+
+    if baseline:
+        change = (results['elapsed'] - baseline['elapsed']) / baseline['elapsed']
+        print(f"\nReplay time vs {baseline.get('label', 'baseline')}: {change:+.1%}")
+        for line in outcome_changes(results, baseline):
+            print(f"  changed {line}")
+    print(f"{'='*80}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a serial capture through the bridge\'s SerialLink')
+    parser.add_argument('capture', help='capture file recorded with SERIAL_RECORD')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='multiple of the recorded pace (0 = as fast as possible)')
+    parser.add_argument('--label', help='name for this run in saved results (e.g. a git tag)')
+    parser.add_argument('--save', help='write results as JSON to this path')
+    parser.add_argument('--compare', help='earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    results = run_replay(args.capture, args.speed)
+    results['label'] = args.label or time.strftime('%Y-%m-%d %H:%M:%S')
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.save:
+        directory = os.path.dirname(args.save)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.save}")
+
+    # A parser change that places the same traffic differently fails the run
+    if baseline and outcome_changes(results, baseline):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+In-memory mirror of per-slot actuator state
+Updated only from replies the Arduino confirmed, so reads are served
+without any serial I/O and redundant commands can be skipped.
+"""
+
+import threading
+import time
+
+# Matches TOTAL_SLOTS and the pin tables in solar5.ino
+TOTAL_SLOTS = 16
+SOLENOID_SLOTS = range(4, 17)
+UV_LIGHT_SLOTS = range(7, 13)
+
+
+class SlotState:
+    """
+    Last confirmed relay/lock/UV state of one slot (None = unknown)
+    `local_slot` is its number on the board that drives it, which decides
+    what hardware it has.
+    """
+
+    def __init__(self, slot, local_slot=None):
+        self.slot = slot
+        self.local_slot = local_slot or slot
+        self.relay_on = None
+        self.locked = None
+        self.uv_on = None
+        self.updated_at = None
+
+    def to_dict(self):
+        return {
+            'slotNumber': self.slot,
+            'relayOn': self.relay_on,
+            'locked': self.locked,
+            'uvLightOn': self.uv_on,
+            'hasSolenoid': self.local_slot in SOLENOID_SLOTS,
+            'hasUvLight': self.local_slot in UV_LIGHT_SLOTS,
+            'updatedAt': self.updated_at,
+        }
+
+
+class SlotStateTable:
+    """
+    Authoritative bridge-side view of every slot
+    `layout` maps kiosk slot -> slot number on its board (see board_set.py);
+    by default there is one board and the two are the same.
+    """
+
+    def __init__(self, total_slots=TOTAL_SLOTS, layout=None):
+        self._lock = threading.Lock()
+        if layout is None:
+            layout = {slot: slot for slot in range(1, total_slots + 1)}
+        self._slots = {slot: SlotState(slot, local) for slot, local in layout.items()}
+
+    def get(self, slot):
+        with self._lock:
+            state = self._slots.get(slot)
+            return state.to_dict() if state else None
+
+    def all(self):
+        with self._lock:
+            return [state.to_dict() for state in self._slots.values()]
+
+    def reset_to_boot_defaults(self, slots=None):
+        """The firmware starts with relays off, solenoids locked, UV off"""
+        with self._lock:
+            now = time.time()
+            for state in self._slots.values():
+                if slots is not None and state.slot not in slots:
+                    continue
+                state.relay_on = False
+                state.locked = True if state.local_slot in SOLENOID_SLOTS else None
+                state.uv_on = False if state.local_slot in UV_LIGHT_SLOTS else None
+                state.updated_at = now
+
+    def handle_message(self, message, slots=None):
+        """
+        SerialLink listener: a fresh boot banner means all outputs reset
+        (only `slots`, the ones of the board that printed it, if given)
+        """
+        if message.get('status') == 'Arduino Ready':
+            self.reset_to_boot_defaults(slots)
+
+    def is_redundant(self, command, slot, value):
+        """True if the slot is already known to be in the requested state"""
+        with self._lock:
+            state = self._slots.get(slot)
+            if state is None:
+                return False
+            if command == 'RELAY':
+                return state.relay_on is not None and state.relay_on == bool(value)
+            if command == 'SOLENOID':
+                return state.locked is not None and state.locked == bool(value)
+            if command == 'UV_LIGHT':
+                return state.uv_on is not None and state.uv_on == bool(value)
+            return False
+
+    def record(self, command, data, result):
+        """Apply a confirmed command reply to the table"""
+        if not result.get('success'):
+            return
+
+        if command == 'BATCH':
+            codes = result.get('results')
+            if codes is None and result.get('simulated'):
+                codes = [0] * len(data.get('ops', []))
+            for (name, slot, value), code in zip(data.get('ops', []), codes or []):
+                if code == 0:
+                    self._apply(name, slot, value)
+            return
+
+        if command == 'SOLENOID':
+            # A timed unlock stays unlocked here until its re-lock is confirmed
+            self._apply(command, data.get('slot'), data.get('lock'))
+        elif command in ('RELAY', 'UV_LIGHT'):
+            self._apply(command, data.get('slot'), data.get('state'))
+        elif command == 'UNLOCK_TEMP':
+            self._apply(command, data.get('slot'), None)
+
+    def _apply(self, command, slot, value):
+        with self._lock:
+            state = self._slots.get(slot)
+            if state is None:
+                return
+            if command == 'RELAY':
+                state.relay_on = bool(value)
+            elif command == 'SOLENOID':
+                state.locked = bool(value)
+            elif command == 'UV_LIGHT':
+                state.uv_on = bool(value)
+            elif command == 'UNLOCK_TEMP':
+                state.locked = False  # Until the re-lock 2 s later is confirmed
+            state.updated_at = time.time()
@@ -0,0 +1,173 @@
+"""
+Timed slot actions
+A timed or temporary unlock goes to the board with its duration, and the
+firmware re-locks the slot on its own when it runs out; a UV sanitization
+cycle goes as a plain UV on. The bridge also keeps the follow-up (re-lock, UV off) in
+a heap ordered by due time and sends it once it falls due, so a slot is
+switched back even if the board reset and lost its own timer in between.
+The firmware relock is the failsafe for the opposite case: the bridge
+crashing or losing the serial link.
+
+A slot has at most one timer of each kind: scheduling another replaces it
+(a second unlock extends the first), and an explicit command for the slot
+cancels it (see app.py). A follow-up the board does not confirm is retried
+until it is, with backoff, so a re-lock outlasts a reconnect.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+RELOCK = 'relock'
+UV_OFF = 'uv-off'
+
+# Retries of an unconfirmed follow-up back off from the first to the second delay
+RETRY_DELAYS = (1.0, 30)
+
+# After this many failed attempts the follow-up counts as failed (and is
+# logged as an error), but it is still retried
+ALERT_ATTEMPTS = 5
+
+# Follow-ups that fall due together are sent by this many threads at once
+FIRE_WORKERS = 4
+
+
+class SlotTimer:
+    """One pending follow-up command"""
+
+    def __init__(self, timer_id, slot, kind, command, data, due_at):
+        self.id = timer_id
+        self.slot = slot
+        self.kind = kind
+        self.command = command
+        self.data = data
+        self.due_at = due_at  # time.monotonic(): the Pi's wall clock jumps when NTP syncs
+        self.created_at = time.time()
+        self.attempts = 0
+
+    def to_dict(self):
+        remaining = self.due_at - time.monotonic()
+        return {
+            'timerId': self.id,
+            'slotNumber': self.slot,
+            'kind': self.kind,
+            'command': self.command,
+            'data': self.data,
+            'dueAt': time.time() + remaining,
+            'remainingSeconds': round(max(0.0, remaining), 3),
+            'createdAt': self.created_at,
+            'attempts': self.attempts,
+        }
+
+
+class SlotTimers:
+    """
+    Follow-up commands by due time
+    `run_action(command, data)` sends one and returns its result dict; it
+    is called on a small worker pool so a slow board does not hold up the
+    other timers.
+    """
+
+    def __init__(self, run_action):
+        self.run_action = run_action
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._heap = []  # (due_at, timer id); stale entries are skipped
+        self._timers = {}  # timer id -> SlotTimer
+        self._by_slot = {}  # (slot, kind) -> timer id
+        self._ids = itertools.count(1)
+        self._pool = ThreadPoolExecutor(max_workers=FIRE_WORKERS, thread_name_prefix='slot-timer')
+        self._running = False
+        self.fired = 0
+        self.failed = 0
+
+    def start(self):
+        self._running = True
+        threading.Thread(target=self._run, name='slot-timers', daemon=True).start()
+
+    def stop(self):
+        with self._lock:
+            self._running = False
+            self._changed.notify_all()
+        self._pool.shutdown(wait=False)
+
+    def schedule(self, slot, kind, delay, command, data):
+        """Send command(data) after `delay` seconds, replacing the slot's timer of this kind"""
+        with self._lock:
+            self._remove(self._by_slot.get((slot, kind)))
+            timer = SlotTimer(next(self._ids), slot, kind, command, data, time.monotonic() + delay)
+            self._add(timer)
+            return timer.to_dict()
+
+    def cancel(self, timer_id):
+        """Drop a timer without sending its command; its last state, or None"""
+        with self._lock:
+            timer = self._remove(timer_id)
+            return timer.to_dict() if timer else None
+
+    def cancel_slot(self, slot, kind):
+        """Drop a slot's timer of this kind (an explicit command overrides it)"""
+        with self._lock:
+            return self._remove(self._by_slot.get((slot, kind))) is not None
+
+    def all(self):
+        """Pending timers, soonest first"""
+        with self._lock:
+            return [timer.to_dict() for timer in sorted(self._timers.values(), key=lambda timer: timer.due_at)]
+
+    def _add(self, timer):
+        self._timers[timer.id] = timer
+        self._by_slot[(timer.slot, timer.kind)] = timer.id
+        heapq.heappush(self._heap, (timer.due_at, timer.id))
+        self._changed.notify_all()
+
+    def _remove(self, timer_id):
+        timer = self._timers.pop(timer_id, None)
+        if timer is not None and self._by_slot.get((timer.slot, timer.kind)) == timer_id:
+            del self._by_slot[(timer.slot, timer.kind)]
+        return timer
+
+    def _run(self):
+        with self._lock:
+            while self._running:
+                now = time.monotonic()
+                while self._heap and self._heap[0][0] <= now:
+                    due_at, timer_id = heapq.heappop(self._heap)
+                    timer = self._timers.get(timer_id)
+                    if timer is None or timer.due_at != due_at:
+                        continue  # Cancelled, replaced or rescheduled
+                    self._remove(timer_id)
+                    self._pool.submit(self._fire, timer)
+                self._changed.wait(self._heap[0][0] - now if self._heap else None)
+
+    def _fire(self, timer):
+        timer.attempts += 1
+        try:
+            result = self.run_action(timer.command, timer.data)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+
+        if result.get('success'):
+            self.fired += 1
+            log.info(f"⏱ Slot {timer.slot} {timer.kind} done", extra={'fields': {'timerId': timer.id}})
+            return
+
+        error = result.get('error', result.get('message', 'Unknown error'))
+        with self._lock:
+            if (timer.slot, timer.kind) in self._by_slot or not self._running:
+                return  # A newer timer for the slot has taken over, or shutting down
+            delay = min(RETRY_DELAYS[0] * 2 ** (timer.attempts - 1), RETRY_DELAYS[1])
+            timer.due_at = time.monotonic() + delay
+            self._add(timer)
+
+        fields = {'timerId': timer.id, 'attempts': timer.attempts, 'retryIn': delay}
+        if timer.attempts == ALERT_ATTEMPTS:
+            self.failed += 1
+            log.error(f"❌ Slot {timer.slot} {timer.kind} still failing, retrying: {error}", extra={'fields': fields})
+        else:
+            log.warning(f"⚠ Slot {timer.slot} {timer.kind} failed, retrying: {error}", extra={'fields': fields})
@@ -0,0 +1,199 @@
+"""
+Per-slot telemetry
+The boards push charging current per slot and the solar bus voltage about
+once a second ({"telemetry": {"v": mV, "i": [mA per slot]}}, see
+solar5.ino). Every sample is folded straight into 1 s, 1 min and 1 h
+rollups: each resolution is a fixed-size NumPy ring with one column per
+slot, so memory stays the same however long the bridge runs, and a
+sample costs a handful of vectorised updates rather than a Python loop.
+
+The newest row of each ring is the bucket still filling; older rows are
+overwritten once a ring wraps (1 h of seconds, a day of minutes, 30 days
+of hours). Buckets follow the wall clock, so if it steps back (NTP) the
+ring opens a new bucket rather than folding samples into a later one.
+
+A push without a bus voltage still counts towards the currents, but not
+towards voltage or power: those are averaged over the samples that had one.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+# name -> (bucket seconds, buckets kept)
+RESOLUTIONS = {
+    '1s': (1, 3600),
+    '1m': (60, 1440),
+    '1h': (3600, 720),
+}
+
+
+class Rollup:
+    """Ring of fixed-width time buckets, one column per slot"""
+
+    def __init__(self, seconds, capacity, columns):
+        self.seconds = seconds
+        self.capacity = capacity
+        self.start = np.zeros(capacity)
+        self.count = np.zeros((capacity, columns), np.uint32)
+        self.current_sum = np.zeros((capacity, columns))
+        self.current_min = np.zeros((capacity, columns), np.float32)
+        self.current_max = np.zeros((capacity, columns), np.float32)
+        self.voltage_count = np.zeros((capacity, columns), np.uint32)
+        self.voltage_sum = np.zeros((capacity, columns))
+        self.power_sum = np.zeros((capacity, columns))
+        self.head = -1  # Row of the bucket still filling
+        self.filled = 0
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.start, self.count, self.current_sum, self.current_min,
+                                              self.current_max, self.voltage_count, self.voltage_sum,
+                                              self.power_sum))
+
+    def add(self, when, columns, current, voltage):
+        """Fold one sample (arrays over `columns`, voltage None if missing) into its bucket"""
+        bucket = when - when % self.seconds
+        if self.head < 0 or bucket != self.start[self.head]:
+            self._open(bucket)
+        row = self.head
+        self.count[row, columns] += 1
+        self.current_sum[row, columns] += current
+        self.current_min[row, columns] = np.minimum(self.current_min[row, columns], current)
+        self.current_max[row, columns] = np.maximum(self.current_max[row, columns], current)
+        if voltage is not None:
+            self.voltage_count[row, columns] += 1
+            self.voltage_sum[row, columns] += voltage
+            self.power_sum[row, columns] += current * voltage / 1000  # mA * mV -> mW
+
+    def rows(self, since=None, limit=None):
+        """Ring rows oldest first, optionally from bucket start `since` on"""
+        rows = (self.head - self.filled + 1 + np.arange(self.filled)) % self.capacity
+        if since is not None:
+            rows = rows[self.start[rows] >= since - since % self.seconds]
+        return rows[-limit:] if limit else rows
+
+    def _open(self, bucket):
+        self.head = (self.head + 1) % self.capacity
+        self.filled = min(self.filled + 1, self.capacity)
+        self.start[self.head] = bucket
+        self.count[self.head] = 0
+        self.current_sum[self.head] = 0
+        self.current_min[self.head] = np.inf
+        self.current_max[self.head] = -np.inf
+        self.voltage_count[self.head] = 0
+        self.voltage_sum[self.head] = 0
+        self.power_sum[self.head] = 0
+
+
+class TelemetryStore:
+    """Rollups of every slot's samples, for /api/telemetry"""
+
+    def __init__(self, slots):
+        self.slots = sorted(slots)
+        self._columns = {slot: column for column, slot in enumerate(self.slots)}
+        self._lock = threading.Lock()
+        self._rollups = {name: Rollup(seconds, capacity, len(self.slots))
+                         for name, (seconds, capacity) in RESOLUTIONS.items()}
+        self._latest = {}  # slot -> (time, mA, mV or None)
+        self.samples = 0
+        self.samples_without_voltage = 0
+
+    def handle_message(self, message, first_slot=1):
+        """
+        SerialLink listener for a board's telemetry pushes; `first_slot` is
+        the kiosk slot of the board's slot 1 (see board_set.py)
+        """
+        telemetry = message.get('telemetry')
+        if isinstance(telemetry, dict):
+            self.add(first_slot, telemetry.get('i') or [], telemetry.get('v'))
+
+    def add(self, first_slot, currents, voltage, when=None):
+        """
+        One push: currents[n] is the board's slot n + 1 (None without a
+        sensor). `when` defaults to now, read under the lock so that pushes
+        from several boards reach the rollups in time order.
+        """
+        columns, values = [], []
+        for offset, current in enumerate(currents):
+            column = self._columns.get(first_slot + offset)
+            if column is not None and current is not None:
+                columns.append(column)
+                values.append(current)
+        if not columns:
+            return
+
+        columns = np.array(columns)
+        current = np.array(values, dtype=float)
+        voltage = None if voltage is None else float(voltage)
+        with self._lock:
+            if when is None:
+                when = time.time()
+            for rollup in self._rollups.values():
+                rollup.add(when, columns, current, voltage)
+            for column, value in zip(columns, values):
+                self._latest[self.slots[column]] = (when, value, voltage)
+            self.samples += 1
+            if voltage is None:
+                self.samples_without_voltage += 1
+
+    def query(self, resolution='1m', slots=None, since=None, limit=60):
+        """
+        Buckets of one resolution, column-wise: bucket start times, and per
+        slot the sample count, current mean/min/max (mA), the count of
+        samples with a voltage, mean voltage (mV) and mean power (mW). null
+        where a slot had no samples.
+        """
+        if resolution not in self._rollups:
+            raise ValueError(f"Resolution must be one of {', '.join(RESOLUTIONS)}")
+        rollup = self._rollups[resolution]
+        slots = [slot for slot in (slots or self.slots) if slot in self._columns]
+
+        with self._lock:
+            rows = rollup.rows(since, max(1, min(limit, rollup.capacity)))
+            starts = rollup.start[rows].tolist()
+            series = {}
+            for slot in slots:
+                column = self._columns[slot]
+                count = rollup.count[rows, column]
+                voltage_count = rollup.voltage_count[rows, column]
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    series[str(slot)] = {
+                        'samples': count.tolist(),
+                        'currentMa': {
+                            'mean': _values(rollup.current_sum[rows, column] / count),
+                            'min': _values(rollup.current_min[rows, column], count),
+                            'max': _values(rollup.current_max[rows, column], count),
+                        },
+                        'voltageSamples': voltage_count.tolist(),
+                        'voltageMv': _values(rollup.voltage_sum[rows, column] / voltage_count),
+                        'powerMw': _values(rollup.power_sum[rows, column] / voltage_count),
+                    }
+            latest = {str(slot): {'time': when, 'currentMa': current, 'voltageMv': _value(voltage)}
+                      for slot, (when, current, voltage) in sorted(self._latest.items()) if slot in slots}
+
+        return {
+            'resolution': resolution,
+            'bucketSeconds': rollup.seconds,
+            'start': starts,
+            'slots': series,
+            'latest': latest,
+            'samples': self.samples,
+            'samplesWithoutVoltage': self.samples_without_voltage,
+            'bufferBytes': self.nbytes,
+        }
+
+    @property
+    def nbytes(self):
+        return sum(rollup.nbytes for rollup in self._rollups.values())
+
+
+def _values(array, count=None):
+    """JSON-ready rounded values, None where there is no data"""
+    valid = np.isfinite(array) if count is None else (count > 0) & np.isfinite(array)
+    return [round(float(value), 1) if ok else None for value, ok in zip(array, valid)]
+
+
+def _value(value):
+    return None if value is None or value != value else value
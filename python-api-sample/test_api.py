@@ -7,7 +7,7 @@ import requests
 import json
 import time
 
-BASE_URL = "http://localhost:5000"
+BASE_URL = "http://localhost:8000"
 
 def print_header(text):
     print("\n" + "="*50)
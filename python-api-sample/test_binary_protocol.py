@@ -0,0 +1,79 @@
+"""Binary frame encoding and decoding (binary_protocol.py)"""
+
+import struct
+
+import pytest
+
+import binary_protocol
+
+
+def payload_of(frame):
+    """The payload of a whole frame, checking its header and CRC"""
+    assert frame[0] == binary_protocol.FRAME_START
+    length = frame[1]
+    assert len(frame) == length + 3
+    assert binary_protocol.crc8(frame[1:-1]) == frame[-1]
+    return frame[2:-1]
+
+
+@pytest.mark.parametrize('command, data', [
+    ('RELAY', {'slot': 3, 'state': True}),
+    ('RELAY', {'slot': 16, 'state': False}),
+    ('UV_LIGHT', {'slot': 7, 'state': True}),
+    ('SOLENOID', {'slot': 9, 'lock': True}),
+    ('SOLENOID', {'slot': 9, 'lock': False, 'duration': 30}),
+    ('READ_COIN', {}),
+])
+def test_command_round_trip(command, data):
+    frame = binary_protocol.encode_command(command, data, 513)
+    assert binary_protocol.decode_command(payload_of(frame)) == (command, data, 513)
+
+
+@pytest.mark.parametrize('duration', [1, 255, 256, 3600, binary_protocol.MAX_DURATION])
+def test_solenoid_duration_is_not_truncated(duration):
+    frame = binary_protocol.encode_command('SOLENOID', {'slot': 7, 'lock': False, 'duration': duration}, 1)
+    _, data, _ = binary_protocol.decode_command(payload_of(frame))
+    assert data['duration'] == duration
+
+
+@pytest.mark.parametrize('duration', [binary_protocol.MAX_DURATION + 1, 86400, -1])
+def test_solenoid_duration_out_of_range_falls_back_to_json(duration):
+    data = {'slot': 7, 'lock': False, 'duration': duration}
+    assert binary_protocol.encode_command('SOLENOID', data, 1) is None
+
+
+def test_commands_without_opcode_stay_json():
+    assert binary_protocol.encode_command('FINGERPRINT_VERIFY', {'slot': 1}, 1) is None
+    assert not binary_protocol.supports('BATCH')
+
+
+def reply_frame(command, seq, code, extra=b''):
+    opcode = binary_protocol.OPCODES[command] | binary_protocol.REPLY_FLAG
+    return binary_protocol.frame(struct.pack('<BHB', opcode, seq, code) + extra)
+
+
+def test_decode_replies():
+    buffer = reply_frame('RELAY', 42, binary_protocol.RESULT_OK)
+    assert binary_protocol.decode_frame(buffer) == (
+        {'success': True, 'message': 'Relay controlled', 'seq': 42}, len(buffer))
+
+    buffer = reply_frame('SOLENOID', 7, binary_protocol.RESULT_UNSUPPORTED_SLOT)
+    message, _ = binary_protocol.decode_frame(buffer)
+    assert message == {'success': False, 'message': 'Slot does not support solenoid control', 'seq': 7}
+
+    buffer = reply_frame('READ_COIN', 9, binary_protocol.RESULT_OK, struct.pack('<HI', 500, 123456))
+    message, _ = binary_protocol.decode_frame(buffer)
+    assert message == {'success': True, 'value': 5.0, 'timestamp': 123456, 'seq': 9}
+
+
+def test_decode_incomplete_and_corrupt_frames():
+    buffer = reply_frame('RELAY', 1, binary_protocol.RESULT_OK)
+    assert binary_protocol.decode_frame(buffer[:1]) == (binary_protocol.NEED_MORE, 0)
+    assert binary_protocol.decode_frame(buffer[:-1]) == (binary_protocol.NEED_MORE, 0)
+
+    corrupt = buffer[:-1] + bytes([buffer[-1] ^ 0xFF])
+    assert binary_protocol.decode_frame(corrupt) == (binary_protocol.BAD_FRAME, 1)
+
+    # A command frame is not a reply
+    command = binary_protocol.encode_command('RELAY', {'slot': 1, 'state': True}, 1)
+    assert binary_protocol.decode_frame(command) == (binary_protocol.BAD_FRAME, 1)
@@ -0,0 +1,25 @@
+"""Which commands may be re-sent after a reconnect (board_connection.py)"""
+
+import pytest
+
+from board_connection import is_idempotent
+
+
+@pytest.mark.parametrize('command, data, expected', [
+    ('RELAY', {'slot': 1, 'state': True}, True),
+    ('UV_LIGHT', {'slot': 7, 'state': False}, True),
+    ('PING', {}, True),
+    ('FINGERPRINT_DELETE', {'id': 3}, True),
+    ('FINGERPRINT_EMPTY', {}, True),
+    ('SOLENOID', {'slot': 1, 'lock': True}, True),
+    ('SOLENOID', {'slot': 1, 'lock': False}, False),
+    ('SOLENOID', {'slot': 1, 'lock': False, 'duration': 10}, False),
+    ('UNLOCK_TEMP', {'slot': 1}, False),
+    ('READ_COIN', {}, False),
+    ('FINGERPRINT_ENROLL', {'id': 3}, False),
+    ('BATCH', {'ops': [['RELAY', 1, False], ['UV_LIGHT', 7, False], ['SOLENOID', 2, True]]}, True),
+    ('BATCH', {'ops': [['RELAY', 1, False], ['SOLENOID', 2, False]]}, False),
+    ('BATCH', {'ops': [['UNLOCK_TEMP', 2]]}, False),
+])
+def test_is_idempotent(command, data, expected):
+    assert is_idempotent(command, data) is expected
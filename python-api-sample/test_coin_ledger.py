@@ -0,0 +1,78 @@
+"""Coin ledger deduplication and persistence (coin_ledger.py)"""
+
+import pytest
+
+from coin_events import CoinEventHub
+from coin_ledger import CoinLedger
+
+
+@pytest.fixture
+def ledger_path(tmp_path):
+    return str(tmp_path / 'coins.db')
+
+
+@pytest.fixture
+def ledger(ledger_path):
+    ledger = CoinLedger(ledger_path)
+    yield ledger
+    ledger.close()
+
+
+def test_repeated_push_is_recorded_once(ledger):
+    assert ledger.record('a', 5.0, 1000)['id'] == 1
+    assert ledger.record('a', 5.0, 1000) is None
+    assert ledger.record('a', 10.0, 2000)['id'] == 2
+    assert ledger.duplicates == 1
+
+    # Board timestamps are per board
+    assert ledger.record('b', 5.0, 1000)['id'] == 3
+
+
+def test_board_reset_starts_a_new_boot(ledger):
+    ledger.record('a', 5.0, 1000)
+    ledger.record('a', 5.0, 2000)
+    # millis() restarted: the same timestamps are new coins now
+    assert ledger.record('a', 1.0, 500)['id'] == 3
+    assert ledger.record('a', 1.0, 1000)['id'] == 4
+    assert ledger.record('a', 1.0, 1000) is None
+    ledger.flush()
+
+    assert [entry['timestamp'] for entry in ledger.since(0)] == [1000, 2000, 500, 1000]
+
+
+def test_dedup_survives_a_bridge_restart(ledger_path):
+    ledger = CoinLedger(ledger_path)
+    ledger.record('a', 5.0, 1000)
+    ledger.record('a', 1.0, 500)  # Second boot
+    ledger.close()
+
+    ledger = CoinLedger(ledger_path)
+    try:
+        assert ledger.last_id == 2
+        # The push seen just before the restart, sent again
+        assert ledger.record('a', 1.0, 500) is None
+        assert ledger.record('a', 1.0, 800)['id'] == 3
+        ledger.flush()
+        assert len(ledger.since(0)) == 3
+    finally:
+        ledger.close()
+
+
+def test_since_includes_queued_coins(ledger):
+    ledger.record('a', 5.0, 1000)
+    ledger.flush()
+    ledger.record('a', 10.0, 2000)  # Not committed yet
+    assert [entry['id'] for entry in ledger.since(0)] == [1, 2]
+    assert [entry['id'] for entry in ledger.since(1)] == [2]
+
+
+def test_hub_numbers_events_from_the_ledger(ledger):
+    hub = CoinEventHub(ledger=ledger)
+    assert hub.publish(5.0, 1000, board='a').id == 1
+    assert hub.publish(5.0, 1000, board='a') is None
+    assert hub.publish(1.0, 300, board='a').id == 2  # Board reset
+
+    assert [event.id for event in hub.history_since(0)] == [1, 2]
+    assert hub.claim().id == 1
+    assert hub.claim().id == 2
+    assert hub.claim() is None
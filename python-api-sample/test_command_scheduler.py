@@ -0,0 +1,146 @@
+"""Command classes and admission (command_scheduler.py)"""
+
+import threading
+import time
+
+import pytest
+
+from command_scheduler import (ACTUATOR, COIN, FINGERPRINT, SAFETY, CommandScheduler, DeadlineExceeded,
+                               Overloaded, classify)
+
+
+@pytest.mark.parametrize('command, data, expected', [
+    ('SOLENOID', {'slot': 1, 'lock': True}, SAFETY),
+    ('SOLENOID', {'slot': 1, 'lock': False, 'duration': 10}, SAFETY),
+    ('UNLOCK_TEMP', {'slot': 1}, SAFETY),
+    ('RELAY', {'slot': 1, 'state': True}, ACTUATOR),
+    ('UV_LIGHT', {'slot': 7, 'state': True}, ACTUATOR),
+    ('BATCH', {'ops': [['RELAY', 1, False], ['UV_LIGHT', 7, False]]}, ACTUATOR),
+    ('BATCH', {'ops': [['RELAY', 1, False], ['SOLENOID', 2, True]]}, SAFETY),
+    ('READ_COIN', {}, COIN),
+    ('FINGERPRINT_VERIFY', {'slot': 1}, FINGERPRINT),
+    ('FINGERPRINT_ENROLL', {'id': 3}, FINGERPRINT),
+    ('PING', {}, ACTUATOR),
+])
+def test_classify(command, data, expected):
+    assert classify(command, data) == expected
+
+
+class HeldLink:
+    """A link whose requests block until released, recording their order"""
+
+    def __init__(self):
+        self.sent = []
+        self.release = threading.Event()
+
+    def request(self, command, data, timeout=10, on_update=None):
+        self.sent.append(command)
+        self.release.wait(5)
+        return {'success': True}, []
+
+
+def run(scheduler, command, data, errors=None, **kwargs):
+    """execute() in a thread; what it raises is appended to `errors`"""
+    def target():
+        try:
+            scheduler.execute(command, data, **kwargs)
+        except DeadlineExceeded as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 2
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def queued(scheduler, command_class):
+    return scheduler.queue_stats()[command_class]['queued']
+
+
+def test_full_queue_is_rejected():
+    link = HeldLink()
+    scheduler = CommandScheduler(link, queue_limits={COIN: 1})
+    threads = [run(scheduler, 'READ_COIN', {})]
+    wait_for(lambda: link.sent)
+    threads.append(run(scheduler, 'READ_COIN', {}))
+    wait_for(lambda: queued(scheduler, COIN) == 1)
+
+    with pytest.raises(Overloaded):
+        scheduler.execute('READ_COIN', {})
+    assert scheduler.queue_stats()[COIN]['rejected'] == 1
+
+    link.release.set()
+    for thread in threads:
+        thread.join(2)
+    assert link.sent == ['READ_COIN', 'READ_COIN']
+
+
+def test_backlog_longer_than_deadline_is_rejected():
+    link = HeldLink()
+    scheduler = CommandScheduler(link)
+    thread = run(scheduler, 'FINGERPRINT_VERIFY', {'slot': 1})
+    wait_for(lambda: link.sent)
+
+    # The sensor is taken for about DEFAULT_SERVICE_TIMES[FINGERPRINT] (5 s)
+    with pytest.raises(Overloaded) as error:
+        scheduler.execute('FINGERPRINT_VERIFY', {'slot': 2}, deadline=1)
+    assert isinstance(error.value, DeadlineExceeded)
+    assert error.value.retry_after > 0
+
+    link.release.set()
+    thread.join(2)
+
+
+def test_safety_is_never_shed():
+    link = HeldLink()
+    scheduler = CommandScheduler(link)
+    thread = run(scheduler, 'RELAY', {'slot': 1, 'state': True})
+    wait_for(lambda: link.sent)
+
+    # Shorter than the backlog: anything else would be turned away at once;
+    # a re-lock is queued and only gives up when its deadline has passed
+    errors = []
+    run(scheduler, 'SOLENOID', {'slot': 2, 'lock': True}, errors, deadline=0.01).join(2)
+    assert [type(error) for error in errors] == [DeadlineExceeded]
+    assert scheduler.queue_stats()[SAFETY]['rejected'] == 0
+    assert scheduler.queue_stats()[SAFETY]['expired'] == 1
+
+    link.release.set()
+    thread.join(2)
+
+
+def test_safety_goes_first():
+    link = HeldLink()
+    scheduler = CommandScheduler(link)
+    threads = [run(scheduler, 'RELAY', {'slot': 1, 'state': True})]
+    wait_for(lambda: link.sent)
+    threads.append(run(scheduler, 'RELAY', {'slot': 2, 'state': True}))
+    wait_for(lambda: queued(scheduler, ACTUATOR) == 1)
+    for slot in (3, 4, 5):
+        threads.append(run(scheduler, 'SOLENOID', {'slot': slot, 'lock': True}))
+    wait_for(lambda: queued(scheduler, SAFETY) == 3)
+
+    link.release.set()
+    for thread in threads:
+        thread.join(2)
+    assert link.sent == ['RELAY', 'SOLENOID', 'SOLENOID', 'SOLENOID', 'RELAY']
+
+
+def test_fingerprint_jobs_do_not_block_short_commands():
+    link = HeldLink()
+    scheduler = CommandScheduler(link)
+    threads = [run(scheduler, 'FINGERPRINT_VERIFY', {'slot': 1})]
+    wait_for(lambda: link.sent)
+    threads.append(run(scheduler, 'READ_COIN', {}))
+    wait_for(lambda: len(link.sent) == 2)
+
+    link.release.set()
+    for thread in threads:
+        thread.join(2)
+    assert link.sent == ['FINGERPRINT_VERIFY', 'READ_COIN']
@@ -9,7 +9,7 @@ import json
 import time
 import sys
 
-BASE_URL = "http://localhost:5000"
+BASE_URL = "http://localhost:8000"
 
 def enroll_fingerprint(fingerprint_id):
     """
@@ -0,0 +1,78 @@
+"""Telemetry rollups (telemetry.py)"""
+
+import numpy as np
+
+from telemetry import Rollup, TelemetryStore
+
+
+def add(rollup, when, current, voltage=12000.0):
+    rollup.add(when, np.array([0]), np.array([float(current)]), voltage)
+
+
+def test_samples_share_a_bucket():
+    rollup = Rollup(60, 4, 1)
+    add(rollup, 120.0, 100)
+    add(rollup, 150.0, 300)
+    rows = rollup.rows()
+    assert rollup.start[rows].tolist() == [120.0]
+    assert rollup.count[rows, 0].tolist() == [2]
+    assert rollup.current_sum[rows, 0].tolist() == [400.0]
+    assert rollup.current_min[rows, 0].tolist() == [100.0]
+    assert rollup.current_max[rows, 0].tolist() == [300.0]
+
+
+def test_ring_wraps_and_keeps_the_newest_buckets():
+    rollup = Rollup(1, 4, 1)
+    for second in range(10):
+        add(rollup, float(second), second)
+
+    rows = rollup.rows()
+    assert rollup.filled == 4
+    assert rollup.start[rows].tolist() == [6.0, 7.0, 8.0, 9.0]
+    assert rollup.current_sum[rows, 0].tolist() == [6.0, 7.0, 8.0, 9.0]
+    assert rollup.start[rollup.rows(since=8)].tolist() == [8.0, 9.0]
+    assert rollup.start[rollup.rows(limit=3)].tolist() == [7.0, 8.0, 9.0]
+
+    # A reused row starts empty
+    assert rollup.count[rows, 0].tolist() == [1, 1, 1, 1]
+
+
+def test_clock_step_back_opens_a_new_bucket():
+    rollup = Rollup(1, 8, 1)
+    add(rollup, 100.2, 10)
+    add(rollup, 101.5, 20)
+    add(rollup, 95.0, 30)  # Wall clock stepped back
+    add(rollup, 95.5, 40)
+
+    rows = rollup.rows()
+    assert rollup.start[rows].tolist() == [100.0, 101.0, 95.0]
+    assert rollup.current_sum[rows, 0].tolist() == [10.0, 20.0, 70.0]
+
+
+def test_missing_voltage_leaves_voltage_and_power_alone():
+    store = TelemetryStore([1, 2])
+    store.add(1, [1000, 500], 12000, when=60.0)
+    store.add(1, [3000, None], None, when=61.0)
+
+    result = store.query('1m', limit=1)
+    slot = result['slots']['1']
+    assert slot['samples'] == [2]
+    assert slot['currentMa']['mean'] == [2000.0]
+    assert slot['voltageSamples'] == [1]
+    assert slot['voltageMv'] == [12000.0]
+    assert slot['powerMw'] == [12000.0]
+    assert result['slots']['2']['voltageMv'] == [12000.0]
+    assert result['samples'] == 2
+    assert result['samplesWithoutVoltage'] == 1
+    assert result['latest']['1']['voltageMv'] is None
+
+
+def test_query_maps_board_slots_to_kiosk_slots():
+    store = TelemetryStore(range(1, 33))
+    store.add(17, [250, None, 750], 12000, when=0.0)  # A second board driving slots 17-32
+
+    result = store.query('1s', slots=[17, 18, 19], limit=1)
+    assert result['slots']['17']['currentMa']['mean'] == [250.0]
+    assert result['slots']['18']['samples'] == [0]
+    assert result['slots']['18']['currentMa']['mean'] == [None]
+    assert result['slots']['19']['currentMa']['mean'] == [750.0]
@@ -0,0 +1,45 @@
+"""Splitting timed commands into a board command and a follow-up (app.py)"""
+
+import os
+
+import pytest
+
+# app.py attaches to a board at import: give it none (simulation mode) and
+# keep the kiosk's coin ledger out of it
+os.environ.pop('BROKER_SOCKET', None)
+os.environ['ARDUINO_PORT'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'no-arduino')
+os.environ['COIN_LEDGER'] = ':memory:'
+
+app = pytest.importorskip('app')
+
+
+def test_timed_unlock_keeps_its_duration_and_schedules_a_relock():
+    command, data, timer = app.split_timed_command('SOLENOID', {'slot': 7, 'lock': False, 'duration': 300})
+    assert (command, data) == ('SOLENOID', {'slot': 7, 'lock': False, 'duration': 300})
+    assert timer == (app.RELOCK, 300, 'SOLENOID', {'slot': 7, 'lock': True})
+
+
+def test_plain_lock_and_unlock_have_no_timer():
+    assert app.split_timed_command('SOLENOID', {'slot': 7, 'lock': True}) == (
+        'SOLENOID', {'slot': 7, 'lock': True, 'duration': 0}, None)
+    assert app.split_timed_command('SOLENOID', {'slot': 7, 'lock': False, 'duration': 0})[2] is None
+
+
+def test_temporary_unlock_schedules_a_relock():
+    command, data, timer = app.split_timed_command('UNLOCK_TEMP', {'slot': 3})
+    assert (command, data) == ('UNLOCK_TEMP', {'slot': 3})
+    assert timer == (app.RELOCK, app.TEMP_UNLOCK_SECONDS, 'SOLENOID', {'slot': 3, 'lock': True})
+
+
+def test_uv_cycle_goes_out_as_plain_uv_on():
+    command, data, timer = app.split_timed_command('UV_LIGHT', {'slot': 7, 'state': True, 'duration': 60})
+    assert (command, data) == ('UV_LIGHT', {'slot': 7, 'state': True})
+    assert timer == (app.UV_OFF, 60, 'UV_LIGHT', {'slot': 7, 'state': False})
+
+    assert app.split_timed_command('UV_LIGHT', {'slot': 7, 'state': False, 'duration': 60}) == (
+        'UV_LIGHT', {'slot': 7, 'state': False}, None)
+
+
+def test_other_commands_pass_through():
+    data = {'slot': 1, 'state': True}
+    assert app.split_timed_command('RELAY', data) == ('RELAY', data, None)